@@ -0,0 +1,323 @@
+"""Benchmark hot path of power usage sampling against stored baselines.
+
+RAPL powercap trees with 1 to 8 sockets and process populations of 10 to 10,000
+processes are synthesized in a temporary directory so that it runs on any Linux
+host without RAPL hardware. filter_rapl_domains, get_rapl_counters, get_cpu_share
+and get_power_usage are timed in each measurement scope. Latency percentiles and
+peak memory allocated per call are compared with a baseline and the run fails if
+any case regressed by more than the tolerance.
+
+Latencies depend on the host, so a calibration loop of Python work and procfs
+reads is timed along with the cases and baseline latencies are scaled by ratio
+of calibration latency of this run to the one stored with the baseline.
+
+Usage:
+    python benchmarks/bench_hot_path.py
+    python benchmarks/bench_hot_path.py --max-procs 1000 -k get_cpu_share
+    python benchmarks/bench_hot_path.py --save-baseline
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import psutil
+from synthetic import make_cgroup_tree
+from synthetic import make_procfs_tree
+from synthetic import make_rapl_tree
+from synthetic import PACKAGE_MAX_ENERGY_UJ
+from synthetic import SERVER_PID
+from synthetic import SERVER_UID
+from synthetic import write_counters
+
+from jupyter_power_usage import utils
+from jupyter_power_usage.metrics import CpuPowerUsage
+
+# Default path of stored baselines
+DEFAULT_BASELINE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'baselines', 'hot_path.json'
+)
+
+SOCKETS = (1, 2, 4, 8)
+PROCS = (10, 100, 1000, 10000)
+SCOPES = ('process', 'user', 'cgroup', 'sys')
+
+# Latency percentiles reported for each case. Only median latency is stable
+# enough to be compared with baseline
+PERCENTILES = (50, 90, 99)
+CHECKED_PERCENTILES = (50,)
+
+# Number of calls made with allocation tracing
+ALLOC_REPEAT = 5
+
+# Latency regressions smaller than this in us are ignored as noise
+LATENCY_FLOOR_US = 20
+
+# Allocation regressions smaller than this in bytes are ignored
+ALLOC_FLOOR_BYTES = 4096
+
+# Key of calibration latency in baseline file
+CALIBRATION_KEY = '_calibration'
+
+
+def percentile(values, q):
+    """Nearest rank percentile of sorted values"""
+    return values[min(int(len(values) * q / 100), len(values) - 1)]
+
+
+def measure(func, repeat, setup=None):
+    """Time func and trace its allocations. setup is called before each call
+    and it is not timed. Returns latency percentiles in us and peak allocated
+    bytes per call"""
+    for _ in range(3):
+        if setup:
+            setup()
+        func()
+
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter_ns()
+        func()
+        timings.append((time.perf_counter_ns() - start) / 1e3)
+    timings.sort()
+
+    # Allocations are traced in a separate pass as tracing slows down calls
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(ALLOC_REPEAT):
+            if setup:
+                setup()
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            func()
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    finally:
+        tracemalloc.stop()
+
+    result = {f'p{q}': round(percentile(timings, q), 1) for q in PERCENTILES}
+    result['alloc'] = max(peaks)
+    return result
+
+
+def make_cpu_power_usage(scope):
+    """Make CpuPowerUsage in given measurement scope on synthetic trees"""
+    config = SimpleNamespace(
+        measurement_scope=scope,
+        memory_accounting='meminfo',
+        sampling_period=1000,
+        collector_socket='',
+    )
+    server_app = SimpleNamespace(
+        log=logging.getLogger(__name__),
+        web_app=SimpleNamespace(settings={'jupyter_power_usage_config': config}),
+    )
+    return CpuPowerUsage(server_app)
+
+
+def get_scope_pids(cpu_power_usage, scope):
+    """Get pids of measurement scope as sampler does"""
+    process_table = cpu_power_usage.process_table
+    process_table.scan()
+    if scope == 'process':
+        return process_table.descendants(SERVER_PID)
+    if scope == 'user':
+        return process_table.user_pids(SERVER_UID)
+    return []
+
+
+def make_overflow_setup(counters):
+    """Make a setup that alternates counters around their maximum so that every
+    other reading overflows"""
+    values = [PACKAGE_MAX_ENERGY_UJ - 1000000, 1000000]
+    state = {'i': 0}
+
+    def setup():
+        write_counters(counters, values[state['i'] % 2])
+        state['i'] += 1
+
+    return setup
+
+
+def rapl_cases(root, repeat):
+    """Yield RAPL discovery and counter reads cases for each number of sockets"""
+    for num_sockets in SOCKETS:
+        for dram in (True, False):
+            rapl_dir = os.path.join(root, f'rapl-{num_sockets}-{dram}')
+            make_rapl_tree(rapl_dir, num_sockets, dram=dram)
+            utils.RAPL_API_DIR = rapl_dir
+            name = f'sockets={num_sockets},dram={dram}'
+            yield f'filter_rapl_domains[{name}]', lambda: measure(
+                utils.filter_rapl_domains, repeat
+            )
+            if dram:
+                cpu_power_usage = make_cpu_power_usage('sys')
+                yield f'get_rapl_counters[{name}]', lambda: measure(
+                    cpu_power_usage.get_rapl_counters, repeat
+                )
+
+
+def share_cases(root, repeat, max_procs, num_sockets=2):
+    """Yield CPU share and power usage cases in each scope for each population"""
+    rapl_dir = os.path.join(root, 'rapl')
+    counters = make_rapl_tree(rapl_dir, num_sockets)
+    utils.RAPL_API_DIR = rapl_dir
+    utils.CGROUP_API_DIR = os.path.join(root, 'cgroup')
+    utils.PROC_CGROUP_FILE = os.path.join(root, 'proc-cgroup')
+    make_cgroup_tree(utils.CGROUP_API_DIR, utils.PROC_CGROUP_FILE)
+
+    for num_procs in PROCS:
+        if num_procs > max_procs:
+            continue
+        procfs_dir = os.path.join(root, f'proc-{num_procs}')
+        make_procfs_tree(procfs_dir, num_procs)
+        psutil.PROCFS_PATH = procfs_dir
+        utils.PROCFS_DIR = procfs_dir
+
+        for scope in SCOPES:
+            name = f'scope={scope},procs={num_procs}'
+            cpu_power_usage = make_cpu_power_usage(scope)
+            pids = get_scope_pids(cpu_power_usage, scope)
+            yield f'get_cpu_share[{name}]', lambda: measure(
+                lambda: cpu_power_usage.get_cpu_share(pids), repeat
+            )
+            yield f'get_power_usage[{name}]', lambda: measure(
+                lambda: cpu_power_usage.get_power_usage(pids), repeat
+            )
+            yield f'get_power_usage[{name},overflow]', lambda: measure(
+                lambda: cpu_power_usage.get_power_usage(pids),
+                repeat,
+                setup=make_overflow_setup(counters),
+            )
+        write_counters(counters, 1000000)
+
+
+def calibration_loop():
+    """Fixed mix of Python work and procfs reads similar to the hot path"""
+    total = 0
+    for i in range(2000):
+        total += int(str(i * 7))
+    for _ in range(20):
+        with open('/proc/self/stat', 'rb') as f:
+            total += len(f.read().split())
+    return total
+
+
+def calibrate(repeat):
+    """Get median latency of calibration loop in us"""
+    return measure(calibration_loop, repeat)['p50']
+
+
+def compare(name, result, baseline, tolerance, alloc_tolerance, scale=1):
+    """Return list of regressions of a case against its baseline. Baseline
+    latencies are multiplied by scale of this host relative to baseline host"""
+    regressions = []
+    for q in CHECKED_PERCENTILES:
+        key = f'p{q}'
+        expected = baseline[key] * scale
+        limit = expected * (1 + tolerance)
+        if result[key] > max(limit, expected + LATENCY_FLOOR_US):
+            regressions.append(
+                f'{name}: {key} {result[key]:.1f} us > {expected:.1f} us'
+            )
+    limit = baseline['alloc'] * (1 + alloc_tolerance)
+    if result['alloc'] > max(limit, baseline['alloc'] + ALLOC_FLOOR_BYTES):
+        regressions.append(f'{name}: alloc {result["alloc"]} B > {baseline["alloc"]} B')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--repeat', type=int, default=50, help='Repetitions')
+    parser.add_argument(
+        '--max-procs', type=int, default=max(PROCS), help='Largest population'
+    )
+    parser.add_argument('-k', default='', help='Only run cases containing this')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline file')
+    parser.add_argument(
+        '--save-baseline', action='store_true', help='Store results as baseline'
+    )
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=1.0,
+        help='Allowed relative latency regression',
+    )
+    parser.add_argument(
+        '--alloc-tolerance',
+        type=float,
+        default=0.2,
+        help='Allowed relative allocation regression',
+    )
+    args = parser.parse_args()
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baselines = json.load(f)
+
+    calibration = calibrate(args.repeat)
+    scale = 1
+    if CALIBRATION_KEY in baselines:
+        scale = calibration / baselines[CALIBRATION_KEY]['p50']
+    print(f'Calibration: {calibration:.1f} us (x{scale:.2f} of baseline host)\n')
+
+    results = {}
+    regressions = []
+    print(f'{"case":<56}' + ''.join(f'{f"p{q} (us)":>12}' for q in PERCENTILES), end='')
+    print(f'{"alloc (B)":>12}')
+    with tempfile.TemporaryDirectory() as root:
+        # Each case sets up synthetic trees before it is yielded and it is only
+        # run if it matches the filter
+        cases = itertools.chain(
+            rapl_cases(root, args.repeat),
+            share_cases(root, args.repeat, args.max_procs),
+        )
+        for name, run in cases:
+            if args.k not in name:
+                continue
+            result = results[name] = run()
+            print(
+                f'{name:<56}'
+                + ''.join(f'{result[f"p{q}"]:>12.1f}' for q in PERCENTILES)
+                + f'{result["alloc"]:>12}'
+            )
+            if name in baselines:
+                regressions += compare(
+                    name,
+                    result,
+                    baselines[name],
+                    args.tolerance,
+                    args.alloc_tolerance,
+                    scale,
+                )
+
+    if args.save_baseline:
+        results[CALIBRATION_KEY] = {'p50': calibration}
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump({**baselines, **results}, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f'Baseline stored in {args.baseline}')
+        return
+
+    if regressions:
+        print('\nRegressions against baseline:')
+        for regression in regressions:
+            print(f'  {regression}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Benchmark cost of CPU and memory share computation for each memory accounting
+method.
+
+It spawns a number of idle processes on the host to mimic a busy node and times
+CpuPowerUsage.get_cpu_share() in process scope against a fake RAPL tree.
+
+Usage:
+    python benchmarks/bench_memory_share.py --procs 2000 --repeat 20
+"""
+
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+from jupyter_power_usage import utils
+from jupyter_power_usage.metrics import CpuPowerUsage
+
+
+def make_rapl_tree(root):
+    """Make a fake RAPL tree with single package"""
+    package_path = os.path.join(root, 'intel-rapl:0')
+    os.makedirs(package_path)
+    for name, value in (
+        ('name', 'package-0'),
+        ('energy_uj', 1000000),
+        ('max_energy_range_uj', 262143328850),
+    ):
+        with open(os.path.join(package_path, name), 'w') as f:
+            f.write(f'{value}\n')
+
+
+def make_cpu_power_usage(memory_accounting):
+    """Make CpuPowerUsage in process scope with given memory accounting"""
+    config = SimpleNamespace(
+        measurement_scope='process',
+        memory_accounting=memory_accounting,
+        sampling_period=1000,
+        collector_socket='',
+    )
+    server_app = SimpleNamespace(
+        log=logging.getLogger(__name__),
+        web_app=SimpleNamespace(settings={'jupyter_power_usage_config': config}),
+    )
+    return CpuPowerUsage(server_app)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--procs', type=int, default=500, help='Idle processes')
+    parser.add_argument('--repeat', type=int, default=20, help='Repetitions')
+    args = parser.parse_args()
+
+    # Spawn idle processes that are not part of current scope
+    procs = [
+        subprocess.Popen(
+            [sys.executable, '-c', 'import time; time.sleep(3600)'],
+            start_new_session=True,
+        )
+        for _ in range(args.procs)
+    ]
+    try:
+        with tempfile.TemporaryDirectory() as root:
+            make_rapl_tree(root)
+            utils.RAPL_API_DIR = root
+
+            print(f'{len(procs) + 1} processes spawned, {args.repeat} repetitions')
+            print(f'{"memory_accounting":<20}{"mean (ms)":>12}{"max (ms)":>12}')
+            pids = [os.getpid()]
+            for memory_accounting in ('rss', 'meminfo', 'pss'):
+                cpu_power_usage = make_cpu_power_usage(memory_accounting)
+                timings = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    cpu_power_usage.get_cpu_share(pids)
+                    timings.append((time.perf_counter() - start) * 1e3)
+                    # Make sure cached meminfo is not reused between samples
+                    time.sleep(0.11)
+                print(
+                    f'{memory_accounting:<20}'
+                    f'{sum(timings) / len(timings):>12.3f}'
+                    f'{max(timings):>12.3f}'
+                )
+    finally:
+        for proc in procs:
+            proc.kill()
+            proc.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Benchmark startup cost of power usage backends.
+
+It times construction of CpuPowerUsage against a fake RAPL tree when RAPL domains
+are discovered eagerly, when they are reused from the topology cache and when
+discovery is deferred to the sampler. Import time of the extension is measured
+in a fresh interpreter. The run fails if importing the extension imports numpy, which is
+only needed once the extension is loaded.
+
+Usage:
+    python benchmarks/bench_startup.py --sockets 2 --repeat 20
+"""
+
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+from jupyter_power_usage import utils
+from jupyter_power_usage.metrics import CpuPowerUsage
+
+
+def make_rapl_tree(root, num_sockets):
+    """Make a fake RAPL tree with a package and DRAM domain per socket"""
+    for i_soc in range(num_sockets):
+        package_path = os.path.join(root, f'intel-rapl:{i_soc}')
+        domain_path = os.path.join(package_path, f'intel-rapl:{i_soc}:0')
+        os.makedirs(domain_path)
+        for path, name in ((package_path, f'package-{i_soc}'), (domain_path, 'dram')):
+            for file_name, value in (
+                ('name', name),
+                ('energy_uj', 1000000),
+                ('max_energy_range_uj', 262143328850),
+                ('constraint_0_power_limit_uw', 150000000),
+            ):
+                with open(os.path.join(path, file_name), 'w') as f:
+                    f.write(f'{value}\n')
+
+
+def make_server_app():
+    """Make a minimal server app in system measurement scope"""
+    config = SimpleNamespace(
+        measurement_scope='sys',
+        memory_accounting='meminfo',
+        sampling_period=1000,
+        collector_socket='',
+    )
+    return SimpleNamespace(
+        log=logging.getLogger(__name__),
+        web_app=SimpleNamespace(settings={'jupyter_power_usage_config': config}),
+    )
+
+
+def timeit(func, repeat):
+    """Return mean and max time in ms of calling func"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1e3)
+    return sum(timings) / len(timings), max(timings)
+
+
+def import_time():
+    """Time import of extension in a fresh interpreter in which Jupyter server is
+    already imported as it is when extension is loaded. Returns import time in
+    ms and whether numpy has been imported by the extension"""
+    code = (
+        'import sys, time, jupyter_server.serverapp\n'
+        'numpy_loaded = \'numpy\' in sys.modules\n'
+        't = time.perf_counter()\n'
+        'import jupyter_power_usage\n'
+        'print((time.perf_counter() - t) * 1e3)\n'
+        'print(not numpy_loaded and \'numpy\' in sys.modules)'
+    )
+    proc = subprocess.run(
+        [sys.executable, '-c', code], check=True, capture_output=True, text=True
+    )
+    elapsed, numpy_imported = proc.stdout.split()
+    return float(elapsed), numpy_imported == 'True'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sockets', type=int, default=2, help='Fake sockets')
+    parser.add_argument('--repeat', type=int, default=20, help='Repetitions')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        make_rapl_tree(os.path.join(root, 'intel-rapl'), args.sockets)
+        utils.RAPL_API_DIR = os.path.join(root, 'intel-rapl')
+        cache_path = os.path.join(root, 'rapl-topology.json')
+        server_app = make_server_app()
+
+        cases = [
+            ('eager', lambda: CpuPowerUsage(server_app)),
+            (
+                'eager, cached',
+                lambda: CpuPowerUsage(server_app, topology_cache_path=cache_path),
+            ),
+            ('lazy', lambda: CpuPowerUsage(server_app, lazy=True)),
+        ]
+
+        # Warm up topology cache
+        utils.get_rapl_topology(cache_path)
+
+        print(f'{args.sockets} sockets, {args.repeat} repetitions')
+        print(f'{"case":<20}{"mean (ms)":>12}{"max (ms)":>12}')
+        for name, func in cases:
+            mean, worst = timeit(func, args.repeat)
+            print(f'{name:<20}{mean:>12.3f}{worst:>12.3f}')
+        elapsed, numpy_imported = import_time()
+        print(f'{"import extension":<20}{elapsed:>12.3f}')
+        if numpy_imported:
+            sys.exit('Importing the extension must not import numpy')
+
+
+if __name__ == '__main__':
+    main()
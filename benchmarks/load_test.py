@@ -0,0 +1,428 @@
+"""Load test of power usage handlers of a running Jupyter server.
+
+A real Jupyter server with the extension is started in a subprocess against a
+synthetic RAPL tree whose counters advance in background, with a population of
+idle child processes in its process tree. The Electricity Maps proxy is backed by
+a local stub of the upstream API. Configurable numbers of concurrent clients poll
+each endpoint for a fixed duration and throughput, p50/p99 latency, event loop
+lag of the server and CPU time used by the server are reported for each case.
+Results are saved as JSON and can be compared with a previous run.
+
+Usage:
+    python benchmarks/load_test.py --clients 1 50 500 -o load.json
+    python benchmarks/load_test.py --endpoints power --procs 1000 --compare load.json
+"""
+
+import argparse
+import asyncio
+import glob
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing import Process
+
+import psutil
+from synthetic import make_rapl_tree
+from synthetic import write_counters
+from tornado import web
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpclient import HTTPRequest
+
+# Token of the Jupyter server under test
+TOKEN = 'load-test'
+
+# Paths of endpoints under test relative to base URL
+ENDPOINTS = {
+    'power': 'api/metrics/v1/power_usage',
+    'snapshot': 'api/metrics/v1/power_usage/snapshot',
+    'emaps': 'api/metrics/v1/emission_factor/emaps/v3/carbon-intensity/latest'
+    '?zone=FR',
+}
+
+# Path of handler that reports event loop lag of the server under test
+LAG_PATH = 'loadtest/lag'
+
+# Interval in sec at which event loop lag of the server is probed
+LAG_PROBE_INTERVAL = 0.01
+
+# Power drawn by synthetic packages in W
+SYNTHETIC_POWER = 50
+
+# Time in sec to wait for server to make its first reading
+STARTUP_TIMEOUT = 60
+
+PERCENTILES = (50, 99)
+
+
+def percentile(values, q):
+    """Return q-th percentile of values or 0 if there are none"""
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(int(len(values) * q / 100), len(values) - 1)]
+
+
+def get_free_port():
+    """Get a free TCP port on localhost"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class StubEmapsHandler(web.RequestHandler):
+    """Stub of latest carbon intensity endpoint of Electricity Maps"""
+
+    def get(self):
+        self.set_header('Cache-Control', 'max-age=60')
+        self.finish(
+            {
+                'zone': self.get_argument('zone', 'FR'),
+                'carbonIntensity': 50,
+                'datetime': '2024-01-01T00:00:00.000Z',
+            }
+        )
+
+
+def run_emaps_stub(port):
+    """Serve stub of Electricity Maps API until terminated"""
+
+    async def serve():
+        app = web.Application([(r'/v3/carbon-intensity/latest', StubEmapsHandler)])
+        app.listen(port, '127.0.0.1')
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+class LagMonitor:
+    """Probe event loop lag as the delay of wake ups of a periodic sleep"""
+
+    def __init__(self):
+        self.samples = []
+
+    async def run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(LAG_PROBE_INTERVAL)
+            lag = time.perf_counter() - start - LAG_PROBE_INTERVAL
+            self.samples.append(max(lag, 0) * 1e3)
+
+    def reset(self):
+        """Return lag samples in ms since previous reset"""
+        samples, self.samples = self.samples, []
+        return samples
+
+
+class LagHandler(web.RequestHandler):
+    """Return and reset event loop lag samples of the server"""
+
+    def initialize(self, monitor):
+        self.monitor = monitor
+
+    def get(self):
+        self.finish({'samples': self.monitor.reset()})
+
+
+def advance_counters(counters, interval=0.1):
+    """Advance synthetic energy counters as if packages drew SYNTHETIC_POWER"""
+    energy_uj = 1000000
+    while True:
+        time.sleep(interval)
+        energy_uj += int(SYNTHETIC_POWER * interval * 1e6)
+        write_counters(counters, energy_uj)
+
+
+def serve(args):
+    """Run Jupyter server with the extension against synthetic trees
+
+    This runs in the server subprocess so that patched paths only apply to the
+    server under test.
+    """
+    from jupyter_server.serverapp import ServerApp
+    from jupyter_server.utils import url_path_join
+    from tornado.ioloop import IOLoop
+
+    from jupyter_power_usage import api
+    from jupyter_power_usage import utils
+
+    utils.RAPL_API_DIR = os.path.join(args.root, 'rapl')
+    api.EMAPS_API_URL = f'http://127.0.0.1:{args.emaps_port}'
+    counters = glob.glob(os.path.join(utils.RAPL_API_DIR, '**', 'energy_uj'))
+    threading.Thread(target=advance_counters, args=(counters,), daemon=True).start()
+
+    # Idle children make the process tree of the server as large as a busy one
+    children = [subprocess.Popen(['sleep', 'infinity']) for _ in range(args.procs)]
+
+    monitor = LagMonitor()
+    app = ServerApp.instance(jpserver_extensions={'jupyter_power_usage': True})
+    try:
+        app.initialize(
+            [
+                f'--port={args.port}',
+                '--ip=127.0.0.1',
+                '--no-browser',
+                '--allow-root',
+                f'--IdentityProvider.token={TOKEN}',
+                f'--ServerApp.root_dir={args.root}',
+                f'--PowerUsageDisplay.measurement_scope={args.scope}',
+                f'--PowerUsageDisplay.sampling_period={args.sampling_period}',
+                '--PowerUsageDisplay.emaps_access_token=stub',
+                '--PowerUsageDisplay.energy_ledger_enabled=False',
+                '--ServerApp.log_level=WARN',
+            ]
+        )
+        app.web_app.add_handlers(
+            '.*$',
+            [
+                (
+                    url_path_join(app.base_url, LAG_PATH),
+                    LagHandler,
+                    {'monitor': monitor},
+                )
+            ],
+        )
+        IOLoop.current().add_callback(monitor.run)
+        app.start()
+    finally:
+        for child in children:
+            child.kill()
+
+
+async def poll(client, url, deadline, think_time, latencies, errors):
+    """Poll url until deadline and record latencies in ms"""
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        response = await client.fetch(
+            HTTPRequest(url, headers={'Authorization': f'token {TOKEN}'}),
+            raise_error=False,
+        )
+        if response.code == 200:
+            latencies.append((time.perf_counter() - start) * 1e3)
+        else:
+            errors.append(response.code)
+        if think_time:
+            await asyncio.sleep(think_time)
+
+
+async def run_case(base_url, server, path, clients, duration, think_time):
+    """Drive clients concurrent pollers against an endpoint"""
+    client = AsyncHTTPClient(force_instance=True, max_clients=clients)
+    lag_url = f'{base_url}/{LAG_PATH}'
+    latencies, errors = [], []
+    try:
+        # Discard lag samples of the idle period before the case
+        await client.fetch(lag_url)
+        cpu_start = sum(server.cpu_times()[:2])
+        start = time.perf_counter()
+        deadline = start + duration
+        await asyncio.gather(
+            *(
+                poll(
+                    client,
+                    f'{base_url}/{path}',
+                    deadline,
+                    think_time,
+                    latencies,
+                    errors,
+                )
+                for _ in range(clients)
+            )
+        )
+        elapsed = time.perf_counter() - start
+        cpu = sum(server.cpu_times()[:2]) - cpu_start
+        lag = json.loads((await client.fetch(lag_url)).body)['samples']
+    finally:
+        client.close()
+
+    result = {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'throughput': len(latencies) / elapsed,
+        'server_cpu': cpu / elapsed,
+        'lag_max': max(lag, default=0),
+    }
+    for q in PERCENTILES:
+        result[f'p{q}'] = percentile(latencies, q)
+        result[f'lag_p{q}'] = percentile(lag, q)
+    return result
+
+
+async def wait_ready(base_url, server):
+    """Wait until server has made its first reading"""
+    client = AsyncHTTPClient(force_instance=True)
+    url = f'{base_url}/{ENDPOINTS["power"]}'
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    try:
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise RuntimeError('Jupyter server exited during startup')
+            try:
+                response = await client.fetch(
+                    HTTPRequest(url, headers={'Authorization': f'token {TOKEN}'}),
+                    raise_error=False,
+                )
+                if response.code == 200 and 'cpu' in json.loads(response.body):
+                    return
+            except OSError:
+                # Server is not listening yet
+                pass
+            await asyncio.sleep(0.5)
+    finally:
+        client.close()
+    raise RuntimeError('Jupyter server did not make a reading in time')
+
+
+def compare(results, previous):
+    """Print results of cases side by side with a previous run"""
+    print(f'\n{"case":<32}{"metric":>12}{"previous":>12}{"current":>12}{"ratio":>8}')
+    for name, result in results.items():
+        if name not in previous:
+            continue
+        for key in ('throughput', 'p50', 'p99', 'lag_p99', 'server_cpu'):
+            before, after = previous[name][key], result[key]
+            ratio = f'{after / before:.2f}' if before else '-'
+            print(f'{name:<32}{key:>12}{before:>12.2f}{after:>12.2f}{ratio:>8}')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        '--clients',
+        type=int,
+        nargs='+',
+        default=[1, 10, 100, 500],
+        help='Numbers of concurrent clients',
+    )
+    parser.add_argument(
+        '--endpoints',
+        nargs='+',
+        choices=sorted(ENDPOINTS),
+        default=['power', 'emaps'],
+        help='Endpoints under test',
+    )
+    parser.add_argument(
+        '--duration', type=float, default=10, help='Duration in sec of each case'
+    )
+    parser.add_argument(
+        '--think-time',
+        type=float,
+        default=0,
+        help='Time in sec each client waits between two requests',
+    )
+    parser.add_argument(
+        '--procs', type=int, default=100, help='Idle processes under the server'
+    )
+    parser.add_argument(
+        '--sockets', type=int, default=1, help='Sockets of synthetic RAPL tree'
+    )
+    parser.add_argument(
+        '--scope',
+        default='process',
+        choices=('process', 'user', 'cgroup', 'sys'),
+        help='Measurement scope of the server',
+    )
+    parser.add_argument(
+        '--sampling-period', type=int, default=1000, help='Sampling period in ms'
+    )
+    parser.add_argument('-o', '--output', help='Save results to this JSON file')
+    parser.add_argument('--compare', help='Compare with results of a previous run')
+    # Internal options of the server subprocess
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--root', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--emaps-port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    with tempfile.TemporaryDirectory() as root:
+        make_rapl_tree(os.path.join(root, 'rapl'), num_sockets=args.sockets)
+        port, emaps_port = get_free_port(), get_free_port()
+        stub = Process(target=run_emaps_stub, args=(emaps_port,), daemon=True)
+        stub.start()
+        server_proc = subprocess.Popen(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                '--serve',
+                f'--root={root}',
+                f'--port={port}',
+                f'--emaps-port={emaps_port}',
+                f'--procs={args.procs}',
+                f'--scope={args.scope}',
+                f'--sampling-period={args.sampling_period}',
+            ]
+        )
+        server = psutil.Process(server_proc.pid)
+        base_url = f'http://127.0.0.1:{port}'
+        results = {}
+        try:
+            asyncio.run(wait_ready(base_url, server_proc))
+            print(
+                f'{"case":<32}{"req/s":>10}{"p50 (ms)":>10}{"p99 (ms)":>10}'
+                f'{"lag p99":>10}{"lag max":>10}{"cpu":>8}{"errors":>8}'
+            )
+            for endpoint in args.endpoints:
+                for clients in args.clients:
+                    name = f'{endpoint}[clients={clients}]'
+                    result = results[name] = asyncio.run(
+                        run_case(
+                            base_url,
+                            server,
+                            ENDPOINTS[endpoint],
+                            clients,
+                            args.duration,
+                            args.think_time,
+                        )
+                    )
+                    print(
+                        f'{name:<32}{result["throughput"]:>10.1f}'
+                        f'{result["p50"]:>10.2f}{result["p99"]:>10.2f}'
+                        f'{result["lag_p99"]:>10.2f}{result["lag_max"]:>10.2f}'
+                        f'{result["server_cpu"]:>8.2f}{result["errors"]:>8}'
+                    )
+        finally:
+            server_proc.terminate()
+            server_proc.wait()
+            stub.terminate()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(
+                {
+                    'config': {
+                        k: getattr(args, k)
+                        for k in (
+                            'duration',
+                            'think_time',
+                            'procs',
+                            'sockets',
+                            'scope',
+                            'sampling_period',
+                        )
+                    },
+                    'results': results,
+                },
+                f,
+                indent=2,
+                sort_keys=True,
+            )
+            f.write('\n')
+        print(f'Results saved in {args.output}')
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare(results, json.load(f)['results'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""Synthetic sysfs and procfs trees used by benchmarks.
+
+RAPL powercap trees and process populations are written to plain directories so
+that benchmarks run on hosts without RAPL hardware and with any number of
+processes. Functions of this module only write files. Benchmarks point
+jupyter_power_usage.utils and psutil to the trees.
+"""
+
+import os
+
+# Maximum value of RAPL energy counters of packages and DRAM domains in uJ
+PACKAGE_MAX_ENERGY_UJ = 262143328850
+DRAM_MAX_ENERGY_UJ = 65712999613
+
+# Memory of synthetic host in kB
+MEM_TOTAL_KB = 256 * 1024 * 1024
+
+# Processes of synthetic population
+INIT_PID = 1
+SERVER_PID = 2
+SERVER_UID = 1000
+OTHER_UID = 1001
+
+# Number of fields of /proc/<pid>/stat after process name
+STAT_FIELDS = 50
+
+
+def write_file(path, content):
+    """Write content to file creating parent directories"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(f'{content}\n')
+
+
+def make_rapl_tree(root, num_sockets=1, dram=True, energy_uj=1000000):
+    """Make a RAPL powercap tree with a package per socket and optional DRAM
+    domains. Returns paths of all energy counter files"""
+    counters = []
+    for i_soc in range(num_sockets):
+        package_path = os.path.join(root, f'intel-rapl:{i_soc}')
+        zones = [(package_path, f'package-{i_soc}', PACKAGE_MAX_ENERGY_UJ)]
+        # Core domain is not used for power usage but it is present on all hosts
+        zones.append((os.path.join(package_path, f'intel-rapl:{i_soc}:0'), 'core', 0))
+        if dram:
+            zones.append(
+                (
+                    os.path.join(package_path, f'intel-rapl:{i_soc}:1'),
+                    'dram',
+                    DRAM_MAX_ENERGY_UJ,
+                )
+            )
+        for path, name, max_energy_uj in zones:
+            write_file(os.path.join(path, 'name'), name)
+            write_file(os.path.join(path, 'energy_uj'), energy_uj)
+            write_file(os.path.join(path, 'max_energy_range_uj'), max_energy_uj)
+            write_file(os.path.join(path, 'constraint_0_power_limit_uw'), 150000000)
+            counters.append(os.path.join(path, 'energy_uj'))
+    return counters
+
+
+def write_counters(counters, energy_uj):
+    """Set all energy counters to a value"""
+    for path in counters:
+        with open(path, 'w') as f:
+            f.write(f'{energy_uj}\n')
+
+
+def make_stat_line(pid, ppid, utime, stime, start_time):
+    """Make content of /proc/<pid>/stat"""
+    fields = ['0'] * STAT_FIELDS
+    fields[0] = 'S'
+    fields[1] = str(ppid)
+    fields[11] = str(utime)
+    fields[12] = str(stime)
+    fields[19] = str(start_time)
+    return f'{pid} (proc-{pid}) ' + ' '.join(fields)
+
+
+def make_procfs_tree(root, num_procs, server_share=0.1, user_share=0.5):
+    """Make a procfs tree with a population of processes
+
+    Process SERVER_PID is owned by SERVER_UID and server_share of the population
+    are its descendants. user_share of the population is owned by SERVER_UID.
+    Returns pids of all processes.
+    """
+    write_file(
+        os.path.join(root, 'stat'),
+        'cpu  1000000 0 500000 8000000 10000 0 1000 0 0 0\n'
+        'cpu0 1000000 0 500000 8000000 10000 0 1000 0 0 0\n'
+        'btime 1700000000',
+    )
+    write_file(
+        os.path.join(root, 'meminfo'),
+        f'MemTotal:       {MEM_TOTAL_KB} kB\n'
+        f'MemFree:        {MEM_TOTAL_KB // 2} kB\n'
+        f'MemAvailable:   {MEM_TOTAL_KB * 3 // 4} kB\n'
+        'HugePages_Total:       0',
+    )
+
+    write_proc(root, INIT_PID, 0, 0)
+    write_proc(root, SERVER_PID, INIT_PID, SERVER_UID)
+    pids = [INIT_PID, SERVER_PID]
+
+    num_server = int(num_procs * server_share)
+    num_user = max(int(num_procs * user_share), num_server)
+    for i in range(num_procs):
+        pid = SERVER_PID + 1 + i
+        if i < num_server:
+            # Chains of depth 4 below the server, like kernels and their children
+            ppid = SERVER_PID if i % 4 == 0 else pid - 1
+        else:
+            ppid = INIT_PID
+        write_proc(root, pid, ppid, SERVER_UID if i < num_user else OTHER_UID)
+        pids.append(pid)
+    return pids
+
+
+def write_proc(root, pid, ppid, uid, utime=100, stime=50, rss_pages=1024):
+    """Write procfs entries of a process"""
+    path = os.path.join(root, str(pid))
+    write_file(os.path.join(path, 'stat'), make_stat_line(pid, ppid, utime, stime, pid))
+    write_file(
+        os.path.join(path, 'status'),
+        f'Name:\tproc-{pid}\nPPid:\t{ppid}\n'
+        f'Uid:\t{uid}\t{uid}\t{uid}\t{uid}\nGid:\t{uid}\t{uid}\t{uid}\t{uid}',
+    )
+    write_file(
+        os.path.join(path, 'statm'), f'{rss_pages * 4} {rss_pages} 256 16 0 512 0'
+    )
+    write_file(
+        os.path.join(path, 'smaps_rollup'),
+        f'Rss:                {rss_pages * 4} kB\n'
+        f'Pss:                {rss_pages * 3} kB',
+    )
+
+
+def make_cgroup_tree(root, proc_cgroup_file):
+    """Make a cgroup v2 hierarchy with cgroup of the server. Returns cgroup path"""
+    write_file(os.path.join(root, 'cgroup.controllers'), 'cpu memory')
+    path = os.path.join(root, 'user.slice', 'jupyter.service')
+    write_file(os.path.join(path, 'cpu.stat'), 'usage_usec 1000000\nuser_usec 0')
+    write_file(os.path.join(path, 'memory.current'), 1024 * 1024 * 1024)
+    write_file(proc_cgroup_file, '0::/user.slice/jupyter.service')
+    return path
@@ -1,11 +1,36 @@
+import atexit
+from functools import partial
+
 from jupyter_server.utils import url_path_join as ujoin
 
 from ._version import __version__  # noqa
+from .api import CellEnergyHandler
 from .api import ElectrictyMapsHandler
+from .api import EMAPS_LATEST_PATH
+from .api import fetch_emaps
+from .api import get_cached_emission_factor
+from .api import get_emaps_cache_key
+from .api import KernelPowerMetricHandler
+from .api import make_metrics_payload
+from .api import OverheadHandler
+from .api import PowerExportHandler
+from .api import PowerHistoryHandler
 from .api import PowerMetricHandler
+from .api import PowerSnapshotHandler
+from .api import PowerStreamHandler
+from .api import PrometheusMetricHandler
+from .cache import ResponseCache
+from .cells import CellEnergyRecorder
+from .cells import KERNEL_ACTIONS_SCHEMA
 from .config import PowerUsageDisplay
+from .emissions import EmissionsIntegrator
 from .metrics import CpuPowerUsage
 from .metrics import GpuPowerUsage
+from .overhead import OverheadRecorder
+from .prometheus import PrometheusExporter
+from .sampler import PowerUsageSampler
+from .stream import PowerStreamBroadcaster
+from .utils import get_default_topology_cache_path
 
 
 def _jupyter_server_extension_points():
@@ -23,11 +48,133 @@ def load_jupyter_server_extension(server_app):
     Args:
         nbapp : handle to the Notebook webserver instance.
     """
+    # Modules that use numpy are imported only when extension is loaded so that
+    # importing the extension stays cheap
+    from .carbon import CarbonIntensityTable
+    from .history import PowerHistory
+    from .ledger import EnergyLedger
+    from .ledger import get_default_ledger_path
+
     config = PowerUsageDisplay(parent=server_app)
     server_app.web_app.settings['jupyter_power_usage_config'] = config
 
-    cpu_power_usage = CpuPowerUsage(server_app)
-    gpu_power_usage = GpuPowerUsage(server_app)
+    # Cost of the power meter itself
+    overhead = OverheadRecorder(enabled=config.overhead_enabled)
+
+    # Backends are initialized by sampler in background so that discovery of
+    # RAPL domains and GPUs does not delay server startup
+    cpu_power_usage = CpuPowerUsage(
+        server_app,
+        lazy=True,
+        topology_cache_path=get_default_topology_cache_path(),
+        overhead=overhead,
+    )
+    gpu_power_usage = GpuPowerUsage(server_app, lazy=True)
+
+    # Start a single background sampler shared by all clients
+    sampler = PowerUsageSampler(
+        server_app, cpu_power_usage, gpu_power_usage, overhead=overhead
+    )
+
+    # Keep history of readings at several resolutions. Availability of backends
+    # is not known yet and unavailable fields are recorded as missing values
+    history = PowerHistory(['cpu', 'gpu'])
+    sampler.add_listener(history.add)
+
+    # Persist cumulative energy usage across restarts
+    ledger = None
+    if config.energy_ledger_enabled:
+        ledger = EnergyLedger(
+            config.energy_ledger_path or get_default_ledger_path(),
+            capacity=config.energy_ledger_capacity,
+            fsync_interval=config.energy_ledger_fsync_interval,
+            log=server_app.log,
+        )
+        sampler.add_listener(ledger.add)
+        atexit.register(ledger.close)
+
+    # Responses of Electricity Maps API shared by all clients
+    emaps_cache = ResponseCache(
+        ttl=config.emaps_cache_ttl,
+        max_size=config.emaps_cache_size,
+        log=server_app.log,
+    )
+
+    # Offline carbon intensity table shared by all servers of the host
+    carbon_table = None
+    if config.carbon_table_path:
+        try:
+            carbon_table = CarbonIntensityTable(config.carbon_table_path)
+        except (OSError, ValueError) as err:
+            server_app.log.warning(
+                'Failed to load carbon intensity table due to %s' % err
+            )
+
+    # Integrate emissions on server so that they are accounted for even when no
+    # client is polling. Carbon intensity of zone is refreshed by the server only
+    # when it has its own access token
+    zone = config.emissions_zone.upper()
+    sources = []
+    if zone:
+        sources.append(
+            ('emaps', lambda timestamp: get_cached_emission_factor(emaps_cache, zone))
+        )
+    if carbon_table is not None and zone:
+        table_source = ('table', partial(carbon_table.lookup, zone))
+        if config.carbon_table_priority == 'primary':
+            sources.insert(0, table_source)
+        else:
+            sources.append(table_source)
+    refresh = None
+    if zone and config.emaps_access_token and config.emaps_cache_ttl:
+        key = get_emaps_cache_key(EMAPS_LATEST_PATH, {'zone': zone})
+        refresh = partial(
+            emaps_cache.get,
+            key,
+            partial(
+                fetch_emaps,
+                ElectrictyMapsHandler.client,
+                key,
+                config.emaps_access_token,
+                config.emaps_cache_ttl,
+            ),
+        )
+    emissions = EmissionsIntegrator(
+        lambda: cpu_power_usage.effective_scope,
+        config.emission_factor,
+        sources=sources,
+        refresh=refresh,
+        refresh_interval=config.emaps_cache_ttl,
+        log=server_app.log,
+    )
+    sampler.add_listener(emissions.add)
+
+    # Push each new reading to clients subscribed to the stream
+    broadcaster = PowerStreamBroadcaster(
+        partial(make_metrics_payload, ledger=ledger, emissions=emissions)
+    )
+    sampler.add_listener(broadcaster.publish)
+
+    # Render Prometheus exposition text once per reading
+    exporter = PrometheusExporter(
+        cpu_power_usage, ledger, overhead=overhead, emissions=emissions
+    )
+    sampler.add_listener(exporter.update)
+
+    # Record energy of each execution of notebook cells. Kernels are observed as
+    # soon as they are started and as they are found by sampler
+    cells = None
+    if config.cell_energy_enabled:
+        cells = CellEnergyRecorder(
+            sampler, max_cells=config.cell_energy_history_size, log=server_app.log
+        )
+        sampler.add_listener(cells.update)
+        event_logger = getattr(server_app, 'event_logger', None)
+        if event_logger is not None:
+            event_logger.add_listener(
+                schema_id=KERNEL_ACTIONS_SCHEMA, listener=cells.on_kernel_action
+            )
+    sampler.start()
 
     base_url = server_app.web_app.settings["base_url"]
 
@@ -37,14 +184,57 @@ def load_jupyter_server_extension(server_app):
             (
                 ujoin(base_url, 'api/metrics/v1/power_usage'),
                 PowerMetricHandler,
+                {'sampler': sampler, 'ledger': ledger, 'emissions': emissions},
+            ),
+            (
+                ujoin(base_url, 'api/metrics/v1/power_usage/snapshot'),
+                PowerSnapshotHandler,
                 {
-                    'cpu_power_usage': cpu_power_usage,
-                    'gpu_power_usage': gpu_power_usage,
+                    'sampler': sampler,
+                    'ledger': ledger,
+                    'emissions': emissions,
+                    'emaps_cache': emaps_cache,
                 },
             ),
+            (
+                ujoin(base_url, 'api/metrics/v1/power_usage/kernels'),
+                KernelPowerMetricHandler,
+                {'sampler': sampler},
+            ),
+            (
+                ujoin(base_url, 'api/metrics/v1/power_usage/cells'),
+                CellEnergyHandler,
+                {'cells': cells},
+            ),
+            (
+                ujoin(base_url, 'api/metrics/v1/power_usage/stream'),
+                PowerStreamHandler,
+                {'broadcaster': broadcaster, 'sampler': sampler},
+            ),
+            (
+                ujoin(base_url, 'api/metrics/v1/power_usage/prometheus'),
+                PrometheusMetricHandler,
+                {'exporter': exporter, 'sampler': sampler},
+            ),
+            (
+                ujoin(base_url, 'api/metrics/v1/power_usage/debug/overhead'),
+                OverheadHandler,
+                {'overhead': overhead},
+            ),
+            (
+                ujoin(base_url, 'api/metrics/v1/power_usage/history'),
+                PowerHistoryHandler,
+                {'history': history},
+            ),
+            (
+                ujoin(base_url, 'api/metrics/v1/power_usage/export'),
+                PowerExportHandler,
+                {'ledger': ledger},
+            ),
             (
                 ujoin(base_url, 'api/metrics/v1/emission_factor/emaps') + '(.*)',
                 ElectrictyMapsHandler,
+                {'cache': emaps_cache, 'carbon_table': carbon_table},
             ),
         ],
     )
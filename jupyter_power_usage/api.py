@@ -11,94 +11,363 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-import getpass
 import json
-from concurrent.futures import ThreadPoolExecutor
+import math
+from datetime import datetime
+from datetime import timezone
+from functools import partial
 
-import psutil
 from jupyter_server.base.handlers import JupyterHandler
 from jupyter_server.utils import url_escape
 from jupyter_server.utils import url_path_join
 from tornado import web
-from tornado.concurrent import run_on_executor
 from tornado.httpclient import AsyncHTTPClient
 from tornado.httpclient import HTTPError
 from tornado.httpclient import HTTPRequest
 from tornado.httputil import url_concat
+from tornado.iostream import StreamClosedError
 
+from .cache import get_cache_ttl
+from .prometheus import PROMETHEUS_CONTENT_TYPE
+from .snapshot import get_snapshot_etag
+from .snapshot import make_snapshot
 
-class PowerMetricHandler(JupyterHandler):
-    executor = ThreadPoolExecutor(max_workers=5)
+# Upstream API URL of Electricity Maps
+EMAPS_API_URL = 'https://api.electricitymap.org'
+
+# Path of Electricity Maps API that returns latest carbon intensity of a zone
+EMAPS_LATEST_PATH = '/v3/carbon-intensity/latest'
+
+
+def make_metrics_payload(reading, ledger=None, emissions=None):
+    """Make power usage payload from a reading made by sampler
+
+    Until the first reading is made while backends are initialized in background,
+    the payload only reports that metrics are not ready yet.
+    """
+    if reading is None:
+        return {'status': 'initializing'}
+
+    metrics = {
+        k: v for k, v in reading.items() if k in ('cpu', 'gpu', 'scopes', 'overhead')
+    }
+
+    # Add cumulative energy usage in J if it is being recorded
+    if metrics and ledger is not None:
+        metrics['energy'] = ledger.get_totals()
+
+    # Add cumulative emissions in gCO2e if they are integrated on server
+    if metrics and emissions is not None:
+        metrics['emissions'] = emissions.get_totals()
+    return metrics
+
+
+def get_emaps_cache_key(path, params):
+    """Get key of an Electricity Maps API response in cache. Access token is not
+    part of the key so that all clients share cached responses"""
+    api_path = url_path_join(EMAPS_API_URL, url_escape(path))
+    return url_concat(api_path, sorted(params.items()))
 
-    def initialize(self, cpu_power_usage, gpu_power_usage):
-        self.cpu_power_usage = cpu_power_usage
-        self.gpu_power_usage = gpu_power_usage
 
-        # Check if CPU and/or GPU power usages are available
-        self.cpu_power_usage_available = self.cpu_power_usage.power_usage_available()
-        self.gpu_power_usage_available = self.gpu_power_usage.power_usage_available()
+async def fetch_emaps(client, api_path, token, default_ttl=0):
+    """Fetch data from electricity maps and return it with its TTL"""
+    request = HTTPRequest(
+        api_path,
+        user_agent='JupyterLab Power Usage',
+        headers={'auth-token': f'{token}'},
+    )
+    response = await client.fetch(request)
+    data = json.loads(response.body.decode('utf-8'))
+    return json.dumps(data), get_cache_ttl(response.headers, default_ttl)
 
-        # Get CPU power limit if metrics are available
-        if self.cpu_power_usage_available:
-            self.cpu_power_limit = self.cpu_power_usage.get_power_limit()
 
-        # Get GPU power limit if metrics are available
-        if self.gpu_power_usage_available:
-            self.gpu_power_limit = self.gpu_power_usage.get_power_limit()
+def make_carbon_table_response(table, zone):
+    """Make a response of Electricity Maps latest carbon intensity endpoint from
+    an offline carbon intensity table or None if zone is not in table"""
+    if table is None or not zone:
+        return None
+    intensity = table.lookup(zone)
+    if intensity is None:
+        return None
+    return json.dumps(
+        {
+            'zone': zone.upper(),
+            'carbonIntensity': intensity,
+            'datetime': datetime.now(timezone.utc).isoformat(),
+            'isEstimated': True,
+            'estimationMethod': 'offline table',
+        }
+    )
 
-        # Get reporting scope from config
-        self.measurement_scope = self.settings[
-            'jupyter_power_usage_config'
-        ].measurement_scope
 
-        # Get current user
-        self.user = getpass.getuser()
+def get_cached_emission_factor(cache, zone):
+    """Get latest carbon intensity of zone in g/kWh from responses of Electricity
+    Maps API cached by the proxy or None if it is not cached"""
+    if cache is None or not zone:
+        return None
+    data = cache.peek(get_emaps_cache_key(EMAPS_LATEST_PATH, {'zone': zone.upper()}))
+    if data is None:
+        return None
+    try:
+        return json.loads(data).get('carbonIntensity')
+    except (ValueError, AttributeError):
+        return None
+
+
+class PowerMetricHandler(JupyterHandler):
+    def initialize(self, sampler, ledger=None, emissions=None):
+        self.sampler = sampler
+        self.ledger = ledger
+        self.emissions = emissions
 
     @web.authenticated
     async def get(self):
         """Return host and user energy usage"""
-        # Set process list based on measurement_scope
-        if self.measurement_scope == 'process':
-            pids = [psutil.Process().pid] + [
-                p.pid for p in psutil.Process().children(recursive=True)
-            ]
-        elif self.measurement_scope == 'user':
-            pids = [
-                p.pid
-                for p in psutil.process_iter(['pid', 'username'])
-                if p.username() == self.user
-            ]
-        else:
-            # No need to pass any PIDs. CPU and memory shares will be always 1
-            pids = []
-
-        metrics = {}
-
-        # Add CPU metrics to payload if available
-        if self.cpu_power_usage_available:
-            cpu_power_usage = await self._get_cpu_energy_usage(pids)
-            metrics.update(
-                {'cpu': {'usage': cpu_power_usage, 'limit': self.cpu_power_limit}}
+        # Serve the latest reading made by background sampler. If there are no
+        # readings yet, report that sampler is still initializing
+        self.sampler.touch()
+        metrics = make_metrics_payload(self.sampler.latest, self.ledger, self.emissions)
+        self.finish(json.dumps(metrics))
+
+
+class PowerSnapshotHandler(JupyterHandler):
+    """Return latest reading, static metadata, cumulative energy and cached
+    emission factor in a single response
+
+    ETag of the response is tied to the sequence number of the reading so that
+    clients polling faster than the sampler get a 304 without serializing
+    anything.
+    """
+
+    def initialize(self, sampler, ledger=None, emissions=None, emaps_cache=None):
+        self.sampler = sampler
+        self.ledger = ledger
+        self.emissions = emissions
+        self.emaps_cache = emaps_cache
+
+    @web.authenticated
+    async def get(self):
+        """Return combined snapshot of power usage"""
+        self.sampler.touch()
+        self.set_header('Cache-Control', 'no-cache')
+
+        # Reading and metadata are updated on event loop and are consistent
+        reading = self.sampler.latest
+        metadata = self.sampler.metadata
+        if reading is None or metadata is None:
+            self.finish(json.dumps(make_metrics_payload(None)))
+            return
+
+        seq = self.sampler.seq
+        emission_factor = get_cached_emission_factor(
+            self.emaps_cache, self.get_argument('zone', '')
+        )
+        self.set_header('Etag', get_snapshot_etag(seq, emission_factor))
+        if self.check_etag_header():
+            self.set_status(304)
+            self.finish()
+            return
+
+        metrics = make_metrics_payload(reading, self.ledger, self.emissions)
+        self.finish(json.dumps(make_snapshot(seq, metrics, metadata, emission_factor)))
+
+
+class KernelPowerMetricHandler(JupyterHandler):
+    """Return power usage attributed to each running kernel"""
+
+    def initialize(self, sampler):
+        self.sampler = sampler
+
+    @web.authenticated
+    async def get(self):
+        """Return CPU power usage of process subtree of each kernel by kernel id"""
+        self.sampler.touch()
+        reading = self.sampler.latest or {}
+        self.finish(
+            json.dumps(
+                {
+                    'timestamp': reading.get('timestamp'),
+                    'kernels': reading.get('kernels', {}),
+                }
             )
+        )
+
+
+class CellEnergyHandler(JupyterHandler):
+    """Return energy used by each execution of notebook cells of a kernel"""
+
+    def initialize(self, cells=None):
+        self.cells = cells
+
+    @web.authenticated
+    async def get(self):
+        """Return finished executions of kernel_id with their energy in J"""
+        if self.cells is None:
+            raise web.HTTPError(404, 'Cell energy accounting is not enabled')
+        kernel_id = self.get_argument('kernel_id')
+        self.finish(
+            json.dumps(
+                {'kernel_id': kernel_id, 'cells': self.cells.get_cells(kernel_id)}
+            )
+        )
+
+
+class OverheadHandler(JupyterHandler):
+    """Return histograms of the cost of each phase of sampling"""
+
+    def initialize(self, overhead):
+        self.overhead = overhead
 
-        # Add GPU metrics to payload if available
-        if self.gpu_power_usage_available:
-            gpu_power_usage = self.gpu_power_usage.get_power_usage()
-            metrics.update(
+    @web.authenticated
+    async def get(self):
+        """Return wall and CPU time histograms of each phase in sec"""
+        self.finish(
+            json.dumps(
                 {
-                    'gpu': {
-                        'usage': gpu_power_usage,
-                        'limit': self.gpu_power_limit,
-                    }
+                    'enabled': self.overhead.enabled,
+                    'phases': self.overhead.get_histograms(),
                 }
             )
+        )
 
-        # Get GPU usage
-        self.finish(json.dumps(metrics))
 
-    @run_on_executor
-    def _get_cpu_energy_usage(self, all_processes):
-        return self.cpu_power_usage.get_power_usage(all_processes)
+class PrometheusMetricHandler(JupyterHandler):
+    """Expose power usage in Prometheus text exposition format"""
+
+    def initialize(self, exporter, sampler=None):
+        self.exporter = exporter
+        self.sampler = sampler
+
+    @web.authenticated
+    async def get(self):
+        """Return exposition text rendered from latest reading"""
+        if self.sampler is not None:
+            self.sampler.touch()
+        self.set_header('Content-Type', PROMETHEUS_CONTENT_TYPE)
+        self.finish(self.exporter.text)
+
+
+class PowerStreamHandler(JupyterHandler):
+    """Push power usage to clients using Server-Sent Events
+
+    Each new reading is pushed once to all clients as a frame with a sequence
+    number. A frame is either full or a delta that contains only the values that
+    changed since previous frame. Clients that are slower than the sampler skip
+    frames and get a full frame when they are ready.
+    """
+
+    def initialize(self, broadcaster, sampler=None):
+        self.broadcaster = broadcaster
+        self.sampler = sampler
+        self.subscriber = None
+        self.closed = False
+
+    @web.authenticated
+    async def get(self):
+        """Stream power usage"""
+        self.set_header('Content-Type', 'text/event-stream')
+        self.set_header('Cache-Control', 'no-cache')
+        self.set_header('X-Accel-Buffering', 'no')
+
+        self.subscriber = self.broadcaster.subscribe()
+        try:
+            while not self.closed:
+                # Subscribers count as active clients of sampler
+                if self.sampler is not None:
+                    self.sampler.touch()
+                await self.subscriber.event.wait()
+                self.subscriber.event.clear()
+                frame = self.broadcaster.next_frame(self.subscriber)
+                if frame is None or self.closed:
+                    continue
+                self.write(f'data: {frame}\n\n')
+                # Wait until frame is sent to the client. Frames published in the
+                # meantime are not queued
+                await self.flush()
+        except StreamClosedError:
+            pass
+        finally:
+            self.broadcaster.unsubscribe(self.subscriber)
+
+    def on_connection_close(self):
+        # Wake up the stream so that it notices the closed connection
+        self.closed = True
+        if self.subscriber is not None:
+            self.subscriber.event.set()
+
+
+class PowerHistoryHandler(JupyterHandler):
+    def initialize(self, history):
+        self.history = history
+
+    @web.authenticated
+    async def get(self):
+        """Return power usage history since a given time at a given resolution"""
+        resolution = self.get_argument('resolution', 'raw')
+        if resolution not in self.history.resolutions:
+            raise web.HTTPError(
+                400,
+                'Invalid resolution %s. Available resolutions are %s'
+                % (resolution, ', '.join(self.history.resolutions)),
+            )
+        try:
+            since = float(self.get_argument('since', 0))
+        except ValueError:
+            raise web.HTTPError(400, 'since must be a UNIX timestamp in seconds')
+
+        self.finish(json.dumps(self.history.query(since, resolution)))
+
+
+class PowerExportHandler(JupyterHandler):
+    """Stream recorded power and energy usage as a npz archive"""
+
+    def initialize(self, ledger=None):
+        self.ledger = ledger
+
+    def get_float_argument(self, name, default):
+        """Get a float query argument"""
+        try:
+            return float(self.get_argument(name, default))
+        except ValueError:
+            raise web.HTTPError(400, f'{name} must be a number')
+
+    @web.authenticated
+    async def get(self):
+        """Return energy ledger records in a time range at a given resolution"""
+        if self.ledger is None:
+            raise web.HTTPError(404, 'Energy ledger is not enabled')
+        # numpy is only imported when records are exported
+        from .export import EXPORT_CONTENT_TYPE
+        from .export import EXPORT_FILE_NAME
+        from .export import iter_export
+        from .ledger import read_ledger
+
+        since = self.get_float_argument('since', 0)
+        until = self.get_float_argument('until', math.inf)
+        resolution = self.get_float_argument('resolution', 0)
+
+        # Ledger file is mapped read only independently of the ledger of the
+        # sampler. Records appended during the export are not exported
+        try:
+            header, records = read_ledger(self.ledger.path)
+        except (OSError, ValueError):
+            raise web.HTTPError(404, 'No energy usage has been recorded yet')
+
+        self.set_header('Content-Type', EXPORT_CONTENT_TYPE)
+        self.set_header(
+            'Content-Disposition', f'attachment; filename="{EXPORT_FILE_NAME}"'
+        )
+        for data in iter_export(
+            records,
+            int(header['count']),
+            since=since,
+            until=until,
+            resolution=resolution,
+        ):
+            self.write(data)
+            # Only one chunk is buffered at a time
+            await self.flush()
+        self.finish()
 
 
 class ElectrictyMapsHandler(JupyterHandler):
@@ -117,12 +386,28 @@ class ElectrictyMapsHandler(JupyterHandler):
     # we lose SSL context and hence cert verification will fail eventually failing spawn.
     client = AsyncHTTPClient(force_instance=True)
 
-    def initialize(self):
+    def initialize(self, cache=None, carbon_table=None):
         # Get access token(s) from config
+        config = self.settings['jupyter_power_usage_config']
         self.access_tokens = {}
-        self.access_tokens['emaps'] = self.settings[
-            'jupyter_power_usage_config'
-        ].emaps_access_token
+        self.access_tokens['emaps'] = config.emaps_access_token
+
+        # Cache of upstream responses shared by all clients
+        self.cache = cache
+
+        # Offline carbon intensity table that answers latest carbon intensity
+        # requests without network
+        self.carbon_table = carbon_table
+        self.carbon_table_primary = config.carbon_table_priority == 'primary'
+
+    async def fetch(self, api_path, token):
+        """Fetch data from electricity maps and return it with its TTL"""
+        return await fetch_emaps(
+            self.client,
+            api_path,
+            token,
+            self.cache.ttl if self.cache is not None else 0,
+        )
 
     @web.authenticated
     async def get(self, path):
@@ -130,7 +415,17 @@ class ElectrictyMapsHandler(JupyterHandler):
         try:
             query = self.request.query_arguments
             params = {key: query[key][0].decode() for key in query}
-            api_path = url_path_join('https://api.electricitymap.org', url_escape(path))
+
+            # Latest carbon intensity is served from offline table if it is the
+            # primary source
+            offline = None
+            if path.rstrip('/') == EMAPS_LATEST_PATH:
+                offline = make_carbon_table_response(
+                    self.carbon_table, params.get('zone')
+                )
+            if offline is not None and self.carbon_table_primary:
+                self.finish(offline)
+                return
 
             access_token = params.pop('access_token', None)
             if self.access_tokens['emaps']:
@@ -141,20 +436,25 @@ class ElectrictyMapsHandler(JupyterHandler):
             else:
                 token = ''
 
-            api_path = url_concat(api_path, params)
+            api_path = get_emaps_cache_key(path, params)
 
-            request = HTTPRequest(
-                api_path,
-                user_agent='JupyterLab Power Usage',
-                headers={'auth-token': f'{token}'},
-            )
-            response = await self.client.fetch(request)
-            data = json.loads(response.body.decode('utf-8'))
+            if self.cache is None:
+                data, _ = await self.fetch(api_path, token)
+            else:
+                data = await self.cache.get(
+                    api_path, partial(self.fetch, api_path, token)
+                )
 
             # Send the results back.
-            self.finish(json.dumps(data))
+            self.finish(data)
 
-        except HTTPError as err:
+        except (HTTPError, OSError) as err:
+            # Fall back to offline table when upstream is not reachable
+            if offline is not None:
+                self.finish(offline)
+                return
+            if not isinstance(err, HTTPError):
+                raise web.HTTPError(502, f'Electricity Maps is not reachable: {err}')
             self.set_status(err.code)
             message = err.response.body if err.response else str(err.code)
             self.finish(message)
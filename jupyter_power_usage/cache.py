@@ -0,0 +1,137 @@
+import asyncio
+import re
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+
+# Time in sec for which an expired value can still be served while it is being
+# refreshed or when upstream is failing
+CACHE_MAX_STALE = 3600
+
+
+def get_cache_ttl(headers, default):
+    """Get TTL in sec of a response from its cache headers
+
+    TTL given by upstream can only shorten the default TTL.
+    """
+    cache_control = headers.get('Cache-Control', '').lower()
+    if 'no-store' in cache_control or 'no-cache' in cache_control:
+        return 0
+
+    # Shared caches prefer s-maxage over max-age
+    for directive in ('s-maxage', 'max-age'):
+        match = re.search(rf'(?:^|[\s,]){directive}\s*=\s*"?(\d+)', cache_control)
+        if match:
+            return min(int(match.group(1)), default)
+
+    expires = headers.get('Expires')
+    if expires:
+        try:
+            return min(
+                max(parsedate_to_datetime(expires).timestamp() - time.time(), 0),
+                default,
+            )
+        except (TypeError, ValueError):
+            # Invalid dates mean already expired
+            return 0
+    return default
+
+
+class CacheEntry:
+    """A cached value with its expiry times"""
+
+    __slots__ = ('value', 'expires', 'stale_until')
+
+    def __init__(self, value, expires, stale_until):
+        self.value = value
+        self.expires = expires
+        self.stale_until = stale_until
+
+
+class ResponseCache:
+    """Bounded LRU cache of upstream responses with TTL
+
+    Concurrent misses of same key are coalesced into a single upstream fetch.
+    Once a value has expired, it is still served for up to max_stale sec while it
+    is revalidated in background so that clients never wait on a slow upstream and
+    a failing upstream does not hide the last known value.
+    """
+
+    def __init__(self, ttl=300, max_size=128, max_stale=CACHE_MAX_STALE, log=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.max_stale = max_stale
+        self.log = log
+
+        self._entries = OrderedDict()
+
+        # Futures of ongoing upstream fetches by key
+        self._inflight = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def peek(self, key):
+        """Get value of key if it is cached and not too stale without fetching
+        it from upstream. Returns None otherwise"""
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() >= entry.stale_until:
+            return None
+        return entry.value
+
+    async def get(self, key, fetch):
+        """Get value of key from cache or from upstream
+
+        fetch is a coroutine function that returns the value and its TTL in sec.
+        If TTL is None, default TTL is used.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            now = time.monotonic()
+            if now < entry.expires:
+                return entry.value
+            if now < entry.stale_until:
+                # Serve stale value while it is revalidated in background
+                self._refresh(key, fetch)
+                return entry.value
+
+        # Do not cancel the shared fetch when one of the waiting clients is gone
+        return await asyncio.shield(self._refresh(key, fetch))
+
+    def _refresh(self, key, fetch):
+        """Start an upstream fetch of key unless one is already ongoing"""
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._fetch(key, fetch))
+            self._inflight[key] = future
+            future.add_done_callback(lambda f: self._done(key, f))
+        return future
+
+    def _done(self, key, future):
+        """Cleanup after an upstream fetch"""
+        self._inflight.pop(key, None)
+        # Retrieve exception of background revalidations that nobody awaits
+        if not future.cancelled() and future.exception() is not None:
+            if self.log is not None:
+                self.log.debug(
+                    'Failed to fetch %s from upstream due to %s'
+                    % (key, future.exception())
+                )
+
+    async def _fetch(self, key, fetch):
+        """Fetch value from upstream and cache it"""
+        value, ttl = await fetch()
+        if ttl is None:
+            ttl = self.ttl
+        if ttl > 0:
+            now = time.monotonic()
+            self._entries[key] = CacheEntry(
+                value, now + ttl, now + ttl + self.max_stale
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        else:
+            self._entries.pop(key, None)
+        return value
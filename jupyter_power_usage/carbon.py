@@ -0,0 +1,140 @@
+import argparse
+import csv
+import math
+import os
+import time
+
+import numpy as np
+
+# Magic bytes and version of carbon intensity table file format
+CARBON_TABLE_MAGIC = b'JPUCARBN'
+CARBON_TABLE_VERSION = 1
+
+# Header is followed by zone names and by a float32 table of carbon intensity in
+# g/kWh of shape (number of zones, 12 months, 24 hours of day) in UTC. Missing
+# values are NaN
+CARBON_TABLE_HEADER_DTYPE = np.dtype(
+    [('magic', 'S8'), ('version', '<u4'), ('nzones', '<u4')]
+)
+CARBON_TABLE_ZONE_DTYPE = np.dtype('S16')
+
+
+def build_carbon_table(rows):
+    """Build zones and table of carbon intensity from rows of zone, month, hour
+    and carbon intensity in g/kWh
+
+    Month is in 1-12 and hour in 0-23 UTC. A month or hour that is None applies
+    to all months or hours of the zone. More specific rows take precedence over
+    less specific ones irrespective of their order.
+    """
+    if not rows:
+        raise ValueError('No carbon intensity to build a table from')
+    rows = sorted(rows, key=lambda row: (row[1] is not None) + (row[2] is not None))
+    zones = sorted({row[0].upper() for row in rows})
+    for zone in zones:
+        if len(zone.encode()) > CARBON_TABLE_ZONE_DTYPE.itemsize:
+            raise ValueError(f'Zone {zone} is too long')
+    index = {zone: i for i, zone in enumerate(zones)}
+    table = np.full((len(zones), 12, 24), np.nan, dtype='<f4')
+    for zone, month, hour, intensity in rows:
+        months = slice(None) if month is None else month - 1
+        hours = slice(None) if hour is None else hour
+        table[index[zone.upper()], months, hours] = intensity
+    return zones, table
+
+
+def read_carbon_csv(path):
+    """Read rows of carbon intensity from a CSV file with zone, month, hour and
+    carbon_intensity columns. Month and hour can be empty"""
+
+    def parse(value, low, high):
+        if value is None or value.strip() in ('', '*'):
+            return None
+        value = int(value)
+        if not low <= value <= high:
+            raise ValueError(f'{value} is not in [{low}, {high}]')
+        return value
+
+    with open(path, newline='') as f:
+        return [
+            (
+                row['zone'].strip(),
+                parse(row.get('month'), 1, 12),
+                parse(row.get('hour'), 0, 23),
+                float(row['carbon_intensity']),
+            )
+            for row in csv.DictReader(f)
+        ]
+
+
+def write_carbon_table(path, zones, table):
+    """Write zones and table of carbon intensity to a file atomically"""
+    header = np.zeros((), dtype=CARBON_TABLE_HEADER_DTYPE)
+    header['magic'] = CARBON_TABLE_MAGIC
+    header['version'] = CARBON_TABLE_VERSION
+    header['nzones'] = len(zones)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(header.tobytes())
+        f.write(
+            np.array([z.encode() for z in zones], CARBON_TABLE_ZONE_DTYPE).tobytes()
+        )
+        f.write(np.ascontiguousarray(table, dtype='<f4').tobytes())
+    os.replace(tmp_path, path)
+
+
+class CarbonIntensityTable:
+    """Precompiled table of carbon intensity by zone, month and hour of day
+
+    The table is memory mapped read only so that it is shared by all servers of
+    a host through page cache and only the pages that are looked up are read.
+    Lookups do not need any network access and take constant time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        header = np.memmap(path, dtype=CARBON_TABLE_HEADER_DTYPE, mode='r', shape=())
+        if (
+            header['magic'] != CARBON_TABLE_MAGIC
+            or header['version'] != CARBON_TABLE_VERSION
+        ):
+            raise ValueError(f'{path} is not a compatible carbon intensity table')
+        nzones = int(header['nzones'])
+        offset = CARBON_TABLE_HEADER_DTYPE.itemsize
+        zones = np.memmap(
+            path, dtype=CARBON_TABLE_ZONE_DTYPE, mode='r', offset=offset, shape=nzones
+        )
+        self.zones = {zone.decode(): i for i, zone in enumerate(zones)}
+        self.table = np.memmap(
+            path,
+            dtype='<f4',
+            mode='r',
+            offset=offset + nzones * CARBON_TABLE_ZONE_DTYPE.itemsize,
+            shape=(nzones, 12, 24),
+        )
+
+    def lookup(self, zone, timestamp=None):
+        """Get carbon intensity in g/kWh of zone at timestamp or None if it is not
+        in table. Defaults to current time"""
+        index = self.zones.get(zone.upper())
+        if index is None:
+            return None
+        t = time.gmtime(timestamp)
+        intensity = float(self.table[index, t.tm_mon - 1, t.tm_hour])
+        return None if math.isnan(intensity) else intensity
+
+
+def main(argv=None):
+    """Build a carbon intensity table from a CSV file"""
+    parser = argparse.ArgumentParser(
+        description='Build a carbon intensity table used by Jupyter servers offline'
+    )
+    parser.add_argument(
+        'csv',
+        help='CSV file with zone, month, hour and carbon_intensity (g/kWh) '
+        'columns. Empty month or hour applies to all months or hours',
+    )
+    parser.add_argument('-o', '--output', required=True, help='Output table file')
+    args = parser.parse_args(argv)
+    zones, table = build_carbon_table(read_carbon_csv(args.csv))
+    write_carbon_table(args.output, zones, table)
@@ -0,0 +1,339 @@
+import time
+from collections import deque
+from collections import namedtuple
+from functools import partial
+
+import psutil
+
+from .procs import PSUTIL_EXCEPTIONS
+
+# Message types of kernel iopub channel that delimit executions
+CELL_MSG_TYPES = ('status', 'execute_input')
+
+# Schema of events emitted by kernel manager when kernels are started
+KERNEL_ACTIONS_SCHEMA = 'https://events.jupyter.org/jupyter_server/kernel_actions/v1'
+
+# Raw counters read when a kernel starts or finishes an execution. rapl maps
+# RAPL domains to energy in uJ, gpu is a list of energy of each device in mJ,
+# host_cpu_time and kernel_cpu_time are CPU times in sec of the host and of
+# process subtree of the kernel
+CounterSnapshot = namedtuple(
+    'CounterSnapshot', ['timestamp', 'rapl', 'gpu', 'host_cpu_time', 'kernel_cpu_time']
+)
+
+
+class CellEnergyRecorder:
+    """Record energy used by each execution of notebook cells
+
+    iopub channel of each local kernel is observed and raw counters are read
+    when the kernel gets busy and idle for an execute_request. Energy used by
+    the host during the execution is attributed to the process subtree of the
+    kernel by its share of host CPU time. DRAM energy is attributed by the same
+    share as memory is not read on the message path. GPU energy is attributed
+    by share of devices used by the subtree. When devices have no energy
+    counter, GPU power usage of the kernel sampled by the sampler is integrated
+    over the execution instead. GPU energy is None when no GPU is available.
+
+    Messages are only parsed on event loop. Counters are read on the sampling
+    thread in the order of messages, so that the event loop is never blocked by
+    reading them. Process subtree of each kernel is the one found by the latest
+    scan of the sampler, so that no process scan is made and processes that
+    exit during an execution are accounted for through CPU times of their
+    reaped children. When counters are fetched from a collector, RAPL counters
+    are the ones of its latest snapshot and energy of executions shorter than
+    its period is approximate.
+
+    Kernels are observed as soon as kernel manager reports that they have
+    started and on each reading of sampler.
+    """
+
+    def __init__(self, sampler, max_cells=1000, log=None):
+        self.sampler = sampler
+        self.cpu_power_usage = sampler.cpu_power_usage
+        self.gpu_power_usage = sampler.gpu_power_usage
+        self.executor = sampler.executor
+        self.max_cells = max_cells
+        self.log = log
+
+        # Finished executions of each kernel by kernel id
+        self.cells = {}
+
+        # Counters at start and execution count of executions in progress by
+        # kernel id and message id of execute request
+        self._pending = {}
+
+        # iopub streams and pids of observed kernels by kernel id
+        self._streams = {}
+        self._kernel_pids = {}
+
+        # Cached process handles of kernel subtrees by pid and create time
+        self._procs = {}
+
+    def get_kernel_cpu_time(self, pids):
+        """Get CPU time of processes including their reaped children
+
+        Handles are cached by pid and create time found by the latest scan so
+        that a reused pid is never mistaken for an exited process. Processes
+        that have not been scanned yet are inspected without caching.
+        """
+        process_table = self.cpu_power_usage.process_table
+        cpu_time = 0
+        for pid in pids:
+            key = (pid, process_table.get_create_time(pid))
+            proc = self._procs.get(key)
+            try:
+                if proc is None:
+                    proc = psutil.Process(pid)
+                    if key[1] == proc.create_time():
+                        self._procs[key] = proc
+                t = proc.cpu_times()
+            except PSUTIL_EXCEPTIONS:
+                self._procs.pop(key, None)
+                continue
+            cpu_time += t.user + t.system + t.children_user + t.children_system
+        return cpu_time
+
+    def prune(self):
+        """Forget handles of processes that are not in process table anymore"""
+        process_table = self.cpu_power_usage.process_table
+        self._procs = {
+            (pid, create_time): proc
+            for (pid, create_time), proc in self._procs.items()
+            if process_table.get_create_time(pid) == create_time
+        }
+
+    def read_counters(self, pids):
+        """Read raw counters of the host and CPU time of processes"""
+        cpu = self.cpu_power_usage
+        rapl = {}
+        if cpu.initialized and cpu.power_usage_available():
+            rapl = cpu.get_rapl_counters()
+        gpu = []
+        if self.gpu_power_usage.initialized:
+            gpu = self.gpu_power_usage.read_energy_counters()
+        return CounterSnapshot(
+            time.time(),
+            rapl,
+            gpu,
+            self.cpu_power_usage.get_total_cpu_time(psutil.cpu_times()),
+            self.get_kernel_cpu_time(pids),
+        )
+
+    def integrate_gpu_power(self, kernel_id, start, end):
+        """Integrate GPU power usage of a kernel in readings of sampler between
+        two timestamps into energy in J or None if it has not been sampled
+
+        Each reading holds average power usage since previous reading. Time after
+        latest reading is accounted for with its power usage.
+        """
+        energy = None
+        previous = None
+        usage = None
+        for reading in list(self.sampler.readings):
+            timestamp = reading.get('timestamp')
+            kernel = reading.get('kernels', {}).get(kernel_id, {})
+            if 'gpu' not in kernel:
+                previous = timestamp
+                continue
+            usage = kernel['gpu']['usage']
+            if previous is not None and timestamp > start:
+                covered = min(timestamp, end) - max(previous, start)
+                energy = (energy or 0) + usage * max(covered, 0)
+            previous = timestamp
+            if timestamp >= end:
+                return energy
+        if usage is None:
+            return None
+        return (energy or 0) + usage * (end - max(previous, start))
+
+    def get_energy(self, start, end, pids, kernel_id=None):
+        """Get energy in J attributed to processes of a kernel between two
+        snapshots"""
+        host_cpu_time = end.host_cpu_time - start.host_cpu_time
+        share = 0
+        if host_cpu_time > 0:
+            share = (end.kernel_cpu_time - start.kernel_cpu_time) / host_cpu_time
+            share = min(max(share, 0), 1)
+
+        package = dram = 0
+        overflows = getattr(self.cpu_power_usage, 'rapl_domain_overflow_counters', {})
+        for domain, energy in end.rapl.items():
+            # Counters that have never been read are skipped
+            if energy is None or start.rapl.get(domain) is None:
+                continue
+            diff = energy - start.rapl[domain]
+            # If diff is less than 0, counters have overflown
+            if diff < 0:
+                diff += overflows.get(domain, 0)
+            if domain.startswith('dram'):
+                dram += diff / 1e6
+            else:
+                package += diff / 1e6
+
+        gpu = None
+        counters = start.gpu + end.gpu
+        if counters and None not in counters:
+            gpu = 0
+            handles = self.gpu_power_usage.handles
+            for handle, energy_t, energy in zip(handles, start.gpu, end.gpu):
+                if energy_t is None or energy is None:
+                    continue
+                try:
+                    gpu_share = self.gpu_power_usage.get_process_shares(
+                        handle, {'kernel': set(pids)}
+                    )['kernel']
+                except self.gpu_power_usage.nvml.NVMLError:
+                    continue
+                gpu += (energy - energy_t) / 1e3 * gpu_share
+        elif self.gpu_power_usage.initialized and start.gpu:
+            gpu = self.integrate_gpu_power(kernel_id, start.timestamp, end.timestamp)
+
+        cpu = (package + dram) * share
+        return share, {
+            'cpu': cpu,
+            'dram': dram * share,
+            'gpu': gpu,
+            'total': cpu + (gpu or 0),
+        }
+
+    def get_kernel_pids(self, kernel_id):
+        """Get pids of process subtree of a kernel found by latest scan or pid
+        of kernel if it has not been scanned yet"""
+        pids = self.sampler.kernel_subtrees.get(kernel_id)
+        if pids:
+            return pids
+        pid = self.sampler.kernel_pids.get(kernel_id, self._kernel_pids.get(kernel_id))
+        return [pid] if pid is not None else []
+
+    def handle_message(self, kernel_id, msg_type, parent, content):
+        """Update executions of a kernel with a message of its iopub channel
+
+        It must be called on the sampling thread as it reads counters.
+        """
+        if parent.get('msg_type') != 'execute_request':
+            return
+        msg_id = parent.get('msg_id')
+        pending = self._pending.setdefault(kernel_id, {})
+        if msg_type == 'execute_input':
+            if msg_id in pending:
+                pending[msg_id]['execution_count'] = content.get('execution_count')
+            return
+
+        state = content.get('execution_state')
+        if state == 'busy':
+            pending[msg_id] = {
+                'start': self.read_counters(self.get_kernel_pids(kernel_id)),
+                'execution_count': None,
+            }
+        elif state == 'idle' and msg_id in pending:
+            execution = pending.pop(msg_id)
+            pids = self.get_kernel_pids(kernel_id)
+            start, end = execution['start'], self.read_counters(pids)
+            share, energy = self.get_energy(start, end, pids, kernel_id)
+            cells = self.cells.setdefault(kernel_id, deque(maxlen=self.max_cells))
+            cells.append(
+                {
+                    'msg_id': msg_id,
+                    'execution_count': execution['execution_count'],
+                    'start': start.timestamp,
+                    'end': end.timestamp,
+                    'duration': end.timestamp - start.timestamp,
+                    'cpu_share': share,
+                    'energy': energy,
+                }
+            )
+            self.prune()
+
+    def _handle_message(self, *args):
+        """Handle a message on the sampling thread and log failures"""
+        try:
+            self.handle_message(*args)
+        except Exception as err:
+            if self.log is not None:
+                self.log.debug('Failed to record cell energy due to %s' % err)
+
+    def _on_recv(self, kernel_id, session, msg_list):
+        """Parse iopub messages that delimit executions and hand them over to
+        the sampling thread. Returns the future of the handled message or None
+
+        Header is parsed first so that content of outputs is never unpacked.
+        """
+        try:
+            _, msg_list = session.feed_identities(msg_list)
+            msg = session.deserialize(msg_list, content=False)
+            msg_type = msg['header']['msg_type']
+            if msg_type not in CELL_MSG_TYPES:
+                return None
+            content = session.unpack(msg['content'])
+        except Exception as err:
+            if self.log is not None:
+                self.log.debug('Failed to parse kernel message due to %s' % err)
+            return None
+        return self.executor.submit(
+            self._handle_message, kernel_id, msg_type, msg['parent_header'], content
+        )
+
+    def observe(self, kernel_manager, kernel_id):
+        """Observe iopub channel of a kernel"""
+        try:
+            kernel = kernel_manager.get_kernel(kernel_id)
+            stream = kernel.connect_iopub()
+        except Exception as err:
+            if self.log is not None:
+                self.log.debug(
+                    'Failed to observe kernel %s due to %s' % (kernel_id, err)
+                )
+            return
+        stream.on_recv(partial(self._on_recv, kernel_id, kernel.session))
+        self._streams[kernel_id] = stream
+        pid = getattr(getattr(kernel, 'provisioner', None), 'pid', None)
+        if isinstance(pid, int):
+            self._kernel_pids[kernel_id] = pid
+
+    def forget(self, kernel_id):
+        """Stop observing a kernel and forget its executions"""
+        stream = self._streams.pop(kernel_id, None)
+        if stream is not None:
+            stream.close()
+        self._kernel_pids.pop(kernel_id, None)
+        self._pending.pop(kernel_id, None)
+        self.cells.pop(kernel_id, None)
+
+    def sync_kernels(self):
+        """Observe iopub channel of new kernels and forget kernels that have
+        stopped"""
+        kernel_manager = getattr(self.sampler.server_app, 'kernel_manager', None)
+        if kernel_manager is None:
+            return
+        kernel_ids = set(kernel_manager.list_kernel_ids())
+        for kernel_id in kernel_ids - self._streams.keys():
+            self.observe(kernel_manager, kernel_id)
+        for kernel_id in self._streams.keys() - kernel_ids:
+            self.forget(kernel_id)
+
+    async def on_kernel_action(self, logger, schema_id, data):
+        """Observe kernels as soon as they are started or restarted"""
+        if data.get('status') != 'success' or 'kernel_id' not in data:
+            return
+        if data['action'] in ('start', 'restart'):
+            kernel_id = data['kernel_id']
+            # Restarted kernels are observed through a new connection
+            stream = self._streams.pop(kernel_id, None)
+            if stream is not None:
+                stream.close()
+            kernel_manager = self.sampler.server_app.kernel_manager
+            self.observe(kernel_manager, kernel_id)
+
+    def update(self, reading):
+        """Update observed kernels with each new reading of sampler"""
+        self.sync_kernels()
+
+    def get_cells(self, kernel_id):
+        """Get finished executions of a kernel"""
+        return list(self.cells.get(kernel_id, ()))
+
+    def close(self):
+        """Stop observing kernels"""
+        for stream in self._streams.values():
+            stream.close()
+        self._streams = {}
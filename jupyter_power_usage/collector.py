@@ -0,0 +1,172 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import stat
+import time
+
+import psutil
+
+from .utils import filter_rapl_domains
+from .utils import RaplReader
+from .utils import read_meminfo
+
+# Default path of collector socket
+DEFAULT_COLLECTOR_SOCKET = '/run/jupyter-power-usage/collector.sock'
+
+# Time in sec for which a snapshot is served to all clients before it is
+# refreshed
+DEFAULT_SNAPSHOT_MAX_AGE = 0.1
+
+# Timeout in sec of requests made by clients
+COLLECTOR_TIMEOUT = 1
+
+# Host memory info fields published by collector
+MEMINFO_FIELDS = ('MemTotal', 'MemFree', 'MemAvailable')
+
+
+class HostCollector:
+    """Publish host wide counters to clients connected on a Unix domain socket
+
+    A single collector per host reads RAPL counters, host CPU times and host
+    memory info so that single user servers on the same host only compute the
+    share of their own scope instead of repeating the same host wide work. Clients
+    send a newline terminated request and get a snapshot encoded as a
+    JSON line. A snapshot is read and encoded at most once per max_age sec
+    irrespective of number of clients.
+    """
+
+    def __init__(self, max_age=DEFAULT_SNAPSHOT_MAX_AGE):
+        self.max_age = max_age
+        (
+            self.rapl_domains,
+            self.rapl_domain_power_limits,
+            self.rapl_domain_overflow_counters,
+        ) = filter_rapl_domains()
+        self.rapl_domain_names = list(self.rapl_domains.keys())
+        self.rapl_reader = RaplReader(self.rapl_domains)
+
+        self._snapshot = None
+        self._snapshot_time = -float('inf')
+
+    def snapshot(self):
+        """Read host wide counters"""
+        meminfo = read_meminfo()
+        return {
+            'timestamp': time.time(),
+            'rapl': dict(zip(self.rapl_domain_names, self.rapl_reader.read())),
+            'power_limits': self.rapl_domain_power_limits,
+            'overflow_counters': self.rapl_domain_overflow_counters,
+            'cpu_times': psutil.cpu_times()._asdict(),
+            'meminfo': {k: meminfo.get(k, 0) for k in MEMINFO_FIELDS},
+        }
+
+    def get_encoded_snapshot(self):
+        """Return latest snapshot encoded as a JSON line"""
+        now = time.monotonic()
+        if now - self._snapshot_time > self.max_age:
+            self._snapshot = (json.dumps(self.snapshot()) + '\n').encode()
+            self._snapshot_time = now
+        return self._snapshot
+
+    async def handle(self, reader, writer):
+        """Serve snapshots to a client until it disconnects"""
+        try:
+            while await reader.readline():
+                writer.write(self.get_encoded_snapshot())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, path, mode=0o666):
+        """Start serving on socket path"""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # Remove stale socket of a previous collector
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            os.remove(path)
+        server = await asyncio.start_unix_server(self.handle, path)
+        os.chmod(path, mode)
+        return server
+
+    async def serve(self, path, mode=0o666):
+        """Serve on socket path forever"""
+        server = await self.start(path, mode)
+        async with server:
+            await server.serve_forever()
+
+
+class CollectorClient:
+    """Blocking client of host collector
+
+    A single connection is kept open and it is reopened on the next request if
+    collector goes away.
+    """
+
+    def __init__(self, path, timeout=COLLECTOR_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+
+    def _connect(self):
+        """Connect to collector"""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except Exception:
+            sock.close()
+            raise
+        self._sock = sock
+        self._file = sock.makefile('rb')
+
+    def get_snapshot(self):
+        """Get a snapshot of host wide counters. Raises OSError or ValueError if
+        collector is not available"""
+        if self._sock is None:
+            self._connect()
+        try:
+            self._sock.sendall(b'snapshot\n')
+            line = self._file.readline()
+            if not line:
+                raise ConnectionError('Collector closed connection')
+            return json.loads(line)
+        except (OSError, ValueError):
+            self.close()
+            raise
+
+    def close(self):
+        """Close connection to collector"""
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+            self._sock = None
+            self._file = None
+
+
+def main(argv=None):
+    """Run host collector"""
+    parser = argparse.ArgumentParser(
+        description='Collect host wide power usage counters for Jupyter servers'
+    )
+    parser.add_argument(
+        '--socket',
+        default=DEFAULT_COLLECTOR_SOCKET,
+        help='Path of Unix domain socket to serve on',
+    )
+    parser.add_argument(
+        '--mode',
+        default='666',
+        help='Permissions of socket in octal',
+    )
+    parser.add_argument(
+        '--max-age',
+        type=float,
+        default=DEFAULT_SNAPSHOT_MAX_AGE,
+        help='Time in sec for which a snapshot is shared by all clients',
+    )
+    args = parser.parse_args(argv)
+    asyncio.run(HostCollector(args.max_age).serve(args.socket, int(args.mode, 8)))
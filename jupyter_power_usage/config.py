@@ -1,5 +1,9 @@
+from traitlets import Bool
 from traitlets import Enum
+from traitlets import Float
+from traitlets import Integer
 from traitlets import Unicode
+from traitlets import validate
 from traitlets.config import Configurable
 
 # Minimum measurement period in millisec.
@@ -11,14 +15,18 @@ class PowerUsageDisplay(Configurable):
     """Server side config for jupyterlab-power-usage"""
 
     measurement_scope = Enum(
-        ['process', 'user', 'sys'],
+        ['process', 'user', 'cgroup', 'sys'],
         default_value='process',
-        help="""Scope of measurement. It can take one of three options:
+        help="""Scope of measurement. It can take one of four options:
         
         - `process`: Power usage for current process and its children will
           be reported
         - `user`: Power usage for current user processes will be reported
-        - `system`: Power usage for entire system will be reported.
+        - `cgroup`: Power usage for all processes in the cgroup v2 of current
+          process will be reported. CPU and memory usage are read directly from
+          cgroup accounting files which is cheaper than walking processes. If
+          cgroup v2 is not available, `process` scope will be used
+        - `sys`: Power usage for entire system will be reported.
 
         By default only current process power usage will be reported.
 
@@ -27,6 +35,209 @@ class PowerUsageDisplay(Configurable):
         """,
     ).tag(config=True)
 
+    report_all_scopes = Bool(
+        False,
+        help="""Compute power usage of `process`, `user` and `sys` measurement
+        scopes on every sample and report them all along with power usage of
+        `measurement_scope`.
+
+        All scopes share the same RAPL reading and the same pass over processes
+        so that it costs about the same as reporting only the scope with most
+        processes.
+        """,
+    ).tag(config=True)
+
+    memory_accounting = Enum(
+        ['meminfo', 'pss', 'rss'],
+        default_value='meminfo',
+        help="""Method to estimate memory share of processes in current scope. It
+        can take one of three options:
+
+        - `meminfo`: RSS of processes in current scope compared to memory in use on
+          the host read from /proc/meminfo.
+        - `pss`: Same as `meminfo` but proportional set size (PSS) of processes is
+          used instead of RSS. This is more accurate as shared memory is not
+          counted multiple times but it is more expensive to read.
+        - `rss`: RSS of processes in current scope compared to sum of RSS of all
+          processes on the host. This needs a scan of all processes on every
+          sample and it can be expensive on hosts with a lot of processes.
+
+        This is only applicable to `process` and `user` measurement scopes.
+        """,
+    ).tag(config=True)
+
+    sampling_period = Integer(
+        5000,
+        help=f"""Period in ms at which power usage is sampled on the server.
+
+        A single background task samples the power usage at this period and all
+        the clients are served with the latest reading. It cannot be less than
+        {MIN_MEASUREMENT_PERIOD} ms.
+        """,
+    ).tag(config=True)
+
+    adaptive_sampling = Bool(
+        True,
+        help=f"""Adapt sampling period to power usage and client activity.
+
+        Power usage is sampled faster, down to {MIN_MEASUREMENT_PERIOD} ms, while it
+        is changing and at `sampling_period` while it is steady. When no client
+        has made a request for `client_idle_timeout` sec, sampling backs off up to
+        `max_sampling_period`. Sampling never takes more than a small fraction of
+        the time irrespective of the period.
+        """,
+    ).tag(config=True)
+
+    max_sampling_period = Integer(
+        60000,
+        help="""Longest period in ms at which power usage is sampled when no client
+        is active. Only used when `adaptive_sampling` is enabled.""",
+    ).tag(config=True)
+
+    client_idle_timeout = Integer(
+        60,
+        help="""Time in sec after the last client request after which sampling
+        backs off to `max_sampling_period`.""",
+    ).tag(config=True)
+
+    sampling_buffer_size = Integer(
+        120,
+        help="""Number of latest power usage readings to keep in memory.""",
+    ).tag(config=True)
+
+    overhead_enabled = Bool(
+        False,
+        help="""Record wall and CPU time spent by the power meter in each phase of
+        sampling. Histograms are exposed at the debug endpoint and in Prometheus
+        metrics and cost of latest sample is added to power usage payload.
+
+        CPU time consumed by the power meter is never billed to the measurement
+        scope irrespective of this option.""",
+    ).tag(config=True)
+
+    energy_ledger_enabled = Bool(
+        True,
+        help="""Persist cumulative energy usage to a ledger file so that it survives
+        server restarts.""",
+    ).tag(config=True)
+
+    energy_ledger_path = Unicode(
+        '',
+        help="""Path to energy ledger file. If empty, ledger is stored in Jupyter
+        data directory.""",
+    ).tag(config=True)
+
+    energy_ledger_capacity = Integer(
+        100000,
+        help="""Maximum number of records in energy ledger file. When full, older
+        records are compacted.""",
+    ).tag(config=True)
+
+    energy_ledger_fsync_interval = Integer(
+        60,
+        help="""Interval in seconds at which energy ledger is synced to disk.""",
+    ).tag(config=True)
+
+    collector_socket = Unicode(
+        '',
+        help="""Path to Unix domain socket of node local power usage collector.
+
+        When set, RAPL counters and host wide CPU and memory totals are fetched
+        from the collector that is shared by all servers on the host, and only the
+        share of the current scope is computed by the server. If the collector is
+        not available, counters are read directly.
+        """,
+    ).tag(config=True)
+
     emaps_access_token = Unicode(
         '', help="An API access token for Electricty Maps."
     ).tag(config=True)
+
+    emaps_cache_ttl = Integer(
+        300,
+        help="""Time in seconds for which responses of Electricity Maps API are
+        cached on the server. Upstream cache headers can only shorten it. Set it to
+        0 to disable caching.""",
+    ).tag(config=True)
+
+    emaps_cache_size = Integer(
+        128,
+        help="""Maximum number of Electricity Maps API responses kept in cache.""",
+    ).tag(config=True)
+
+    emission_factor = Float(
+        475,
+        help="""Carbon intensity in gCO2e/kWh used to integrate emissions on the
+        server when the carbon intensity of `emissions_zone` is not available.""",
+    ).tag(config=True)
+
+    emissions_zone = Unicode(
+        '',
+        help="""Zone of Electricity Maps, like `FR`, whose latest carbon intensity
+        is used to integrate emissions on the server.
+
+        Carbon intensity is read from responses of Electricity Maps API cached by
+        the server. When `emaps_access_token` is set, the server refreshes it by
+        itself. Otherwise, it is only available when clients fetch it through the
+        server. `emission_factor` is used when carbon intensity is not available.
+        """,
+    ).tag(config=True)
+
+    carbon_table_path = Unicode(
+        '',
+        help="""Path to an offline carbon intensity table built with
+        `jupyter-power-usage-carbon-table` command.
+
+        Carbon intensity of a zone is looked up in the table by month and hour
+        of day without any network access. It is used when Electricity Maps API
+        is not reachable and to integrate emissions of `emissions_zone` on the
+        server.
+        """,
+    ).tag(config=True)
+
+    carbon_table_priority = Enum(
+        ['fallback', 'primary'],
+        default_value='fallback',
+        help="""Priority of offline carbon intensity table over Electricity Maps.
+
+        - `fallback`: Table is only used when Electricity Maps is not available.
+        - `primary`: Table is used for latest carbon intensity of zones it has
+          and Electricity Maps is only requested for other zones.
+        """,
+    ).tag(config=True)
+
+    cell_energy_enabled = Bool(
+        True,
+        help="""Record energy used by each execution of notebook cells.
+
+        Messages of local kernels are observed and raw energy counters are read
+        when a kernel starts and finishes an execution. Energy is attributed to
+        the process subtree of the kernel and served per kernel at
+        `api/metrics/v1/power_usage/cells`.""",
+    ).tag(config=True)
+
+    cell_energy_history_size = Integer(
+        1000,
+        help="""Number of latest executions of each kernel whose energy is kept in
+        memory.""",
+    ).tag(config=True)
+
+    @validate('sampling_period')
+    def _validate_sampling_period(self, proposal):
+        return max(proposal['value'], MIN_MEASUREMENT_PERIOD)
+
+    @validate('max_sampling_period')
+    def _validate_max_sampling_period(self, proposal):
+        return max(proposal['value'], MIN_MEASUREMENT_PERIOD)
+
+    @validate('sampling_buffer_size')
+    def _validate_sampling_buffer_size(self, proposal):
+        return max(proposal['value'], 1)
+
+    @validate('emaps_cache_size')
+    def _validate_emaps_cache_size(self, proposal):
+        return max(proposal['value'], 1)
+
+    @validate('cell_energy_history_size')
+    def _validate_cell_energy_history_size(self, proposal):
+        return max(proposal['value'], 1)
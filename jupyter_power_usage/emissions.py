@@ -0,0 +1,113 @@
+import asyncio
+import time
+
+# Number of J in a kWh
+J_PER_KWH = 3.6e6
+
+
+class EmissionsIntegrator:
+    """Integrate power usage times carbon intensity into cumulative emissions
+
+    Emissions in gCO2e of each measurement scope are integrated on every reading
+    made by sampler so that they are accounted for irrespective of clients.
+    Carbon intensity is taken from the first of sources that has it, like the
+    cache of Electricity Maps responses shared with the proxy handler or an
+    offline carbon intensity table. The static factor is used when no source
+    has it.
+
+    get_scope returns the measurement scope in use, which is only known once
+    CPU power usage backend has been initialized. sources is a list of source
+    names and callables that return carbon intensity in g/kWh at a timestamp or
+    None. refresh is a coroutine function that refreshes sources in background
+    at most once per refresh_interval sec.
+    """
+
+    def __init__(
+        self,
+        get_scope,
+        factor,
+        sources=(),
+        refresh=None,
+        refresh_interval=300,
+        log=None,
+    ):
+        self.get_scope = get_scope
+        self.factor = factor
+        self.sources = list(sources)
+        self.refresh = refresh
+        self.refresh_interval = refresh_interval
+        self.log = log
+
+        # Carbon intensity in g/kWh used for latest reading and its source
+        self.intensity = factor
+        self.source = 'static'
+
+        # Cumulative emissions in g of each scope
+        self.totals = {}
+
+        self._last_timestamp = None
+        self._next_refresh = 0
+        self._refresh_task = None
+
+    def _refresh(self):
+        """Refresh intensity in background unless a refresh is ongoing"""
+        now = time.monotonic()
+        if self.refresh is None or now < self._next_refresh:
+            return
+        if self._refresh_task is not None and not self._refresh_task.done():
+            return
+        self._next_refresh = now + self.refresh_interval
+        self._refresh_task = asyncio.ensure_future(self.refresh())
+        self._refresh_task.add_done_callback(self._refreshed)
+
+    def _refreshed(self, task):
+        """Log failed refreshes"""
+        if not task.cancelled() and task.exception() is not None:
+            if self.log is not None:
+                self.log.debug(
+                    'Failed to refresh carbon intensity due to %s' % task.exception()
+                )
+
+    def update_intensity(self, timestamp=None):
+        """Update carbon intensity from first source that has it or fall back to
+        static factor"""
+        for source, get_intensity in self.sources:
+            intensity = get_intensity(timestamp)
+            if intensity is not None:
+                self.intensity, self.source = intensity, source
+                return
+        self.intensity, self.source = self.factor, 'static'
+
+    @staticmethod
+    def get_usages(scope, reading):
+        """Get total power usage in W of each scope in a reading"""
+        scopes = reading.get('scopes') or {scope: reading}
+        return {
+            name: sum(values[k]['usage'] for k in ('cpu', 'gpu') if k in values)
+            for name, values in scopes.items()
+        }
+
+    def add(self, reading):
+        """Integrate a reading made by sampler"""
+        timestamp = reading['timestamp']
+        self._refresh()
+        self.update_intensity(timestamp)
+
+        # Power usage is average over the period since previous reading
+        if self._last_timestamp is not None:
+            factor = (timestamp - self._last_timestamp) / J_PER_KWH * self.intensity
+            for name, usage in self.get_usages(self.get_scope(), reading).items():
+                self.totals[name] = self.totals.get(name, 0) + usage * factor
+        self._last_timestamp = timestamp
+
+    def get_totals(self):
+        """Return cumulative emissions in g of each scope along with current
+        carbon intensity. configured is False when only static factor is used, in
+        which case clients may prefer their own carbon intensity"""
+        return {
+            'intensity': self.intensity,
+            'source': self.source,
+            'configured': bool(self.sources),
+            'total': self.totals.get(self.get_scope(), 0),
+            'scopes': dict(self.totals),
+        }
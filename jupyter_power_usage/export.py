@@ -0,0 +1,233 @@
+import argparse
+import math
+import shutil
+import sys
+import zipfile
+from urllib.parse import urlencode
+from urllib.request import Request
+from urllib.request import urlopen
+
+import numpy as np
+from numpy.lib import format as npy_format
+
+from .ledger import get_default_ledger_path
+from .ledger import LEDGER_DOMAINS
+from .ledger import read_ledger
+
+# Columns of exported series. Energy is cumulative energy in J and power is the
+# average power in W since previous row
+EXPORT_COLUMNS = (
+    ('timestamp',)
+    + tuple(f'{domain}_energy' for domain in LEDGER_DOMAINS)
+    + tuple(f'{domain}_power' for domain in LEDGER_DOMAINS)
+)
+
+# Number of ledger records read at once. Memory used by an export does not
+# depend on its range
+EXPORT_CHUNK_SIZE = 65536
+
+# Content type and file name of exports
+EXPORT_CONTENT_TYPE = 'application/octet-stream'
+EXPORT_FILE_NAME = 'power-usage.npz'
+
+
+def _make_chunk(rows, last):
+    """Make columns of a chunk from ledger rows and the row exported before
+    them"""
+    previous = np.empty_like(rows)
+    previous[1:] = rows[:-1]
+    previous[0] = np.nan if last is None else last
+    with np.errstate(divide='ignore', invalid='ignore'):
+        power = (rows[:, 1:] - previous[:, 1:]) / (rows[:, :1] - previous[:, :1])
+
+    chunk = {'timestamp': rows[:, 0]}
+    for i, domain in enumerate(LEDGER_DOMAINS):
+        chunk[f'{domain}_energy'] = rows[:, i + 1]
+        chunk[f'{domain}_power'] = power[:, i]
+    return chunk
+
+
+def iter_export_chunks(
+    records, count, since=0, until=math.inf, resolution=0, chunk_size=EXPORT_CHUNK_SIZE
+):
+    """Yield chunks of exported columns from count first records of a ledger
+
+    Only records with since <= timestamp <= until are exported. If resolution is
+    given in sec, only the last record of each time bucket of that size is kept.
+    As records hold cumulative energy, power of downsampled rows is the average
+    power over their bucket.
+
+    Records are read chunk_size at a time. Records that are moved when the
+    ledger is compacted during the export are skipped so that timestamps of
+    exported rows are always increasing.
+    """
+    timestamps = records[:count, 0]
+    start = int(np.searchsorted(timestamps, since, side='left'))
+    stop = int(np.searchsorted(timestamps, until, side='right'))
+
+    # Record preceding the range is only used to compute power of first row
+    last = np.array(records[start - 1]) if start > 0 else None
+
+    # Last row of previous chunk that can still be replaced by a later row of
+    # the same time bucket
+    pending = None
+    for offset in range(start, stop, chunk_size):
+        rows = np.array(records[offset : min(offset + chunk_size, stop)])
+        if pending is not None:
+            rows = np.concatenate([pending[np.newaxis], rows])
+            pending = None
+
+        newest = -math.inf if last is None else last[0]
+        rows = rows[rows[:, 0] > np.maximum.accumulate(np.append(newest, rows[:-1, 0]))]
+        if resolution > 0 and len(rows):
+            buckets = np.floor(rows[:, 0] / resolution)
+            pending = rows[-1]
+            rows = rows[:-1][buckets[1:] != buckets[:-1]]
+        if len(rows):
+            yield _make_chunk(rows, last)
+            last = rows[-1]
+
+    if pending is not None:
+        yield _make_chunk(pending[np.newaxis], last)
+
+
+class StreamBuffer:
+    """Unseekable file like object whose content is drained by its reader"""
+
+    def __init__(self):
+        self._data = []
+
+    def write(self, data):
+        self._data.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        """Return data written since last drain"""
+        data = b''.join(self._data)
+        self._data = []
+        return data
+
+
+class NpzChunkWriter:
+    """Write chunks of columns to a stream as a compressed npz archive
+
+    Each column of each chunk is a member named <column>/<chunk index>.npy so
+    that the archive is written sequentially and the stream does not need to
+    be seekable. Exports are loaded with load_export.
+    """
+
+    def __init__(self, fileobj):
+        self.zipfile = zipfile.ZipFile(
+            fileobj, mode='w', compression=zipfile.ZIP_DEFLATED, allowZip64=True
+        )
+        self.nchunks = 0
+
+    def write(self, chunk):
+        """Append a chunk of columns to archive"""
+        for column in EXPORT_COLUMNS:
+            name = f'{column}/{self.nchunks:06d}.npy'
+            with self.zipfile.open(name, 'w', force_zip64=True) as f:
+                npy_format.write_array(
+                    f, np.ascontiguousarray(chunk[column]), allow_pickle=False
+                )
+        self.nchunks += 1
+
+    def close(self):
+        """Write central directory of archive. Empty exports get an empty chunk so
+        that they are still valid npz archives"""
+        if self.nchunks == 0:
+            self.write({column: np.empty(0) for column in EXPORT_COLUMNS})
+        self.zipfile.close()
+
+
+def iter_export(records, count, **kwargs):
+    """Yield bytes of npz export of count first records of a ledger chunk by
+    chunk. kwargs are passed to iter_export_chunks"""
+    buffer = StreamBuffer()
+    writer = NpzChunkWriter(buffer)
+    for chunk in iter_export_chunks(records, count, **kwargs):
+        writer.write(chunk)
+        yield buffer.drain()
+    writer.close()
+    yield buffer.drain()
+
+
+def load_export(file):
+    """Load an export into a dict of columns"""
+    with np.load(file) as npz:
+        names = sorted(npz.files)
+        return {
+            column: np.concatenate(
+                [npz[name] for name in names if name.startswith(f'{column}/')]
+            )
+            for column in EXPORT_COLUMNS
+        }
+
+
+def main(argv=None):
+    """Export power usage history of a server"""
+    parser = argparse.ArgumentParser(
+        description='Export recorded power and energy usage as a npz archive'
+    )
+    parser.add_argument(
+        '--ledger',
+        default=None,
+        help='Path of energy ledger file. Defaults to ledger of local server',
+    )
+    parser.add_argument(
+        '--url',
+        default=None,
+        help='Base URL of a Jupyter server to export from instead of a local '
+        'ledger file',
+    )
+    parser.add_argument(
+        '--token',
+        default='',
+        help='Token used to authenticate with the Jupyter server',
+    )
+    parser.add_argument(
+        '--since', type=float, default=0, help='Start of range as UNIX timestamp'
+    )
+    parser.add_argument(
+        '--until', type=float, default=math.inf, help='End of range as UNIX timestamp'
+    )
+    parser.add_argument(
+        '--resolution',
+        type=float,
+        default=0,
+        help='Downsample to this resolution in sec. Full resolution by default',
+    )
+    parser.add_argument(
+        '-o', '--output', default='-', help='Output file. Defaults to stdout'
+    )
+    args = parser.parse_args(argv)
+
+    output = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+    try:
+        if args.url:
+            params = {'since': args.since, 'resolution': args.resolution}
+            if math.isfinite(args.until):
+                params['until'] = args.until
+            request = Request(
+                f'{args.url.rstrip("/")}/api/metrics/v1/power_usage/export?'
+                + urlencode(params),
+                headers={'Authorization': f'token {args.token}'} if args.token else {},
+            )
+            with urlopen(request) as response:
+                shutil.copyfileobj(response, output)
+        else:
+            header, records = read_ledger(args.ledger or get_default_ledger_path())
+            for data in iter_export(
+                records,
+                int(header['count']),
+                since=args.since,
+                until=args.until,
+                resolution=args.resolution,
+            ):
+                output.write(data)
+    finally:
+        if output is not sys.stdout.buffer:
+            output.close()
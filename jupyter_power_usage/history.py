@@ -0,0 +1,179 @@
+import math
+
+import numpy as np
+
+# Downsampled tiers as (name, resolution in sec, number of buckets). By default
+# one hour of 1 s buckets, one day of 1 min buckets and 30 days of 1 h buckets
+# are kept
+DEFAULT_TIERS = (
+    ('1s', 1, 3600),
+    ('1m', 60, 1440),
+    ('1h', 3600, 720),
+)
+
+# Statistics kept for each bucket of downsampled tiers
+BUCKET_STATS = ('min', 'mean', 'max')
+
+
+class RingBuffer:
+    """Fixed size ring buffer of rows backed by a NumPy array
+
+    First column of each row is the timestamp and rows are always appended in
+    increasing order of time.
+    """
+
+    def __init__(self, capacity, ncols):
+        self.data = np.full((capacity, ncols + 1), np.nan)
+        self.capacity = capacity
+        self.head = 0
+        self.size = 0
+
+    def append(self, row):
+        """Append a row overwriting the oldest one if full"""
+        self.data[self.head] = row
+        self.head = (self.head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def segments(self):
+        """Return views of contiguous segments of buffer in chronological order"""
+        if self.size < self.capacity:
+            return [self.data[: self.size]]
+        return [self.data[self.head :], self.data[: self.head]]
+
+    def since(self, timestamp):
+        """Return views of rows with timestamp greater than or equal to timestamp"""
+        views = []
+        for segment in self.segments():
+            start = np.searchsorted(segment[:, 0], timestamp, side='left')
+            if start < len(segment):
+                views.append(segment[start:])
+        return views
+
+
+class Tier:
+    """Downsampled tier that keeps min, mean and max of each field per bucket"""
+
+    def __init__(self, resolution, capacity, nfields):
+        self.resolution = resolution
+        self.buffer = RingBuffer(capacity, nfields * len(BUCKET_STATS))
+        self.nfields = nfields
+
+        # Accumulators of current bucket
+        self.bucket = None
+        self._min = np.empty(nfields)
+        self._max = np.empty(nfields)
+        self._sum = np.empty(nfields)
+        self._count = 0
+        self._row = np.empty(nfields * len(BUCKET_STATS) + 1)
+
+    def _reset(self, bucket):
+        """Start a new bucket"""
+        self.bucket = bucket
+        self._min.fill(np.inf)
+        self._max.fill(-np.inf)
+        self._sum.fill(0)
+        self._count = 0
+
+    def current(self):
+        """Return row of current bucket that is still open or None if it is
+        empty. Row is overwritten by next call"""
+        if self._count == 0:
+            return None
+        self._row[0] = self.bucket
+        self._row[1::3] = self._min
+        self._row[2::3] = self._sum / self._count
+        self._row[3::3] = self._max
+        return self._row
+
+    def _flush(self):
+        """Append current bucket to buffer"""
+        row = self.current()
+        if row is not None:
+            self.buffer.append(row)
+
+    def add(self, timestamp, values):
+        """Add values to the bucket of timestamp"""
+        bucket = math.floor(timestamp / self.resolution) * self.resolution
+        if bucket != self.bucket:
+            self._flush()
+            self._reset(bucket)
+        np.minimum(self._min, values, out=self._min)
+        np.maximum(self._max, values, out=self._max)
+        self._sum += values
+        self._count += 1
+
+
+class PowerHistory:
+    """Multi resolution time series store of power usage readings
+
+    Raw readings are kept in a ring buffer along with downsampled tiers that keep
+    min, mean and max per bucket. Memory usage is bounded by the capacity of
+    each buffer.
+    """
+
+    def __init__(self, fields, raw_capacity=3600, tiers=DEFAULT_TIERS):
+        self.fields = list(fields)
+        self.raw = RingBuffer(raw_capacity, len(self.fields))
+        self.tiers = {
+            name: Tier(resolution, capacity, len(self.fields))
+            for name, resolution, capacity in tiers
+        }
+        self._values = np.empty(len(self.fields))
+        self._row = np.empty(len(self.fields) + 1)
+
+    @property
+    def resolutions(self):
+        """Available resolutions"""
+        return ['raw'] + list(self.tiers.keys())
+
+    def add(self, reading):
+        """Add a reading made by sampler"""
+        for i, field in enumerate(self.fields):
+            self._values[i] = reading[field]['usage'] if field in reading else np.nan
+        self._row[0] = reading['timestamp']
+        self._row[1:] = self._values
+        self.raw.append(self._row)
+        for tier in self.tiers.values():
+            tier.add(reading['timestamp'], self._values)
+
+    def query(self, since=0, resolution='raw'):
+        """Return readings since a given time at a given resolution
+
+        Returns a dict with list of timestamps and values of each field. For
+        downsampled tiers, values are dicts of min, mean and max per bucket. The
+        current bucket that is still open is included as last bucket and
+        partial is True when it is.
+        """
+        partial = False
+        if resolution == 'raw':
+            buffer = self.raw
+            views = buffer.since(since)
+        else:
+            tier = self.tiers[resolution]
+            buffer = tier.buffer
+            views = buffer.since(since)
+            current = tier.current()
+            if current is not None and current[0] >= since:
+                views.append(current[np.newaxis])
+                partial = True
+
+        # Only the requested rows are copied into the result
+        rows = np.concatenate(views) if views else buffer.data[:0]
+        result = {'resolution': resolution, 'timestamp': rows[:, 0].tolist()}
+        if resolution != 'raw':
+            result['partial'] = partial
+        for i, field in enumerate(self.fields):
+            if resolution == 'raw':
+                result[field] = _to_list(rows[:, i + 1])
+            else:
+                ncols = len(BUCKET_STATS)
+                result[field] = {
+                    stat: _to_list(rows[:, 1 + i * ncols + j])
+                    for j, stat in enumerate(BUCKET_STATS)
+                }
+        return result
+
+
+def _to_list(values):
+    """Convert array into list replacing NaN with None"""
+    return [None if math.isnan(v) else v for v in values.tolist()]
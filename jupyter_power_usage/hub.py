@@ -0,0 +1,383 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from functools import partial
+from urllib.parse import urlparse
+
+from jupyter_server.utils import url_path_join
+from tornado import web
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpclient import HTTPRequest
+from tornado.httputil import url_concat
+from tornado.log import app_log
+
+from .cache import ResponseCache
+
+# Path of combined snapshot of single user servers
+SNAPSHOT_PATH = 'api/metrics/v1/power_usage/snapshot'
+
+# Maximum number of concurrent requests to single user servers
+DEFAULT_CONCURRENCY = 20
+
+# Timeout in sec of a request to a single user server
+DEFAULT_TIMEOUT = 5
+
+# Interval in sec between two collections
+DEFAULT_INTERVAL = 30
+
+# Time in sec for which last good value of a server that stopped answering is
+# still aggregated
+DEFAULT_MAX_AGE = 300
+
+# Time in sec for which a validated token is trusted
+TOKEN_CACHE_TTL = 60
+
+# Maximum number of validated tokens that are cached
+TOKEN_CACHE_SIZE = 256
+
+# Accept header to get paginated lists from JupyterHub API
+HUB_PAGINATION_MEDIA_TYPE = 'application/jupyterhub-pagination+json'
+
+
+def make_http_client(max_clients):
+    """Make a HTTP client with at most max_clients concurrent requests
+
+    curl based client keeps connections to servers alive across collections when
+    pycurl is available.
+    """
+    try:
+        from tornado.curl_httpclient import CurlAsyncHTTPClient
+
+        return CurlAsyncHTTPClient(force_instance=True, max_clients=max_clients)
+    except ImportError:
+        return AsyncHTTPClient(force_instance=True, max_clients=max_clients)
+
+
+def get_power(metrics):
+    """Get total CPU and GPU power usage in W of metrics"""
+    return sum(metrics[k]['usage'] for k in ('cpu', 'gpu') if metrics.get(k))
+
+
+def get_host_power(payload):
+    """Get power usage of whole host reported by a server or None if the server
+    does not measure it"""
+    sys = (payload.get('scopes') or {}).get('sys')
+    if sys:
+        return get_power(sys)
+    if payload.get('metadata', {}).get('measurement_scope') == 'sys':
+        return get_power(payload)
+    return None
+
+
+def aggregate(entries):
+    """Aggregate snapshots of single user servers by user, by node and in total
+
+    entries are dicts with user, server, payload, fetched and stale keys. Power
+    usage of a node is measured from RAPL counters of the host that are shared by
+    all servers on the node. It is counted once from the most recent snapshot
+    that has it.
+    """
+    users = {}
+    nodes = {}
+    for entry in entries:
+        payload = entry['payload']
+        metadata = payload.get('metadata', {})
+        hostname = metadata.get('hostname', 'unknown')
+        power = get_power(payload)
+        emissions = (payload.get('emissions') or {}).get('total', 0)
+
+        user = users.setdefault(
+            entry['user'],
+            {'power': 0, 'emissions': 0, 'servers': {}, 'stale': False},
+        )
+        user['power'] += power
+        user['emissions'] += emissions
+        user['servers'][entry['server']] = hostname
+        user['stale'] = user['stale'] or entry['stale']
+
+        node = nodes.setdefault(
+            hostname,
+            {
+                'power': None,
+                'cpu_limit': metadata.get('cpu_limit'),
+                'users_power': 0,
+                'servers': 0,
+                '_fetched': -1,
+            },
+        )
+        node['users_power'] += power
+        node['servers'] += 1
+        host_power = get_host_power(payload)
+        if host_power is not None and entry['fetched'] > node['_fetched']:
+            node['power'] = host_power
+            node['_fetched'] = entry['fetched']
+
+    for node in nodes.values():
+        del node['_fetched']
+
+    return {
+        'timestamp': time.time(),
+        'total': {
+            'power': sum(n['power'] for n in nodes.values() if n['power'] is not None),
+            'users_power': sum(u['power'] for u in users.values()),
+            'emissions': sum(u['emissions'] for u in users.values()),
+            'servers': sum(n['servers'] for n in nodes.values()),
+            'nodes': len(nodes),
+        },
+        'nodes': nodes,
+        'users': users,
+    }
+
+
+class HubAggregator:
+    """Collect power usage of all running single user servers of a JupyterHub
+
+    Servers are listed from JupyterHub API and their snapshots are fetched
+    concurrently with at most concurrency requests in flight over a shared
+    client. When a server fails or times out, its last good snapshot is still
+    aggregated and marked as stale until it is older than max_age sec.
+    """
+
+    def __init__(
+        self,
+        hub_api_url,
+        api_token,
+        proxy_url,
+        concurrency=DEFAULT_CONCURRENCY,
+        timeout=DEFAULT_TIMEOUT,
+        max_age=DEFAULT_MAX_AGE,
+        client=None,
+        log=app_log,
+    ):
+        self.hub_api_url = hub_api_url
+        self.api_token = api_token
+        self.proxy_url = proxy_url
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.max_age = max_age
+        self.client = client or make_http_client(concurrency)
+        self.log = log
+
+        # Last good snapshot of each server by user and server name
+        self.entries = {}
+
+        # Latest aggregated view. Empty until first collection
+        self.view = {}
+
+    def request(self, url, headers=None):
+        """Make a request authenticated with token of the service"""
+        return HTTPRequest(
+            url,
+            headers={'Authorization': f'token {self.api_token}', **(headers or {})},
+            connect_timeout=self.timeout,
+            request_timeout=self.timeout,
+        )
+
+    async def list_servers(self):
+        """List URLs of ready servers by user and server name"""
+        servers = {}
+        url = url_concat(url_path_join(self.hub_api_url, 'users'), {'state': 'ready'})
+        while url:
+            response = await self.client.fetch(
+                self.request(url, {'Accept': HUB_PAGINATION_MEDIA_TYPE})
+            )
+            data = json.loads(response.body)
+            # Hubs that do not paginate return the list of users
+            if isinstance(data, list):
+                users, url = data, None
+            else:
+                users = data['items']
+                url = (data['_pagination'].get('next') or {}).get('url')
+            for user in users:
+                for name, server in (user.get('servers') or {}).items():
+                    if server.get('ready'):
+                        servers[(user['name'], name)] = url_path_join(
+                            self.proxy_url, server['url'], SNAPSHOT_PATH
+                        )
+        return servers
+
+    async def fetch(self, key, url, semaphore):
+        """Fetch snapshot of a server and keep it if it is valid
+
+        Snapshot is revalidated with its ETag so that servers that have not made
+        a new reading since last collection answer with an empty 304.
+        """
+        entry = self.entries.get(key)
+        headers = {'If-None-Match': entry['etag']} if entry and entry['etag'] else {}
+        async with semaphore:
+            try:
+                response = await self.client.fetch(
+                    self.request(url, headers), raise_error=False
+                )
+                if response.code == 304 and entry is not None:
+                    entry['fetched'] = time.monotonic()
+                    entry['stale'] = False
+                    return
+                response.rethrow()
+                payload = json.loads(response.body)
+            except Exception as err:
+                if entry is not None:
+                    entry['stale'] = True
+                self.log.debug('Failed to fetch %s due to %s' % (url, err))
+                return
+
+        # Servers that are still initializing have nothing to report yet
+        if 'metadata' not in payload:
+            return
+        self.entries[key] = {
+            'user': key[0],
+            'server': key[1],
+            'payload': payload,
+            'etag': response.headers.get('Etag'),
+            'fetched': time.monotonic(),
+            'stale': False,
+        }
+
+    async def collect(self):
+        """Fetch snapshots of all ready servers and update aggregated view"""
+        servers = await self.list_servers()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(
+            *(self.fetch(key, url, semaphore) for key, url in servers.items())
+        )
+
+        # Forget servers that have stopped and snapshots that are too old
+        now = time.monotonic()
+        self.entries = {
+            key: entry
+            for key, entry in self.entries.items()
+            if key in servers and now - entry['fetched'] <= self.max_age
+        }
+        self.view = aggregate(self.entries.values())
+        return self.view
+
+    async def run(self, interval):
+        """Collect periodically"""
+        while True:
+            try:
+                await self.collect()
+            except Exception as err:
+                self.log.warning('Failed to collect power usage due to %s' % err)
+            await asyncio.sleep(interval)
+
+
+class AggregateHandler(web.RequestHandler):
+    """Serve aggregated power usage to users with read:metrics scope
+
+    Tokens are validated against JupyterHub API and allowed tokens are trusted
+    for a short time. Denied tokens are checked again on every request.
+    """
+
+    def initialize(self, aggregator, token_cache):
+        self.aggregator = aggregator
+        self.token_cache = token_cache
+
+    async def check_token(self, token):
+        """Ask Hub if token is allowed to read aggregated metrics. Returns
+        whether it is allowed and TTL of the answer. Denials are not cached so
+        that unknown tokens never fill the cache"""
+        url = url_path_join(self.aggregator.hub_api_url, 'user')
+        request = HTTPRequest(url, headers={'Authorization': f'token {token}'})
+        try:
+            response = await self.aggregator.client.fetch(request)
+            model = json.loads(response.body)
+            allowed = bool(model.get('admin')) or 'read:metrics' in model.get(
+                'scopes', []
+            )
+        except Exception:
+            allowed = False
+        return allowed, None if allowed else 0
+
+    async def authorize(self, token):
+        """Check if token is allowed to read aggregated metrics"""
+        return await self.token_cache.get(token, partial(self.check_token, token))
+
+    async def get(self):
+        """Return aggregated view of power usage"""
+        auth = self.request.headers.get('Authorization', '')
+        token = auth[6:] if auth.lower().startswith('token ') else ''
+        token = token or self.get_argument('token', '')
+        if not token or not await self.authorize(token):
+            raise web.HTTPError(403)
+        self.set_header('Content-Type', 'application/json')
+        self.finish(json.dumps(self.aggregator.view))
+
+
+def make_app(
+    aggregator,
+    prefix='/',
+    token_cache_ttl=TOKEN_CACHE_TTL,
+    token_cache_size=TOKEN_CACHE_SIZE,
+):
+    """Make web application of the service"""
+    # Validated tokens are kept in a bounded LRU cache and are never served
+    # once expired
+    token_cache = ResponseCache(
+        ttl=token_cache_ttl, max_size=token_cache_size, max_stale=0
+    )
+    return web.Application(
+        [
+            (
+                url_path_join(prefix, 'api/power_usage'),
+                AggregateHandler,
+                {'aggregator': aggregator, 'token_cache': token_cache},
+            )
+        ]
+    )
+
+
+def main(argv=None):
+    """Run JupyterHub service that aggregates power usage of all servers"""
+    parser = argparse.ArgumentParser(
+        description='Aggregate power usage of single user servers of a JupyterHub'
+    )
+    parser.add_argument(
+        '--proxy-url',
+        default='http://127.0.0.1:8000',
+        help='URL of JupyterHub proxy through which servers are reached',
+    )
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help='Maximum number of concurrent requests to servers',
+    )
+    parser.add_argument(
+        '--timeout',
+        type=float,
+        default=DEFAULT_TIMEOUT,
+        help='Timeout in sec of a request to a server',
+    )
+    parser.add_argument(
+        '--interval',
+        type=float,
+        default=DEFAULT_INTERVAL,
+        help='Interval in sec between two collections',
+    )
+    parser.add_argument(
+        '--max-age',
+        type=float,
+        default=DEFAULT_MAX_AGE,
+        help='Time in sec for which last good value of a server is kept',
+    )
+    args = parser.parse_args(argv)
+
+    # Service is configured by JupyterHub through environment
+    aggregator = HubAggregator(
+        os.environ['JUPYTERHUB_API_URL'],
+        os.environ['JUPYTERHUB_API_TOKEN'],
+        args.proxy_url,
+        concurrency=args.concurrency,
+        timeout=args.timeout,
+        max_age=args.max_age,
+    )
+    service_url = urlparse(os.environ.get('JUPYTERHUB_SERVICE_URL', 'http://:10101'))
+    app = make_app(aggregator, os.environ.get('JUPYTERHUB_SERVICE_PREFIX', '/'))
+
+    async def serve():
+        app.listen(service_url.port, service_url.hostname or '')
+        await aggregator.run(args.interval)
+
+    asyncio.run(serve())
@@ -0,0 +1,298 @@
+import fcntl
+import os
+import time
+
+import numpy as np
+from jupyter_core.paths import jupyter_data_dir
+
+# Magic bytes and version of ledger file format
+LEDGER_MAGIC = b'JPULEDGR'
+LEDGER_VERSION = 1
+
+# Energy domains accounted in ledger. CPU power usage is split into package and
+# DRAM domains
+LEDGER_DOMAINS = ('package', 'dram', 'gpu')
+
+# Header is padded to a page so that records are page aligned
+LEDGER_HEADER_SIZE = 4096
+LEDGER_HEADER_DTYPE = np.dtype(
+    [
+        ('magic', 'S8'),
+        ('version', '<u4'),
+        ('ndomains', '<u4'),
+        ('capacity', '<u8'),
+        ('count', '<u8'),
+        ('domains', 'S16', (len(LEDGER_DOMAINS),)),
+    ]
+)
+
+
+def get_default_ledger_path():
+    """Default ledger path in Jupyter data directory. Named servers of JupyterHub
+    get their own ledger"""
+    server_name = os.environ.get('JUPYTERHUB_SERVER_NAME')
+    file_name = (
+        f'energy-ledger-{server_name}.bin' if server_name else 'energy-ledger.bin'
+    )
+    return os.path.join(jupyter_data_dir(), 'power_usage', file_name)
+
+
+def _valid_header(header):
+    """Check if header of an existing ledger file is compatible"""
+    return (
+        header['magic'] == LEDGER_MAGIC
+        and header['version'] == LEDGER_VERSION
+        and [d.decode() for d in header['domains']] == list(LEDGER_DOMAINS)
+        and header['count'] <= header['capacity']
+    )
+
+
+def read_ledger(path):
+    """Map records of a ledger file read only without locking it
+
+    Returns the header and the records of the ledger. The ledger can still be
+    appended to by the server that owns it. Only records up to the count in
+    header have been written. Raises ValueError if the file is not a
+    compatible ledger.
+    """
+    header = np.memmap(path, dtype=LEDGER_HEADER_DTYPE, mode='r', shape=())
+    if not _valid_header(header):
+        raise ValueError(f'{path} is not a compatible energy ledger')
+    records = np.memmap(
+        path,
+        dtype='<f8',
+        mode='r',
+        offset=LEDGER_HEADER_SIZE,
+        shape=(int(header['capacity']), len(LEDGER_DOMAINS) + 1),
+    )
+    return header, records
+
+
+class EnergyLedger:
+    """Crash safe ledger of cumulative energy usage in Joules per domain
+
+    Power usage readings are integrated into cumulative energy and appended to a
+    file of fixed size records of float64 [timestamp, energy of each domain]. The
+    file is memory mapped so that appending a record is a couple of stores in
+    preallocated memory. A record is written before the record count in the
+    header is bumped so that a crash never exposes a partial record. Dirty pages
+    are synced to disk periodically.
+
+    Cumulative energy is reloaded from last record in constant time. When the
+    file is full, it is compacted by keeping the recent half of the records and
+    every other record of the older half. Compacted records are written to a
+    new file that atomically replaces the ledger, so that a crash leaves either
+    the old or the compacted ledger. As records hold cumulative values,
+    compaction only coarsens the history and never loses energy.
+    """
+
+    def __init__(self, path, capacity=100000, fsync_interval=60, log=None):
+        self.path = path
+        self.capacity = capacity
+        self.fsync_interval = fsync_interval
+        self.log = log
+
+        # Cumulative energy in J of each domain
+        self.totals = np.zeros(len(LEDGER_DOMAINS))
+
+        self._opened = False
+        self._fd = None
+        self.header = None
+        self.records = None
+
+        # Preallocated arrays used in integration
+        self._power = np.zeros(len(LEDGER_DOMAINS))
+        self._last_timestamp = None
+        self._last_sync = time.monotonic()
+
+    @property
+    def count(self):
+        """Number of records in ledger"""
+        return 0 if self.header is None else int(self.header['count'])
+
+    def _create(self, path=None, records=None):
+        """Create a new ledger file with optional initial records"""
+        with open(path or self.path, 'wb') as f:
+            header = np.zeros((), dtype=LEDGER_HEADER_DTYPE)
+            header['magic'] = LEDGER_MAGIC
+            header['version'] = LEDGER_VERSION
+            header['ndomains'] = len(LEDGER_DOMAINS)
+            header['capacity'] = self.capacity
+            header['domains'] = [d.encode() for d in LEDGER_DOMAINS]
+            if records is not None:
+                header['count'] = len(records)
+            f.write(header.tobytes())
+            if records is not None:
+                f.seek(LEDGER_HEADER_SIZE)
+                f.write(records.astype('<f8').tobytes())
+            # Records are allocated lazily by the file system
+            f.truncate(
+                LEDGER_HEADER_SIZE + self.capacity * 8 * (len(LEDGER_DOMAINS) + 1)
+            )
+            if records is not None:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _map(self):
+        """Map header and records of ledger file"""
+        self.header = np.memmap(
+            self.path, dtype=LEDGER_HEADER_DTYPE, mode='r+', shape=()
+        )
+        self.capacity = int(self.header['capacity'])
+        self.records = np.memmap(
+            self.path,
+            dtype='<f8',
+            mode='r+',
+            offset=LEDGER_HEADER_SIZE,
+            shape=(self.capacity, len(LEDGER_DOMAINS) + 1),
+        )
+
+    def _create_locked(self, records=None):
+        """Create a new ledger file with optional initial records that replaces
+        current one
+
+        New file is locked before it replaces current one so that it is never
+        opened by another server.
+        """
+        tmp_path = self.path + '.tmp'
+        self._create(tmp_path, records)
+        fd = os.open(tmp_path, os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            os.close(fd)
+            raise
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = fd
+
+    def _valid_file(self):
+        """Check if opened file is a compatible ledger that is not truncated"""
+        size = os.fstat(self._fd).st_size
+        if size < LEDGER_HEADER_SIZE:
+            return False
+        header = np.memmap(self.path, dtype=LEDGER_HEADER_DTYPE, mode='r', shape=())
+        valid = _valid_header(header) and size >= LEDGER_HEADER_SIZE + int(
+            header['capacity']
+        ) * 8 * (len(LEDGER_DOMAINS) + 1)
+        del header
+        return valid
+
+    def open(self):
+        """Open ledger file and reload cumulative energy from last record"""
+        self._opened = True
+        try:
+            self._open()
+        except (OSError, ValueError) as err:
+            self._log(
+                'warning',
+                'Failed to open energy ledger %s due to %s. Cumulative energy '
+                'will not be persisted...' % (self.path, err),
+            )
+            self.close()
+
+    def _open(self):
+        """Open or create ledger file and lock it"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if not os.path.exists(self.path):
+            self._create_locked()
+        else:
+            # Ledger must not be shared by several servers
+            self._fd = os.open(self.path, os.O_RDWR)
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._log(
+                    'warning',
+                    'Energy ledger %s is used by another server. Cumulative '
+                    'energy will not be persisted...' % self.path,
+                )
+                os.close(self._fd)
+                self._fd = None
+                return
+
+            # Incompatible and truncated files are moved aside
+            if not self._valid_file():
+                self._log(
+                    'warning',
+                    'Energy ledger %s is not compatible. Starting a new one...'
+                    % self.path,
+                )
+                os.replace(self.path, self.path + '.bak')
+                self._create_locked()
+
+        self._map()
+        if self.count > 0:
+            self.totals[:] = self.records[self.count - 1, 1:]
+
+    def _log(self, level, msg):
+        if self.log is not None:
+            getattr(self.log, level)(msg)
+
+    def _compact(self):
+        """Keep recent half of records and every other record of older half"""
+        half = self.capacity // 2
+        records = np.concatenate((self.records[1:half:2], self.records[half:]))
+        self._create_locked(records)
+        self._map()
+
+    def add(self, reading):
+        """Integrate a reading made by sampler and append a record"""
+        if not self._opened:
+            self.open()
+
+        timestamp = reading['timestamp']
+        cpu = reading.get('cpu')
+        gpu = reading.get('gpu')
+        self._power[0] = cpu['usage'] - cpu.get('dram', 0) if cpu else 0
+        self._power[1] = cpu.get('dram', 0) if cpu else 0
+        self._power[2] = gpu['usage'] if gpu else 0
+
+        # Power usage is average over the period since previous reading. Energy
+        # is not integrated over the period when server was not running
+        if self._last_timestamp is not None:
+            self._power *= timestamp - self._last_timestamp
+            self.totals += self._power
+        self._last_timestamp = timestamp
+
+        if self.records is None:
+            return
+
+        # Record is not appended if ledger cannot be compacted. Compaction is
+        # retried with next reading
+        if self.count == self.capacity:
+            try:
+                self._compact()
+            except OSError as err:
+                self._log('warning', 'Failed to compact energy ledger due to %s' % err)
+                return
+
+        # Write record before bumping count
+        count = self.count
+        self.records[count, 0] = timestamp
+        self.records[count, 1:] = self.totals
+        self.header['count'] = count + 1
+
+        if time.monotonic() - self._last_sync > self.fsync_interval:
+            self.flush()
+
+    def flush(self):
+        """Sync ledger to disk"""
+        if self.records is not None:
+            self.records.flush()
+            self.header.flush()
+        self._last_sync = time.monotonic()
+
+    def get_totals(self):
+        """Return cumulative energy in J per domain"""
+        return dict(zip(LEDGER_DOMAINS, self.totals.tolist()))
+
+    def close(self):
+        """Sync and close ledger"""
+        self.flush()
+        self.records = None
+        self.header = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
@@ -1,16 +1,20 @@
 import re
 import time
+from types import SimpleNamespace
 
 import psutil
 from jupyter_server.serverapp import ServerApp
-from py3nvml.py3nvml import nvmlDeviceGetCount
-from py3nvml.py3nvml import nvmlDeviceGetEnforcedPowerLimit
-from py3nvml.py3nvml import nvmlDeviceGetHandleByIndex
-from py3nvml.py3nvml import nvmlDeviceGetPowerUsage
-from py3nvml.py3nvml import NVMLError
-from py3nvml.py3nvml import nvmlInit
 
-from .utils import filter_rapl_domains
+from .collector import CollectorClient
+from .config import MIN_MEASUREMENT_PERIOD
+from .overhead import OverheadRecorder
+from .procs import ProcessTable
+from .utils import get_cgroup_path
+from .utils import get_rapl_topology
+from .utils import RaplReader
+from .utils import read_cgroup_cpu_time
+from .utils import read_cgroup_memory
+from .utils import read_meminfo
 
 # Default power consumption for DRAM if counters are available
 # Units in W/GB RAM consumed
@@ -20,19 +24,79 @@ DEFAULT_DRAM_CONSUMPTION = 0.375
 # Minimum share of procs in current scope
 CPU_SHARE_THRESHOLD = 0.001
 
+# Measurement scopes whose share is computed from their processes
+PROCESS_SCOPES = ('process', 'user')
 
-class CpuPowerUsage:
-    """Extract CPU power usage using RAPL metrics"""
 
-    def __init__(self, server_app: ServerApp):
+class CpuPowerUsage:
+    """Extract CPU power usage using RAPL metrics
+
+    If lazy is True, RAPL domains and host counters are only discovered when
+    initialize() is called so that it can be done in background. RAPL topology is
+    cached in topology_cache_path if it is given. Cost of RAPL reads and process
+    and memory scans is recorded in overhead recorder if it is given.
+    """
+
+    def __init__(
+        self,
+        server_app: ServerApp,
+        lazy=False,
+        topology_cache_path=None,
+        overhead=None,
+    ):
         self.server_app = server_app
         self.config = server_app.web_app.settings['jupyter_power_usage_config']
-        (
-            self.rapl_domains,
-            self.rapl_domain_power_limits,
-            self.rapl_domain_overflow_counters,
-        ) = filter_rapl_domains()
-        self.rapl_domain_names = list(self.rapl_domains.keys())
+        self.topology_cache_path = topology_cache_path
+        self.overhead = overhead or OverheadRecorder(enabled=False)
+        self.initialized = False
+        self._power_usage_available = False
+
+        # Measurement scope in use. It differs from configured one when cgroup
+        # v2 is not available
+        self.effective_scope = self.config.measurement_scope
+        if not lazy:
+            self.initialize()
+
+    def initialize(self):
+        """Discover RAPL domains and make first readings"""
+        # In client mode, host wide counters are fetched from node local
+        # collector. Latest snapshot of collector is used by all computations
+        # within the same sample
+        self.collector = None
+        self._snapshot = None
+        self._collector_available = True
+        if self.config.collector_socket:
+            self.collector = CollectorClient(self.config.collector_socket)
+            self._snapshot = self.get_host_snapshot()
+
+        # RAPL domains are discovered from sysfs only when collector is not
+        # available
+        self.rapl_reader = None
+        if self._snapshot is not None:
+            self.rapl_domains = {}
+            self.rapl_domain_power_limits = self._snapshot['power_limits']
+            self.rapl_domain_overflow_counters = self._snapshot['overflow_counters']
+            self.rapl_domain_names = list(self._snapshot['rapl'].keys())
+        else:
+            self.init_rapl_reader()
+
+        # Index of processes on the host used to compute share of current scope
+        self.process_table = ProcessTable()
+
+        # Cached host memory info
+        self._meminfo = None
+        self._meminfo_time = -float('inf')
+
+        # cgroup of current process used in cgroup measurement scope
+        self.cgroup_path = None
+        if self.config.measurement_scope == 'cgroup':
+            self.cgroup_path = get_cgroup_path()
+            if self.cgroup_path is None:
+                self.server_app.log.warning(
+                    'cgroup v2 of current process not found. '
+                    'Falling back to process measurement scope...'
+                )
+                self.effective_scope = 'process'
 
         # Get total power limit
         self._power_limit = 0
@@ -46,14 +110,67 @@ class CpuPowerUsage:
         # Get a sample reading to check if metrics are available
         self._power_usage_available = False
         counters = self.get_rapl_counters()
-        if sum(counters.values()) > 0:
+        if sum(v for v in counters.values() if v is not None) > 0:
             self._power_usage_available = True
 
             # Setup first readings
             self.rapl_readings_t = counters
-            self.total_cpu_time_t = self.get_total_cpu_time(psutil.cpu_times())
-            self.procs_cpu_time_t = self.total_cpu_time_t
-            self.time_t = time.time()
+            self.total_cpu_time_t = self.get_host_cpu_time()
+            if self.cgroup_path is not None:
+                self.cgroup_cpu_time_t = read_cgroup_cpu_time(self.cgroup_path)
+            self.time_t = self.get_host_time()
+            self._last_usages = ({}, {})
+        self.initialized = True
+
+    def init_rapl_reader(self):
+        """Discover RAPL domains on the host and open their counters"""
+        (
+            self.rapl_domains,
+            self.rapl_domain_power_limits,
+            self.rapl_domain_overflow_counters,
+        ) = get_rapl_topology(self.topology_cache_path)
+        self.rapl_domain_names = list(self.rapl_domains.keys())
+
+        # Reader that keeps RAPL counter files open
+        self.rapl_reader = RaplReader(self.rapl_domains)
+
+    def get_host_snapshot(self):
+        """Get snapshot of host wide counters from collector or None if collector
+        is not available"""
+        try:
+            snapshot = self.collector.get_snapshot()
+        except (OSError, TypeError, ValueError) as err:
+            # TypeError is raised for invalid socket paths
+            if self._collector_available:
+                self.server_app.log.warning(
+                    'Power usage collector at %s is not available due to %s. '
+                    'Falling back to reading counters directly...'
+                    % (self.config.collector_socket, err)
+                )
+            self._collector_available = False
+            return None
+
+        if not self._collector_available:
+            self.server_app.log.info(
+                'Power usage collector at %s is available again'
+                % self.config.collector_socket
+            )
+        self._collector_available = True
+        return snapshot
+
+    def get_host_time(self):
+        """Get time of host wide counters"""
+        if self._snapshot is not None:
+            return self._snapshot['timestamp']
+        return time.time()
+
+    def get_host_cpu_time(self):
+        """Get total CPU time of the host"""
+        if self._snapshot is not None:
+            return self.get_total_cpu_time(
+                SimpleNamespace(**self._snapshot['cpu_times'])
+            )
+        return self.get_total_cpu_time(psutil.cpu_times())
 
     def power_usage_available(self):
         """Check if power metrics are available"""
@@ -95,62 +212,164 @@ class CpuPowerUsage:
     def read_energy_counter(path):
         """Read energy counter file and return value"""
         try:
-            content = open(path, 'r').read().rstrip()
-            # Units are micro Joules
-            return int(content)
+            with open(path, 'r') as f:
+                # Units are micro Joules
+                return int(f.read().rstrip())
         except (PermissionError, ValueError):
             return 0
 
     def get_rapl_counters(self):
         """Gets energy counters from RAPL powercap interface"""
-        # Make a copy of dict and replace paths with values of energy counters
-        rapl_counters = self.rapl_domains.copy()
-        for k, v in self.rapl_domains.items():
-            rapl_counters[k] = self.read_energy_counter(v)
-        return rapl_counters
+        # Counters of all domains are read in one batch from open files
+        if self.collector is not None:
+            self._snapshot = self.get_host_snapshot()
+            if self._snapshot is not None:
+                return self._snapshot['rapl']
+
+        # Collector is absent. Read counters directly
+        if self.rapl_reader is None:
+            self.init_rapl_reader()
+        return dict(zip(self.rapl_domain_names, self.rapl_reader.read()))
 
     def get_cpu_share(self, pids):
         """Get CPU share of processes based on defined scope"""
-        # If system wide measurement is chosen we dont need to compute share
-        # So return immediately with share as 1
-        if self.config.measurement_scope == 'system':
-            return 1, 1
-
-        # CPU share of current scope is rate(procs_cpu_time) / rate(total_cpu_time)
-        # This will give the share of cpu time of processes in current scope to TOTAL
-        # cpu time. We dont need to account for number of CPUs as it is a ratio
-        #
-        # Total CPU time of all processes in the current scope
-        procs_cpu_times = sum(
-            [
-                self.get_total_cpu_time(psutil.Process(pid=p).cpu_times(), proc=True)
-                for p in pids
-            ]
+        return self.get_cpu_shares(pids, {})[0]
+
+    def get_cpu_shares(self, pids, kernels, own_cpu_time=0):
+        """Get CPU and memory shares of current scope and of each kernel
+
+        kernels maps kernel ids to pids of their process subtree. Returns shares
+        of the scope and a dict of shares of each kernel.
+
+        own_cpu_time is the CPU time consumed by the power meter itself since
+        last update. It is not billed to the scope.
+        """
+        scope = self.effective_scope
+        scope_shares, kernel_shares = self.get_cpu_shares_by_scope(
+            {scope: pids}, kernels, own_cpu_time
         )
+        return scope_shares[scope], kernel_shares
+
+    def get_cpu_shares_by_scope(self, scopes, kernels, own_cpu_time=0):
+        """Get CPU and memory shares of several measurement scopes and of each
+        kernel
+
+        scopes maps measurement scopes to pids of their processes and kernels
+        maps kernel ids to pids of their process subtree. Processes of all
+        scopes and kernels are inspected in a single pass and all the shares are
+        computed against the same host CPU time. Returns a dict of shares of
+        each scope and a dict of shares of each kernel.
+        """
+        # CPU share is rate(procs_cpu_time) / rate(total_cpu_time)
+        # This will give the share of cpu time of processes to TOTAL cpu time.
+        # We dont need to account for number of CPUs as it is a ratio
+        #
         # Total CPU time of the host excluding times in IOwait, idle, steal
-        total_cpu_time = self.get_total_cpu_time(psutil.cpu_times())
-        cpu_share = (procs_cpu_times - self.procs_cpu_time_t) / (
-            total_cpu_time - self.total_cpu_time_t
-        )
+        total_cpu_time = self.get_host_cpu_time()
+        total_cpu_time_delta = max(total_cpu_time - self.total_cpu_time_t, 1e-6)
 
-        # cpu_share can be negative when there is a lot of CPU activity and if all
-        # activity disappears suddently, it tends to go negative. Use a threshold to
-        # avoid negative values
+        # Update the time at t which will be used in next cycle
+        self.total_cpu_time_t = total_cpu_time
+
+        # CPU time consumed by all processes of each group since last update
+        # and their current memory. Processes that vanish are ignored. Scopes
+        # are keyed by tuples so that they never clash with kernel ids
+        groups = dict(kernels)
+        for scope, pids in scopes.items():
+            if scope in PROCESS_SCOPES:
+                groups[('scope', scope)] = pids
+        memory_accounting = self.config.memory_accounting
+        usages = {}
+        if groups:
+            with self.overhead.phase('process_read'):
+                usages = self.process_table.update_groups(
+                    groups,
+                    lambda t: self.get_total_cpu_time(t, proc=True),
+                    pss=memory_accounting == 'pss',
+                )
+            with self.overhead.phase('memory'):
+                total_mem = self.get_total_memory()
+
+        def get_shares(procs_cpu_time, procs_mem):
+            # cpu_share can be zero when there is no CPU activity in the group.
+            # Use a threshold to always report a minimum share
+            cpu_share = max(procs_cpu_time / total_cpu_time_delta, CPU_SHARE_THRESHOLD)
+            mem_share = procs_mem / max(total_mem, 1)
+            return min(cpu_share, 1), min(mem_share, 1)
+
+        scope_shares = {}
+        for scope in scopes:
+            if scope == 'sys':
+                # If system wide measurement is chosen we dont need to compute
+                # share
+                scope_shares[scope] = (1, 1)
+            elif scope == 'cgroup':
+                # cgroup accounting gives usage of all processes in scope directly
+                scope_shares[scope] = self.get_cgroup_share(
+                    total_cpu_time_delta, own_cpu_time
+                )
+            else:
+                procs_cpu_time, procs_mem = usages.pop(('scope', scope))
+                scope_shares[scope] = get_shares(
+                    max(procs_cpu_time - own_cpu_time, 0), procs_mem
+                )
+        return scope_shares, {
+            kernel_id: get_shares(*usage) for kernel_id, usage in usages.items()
+        }
+
+    def get_total_memory(self):
+        """Get memory in use on the host against which memory share is computed"""
+        if self.config.memory_accounting == 'rss':
+            # Sum of all RSS will be more than the physical memory as we will add
+            # shared memory of all processes thus deuplicating memory. But we are
+            # interested only in the fraction and it seems to be a reasonable
+            # estimate. This needs a scan of all processes on the host
+            return sum(
+                p.info['memory_info'].rss
+                for p in psutil.process_iter(['memory_info'])
+                if p.info['memory_info'] is not None
+            )
+        # Memory in use on the host from /proc/meminfo
+        meminfo = self.get_meminfo()
+        return meminfo['MemTotal'] - meminfo['MemAvailable']
+
+    def get_meminfo(self):
+        """Get host memory info in bytes
+
+        Values are cached and reused by all the computations within the same
+        sample
+        """
+        if self._snapshot is not None:
+            return self._snapshot['meminfo']
+
+        now = time.monotonic()
+        if now - self._meminfo_time > MIN_MEASUREMENT_PERIOD / 1e3:
+            self._meminfo = read_meminfo()
+            self._meminfo_time = now
+        return self._meminfo
+
+    def get_cgroup_share(self, total_cpu_time_delta, own_cpu_time=0):
+        """Get CPU and memory share of cgroup of current process
+
+        Only a couple of cgroup accounting files are read irrespective of number of
+        processes in the cgroup.
+        """
+        # CPU share is rate(cgroup_cpu_time) / rate(total_cpu_time)
+        cgroup_cpu_time = read_cgroup_cpu_time(self.cgroup_path)
+        cgroup_cpu_time_delta = cgroup_cpu_time - self.cgroup_cpu_time_t
+        cpu_share = max(cgroup_cpu_time_delta - own_cpu_time, 0) / total_cpu_time_delta
         cpu_share = max(cpu_share, CPU_SHARE_THRESHOLD)
 
-        # Update the times at t which will be used in next cycle
-        self.procs_cpu_time_t = procs_cpu_times
-        self.total_cpu_time_t = total_cpu_time
+        # Update the time at t which will be used in next cycle
+        self.cgroup_cpu_time_t = cgroup_cpu_time
 
-        # Memory share if sum of all process's memory / total memory consumption
-        # We choose RSS here to estimate the share. Sum of all RSS will be more than
-        # the physical memory as we will add shared memory of all processes thus
-        # deuplicating memory. But we are interested only in the fraction and it
-        # seems to be a reasonable estimate
-        mem_share = sum([psutil.Process(pid=p).memory_info().rss for p in pids]) / sum(
-            [p.memory_info().rss for p in psutil.process_iter(['memory_info'])]
+        # memory.current includes page cache of the cgroup. So we compare it with
+        # host memory that is not free which includes buffers and cache as well
+        meminfo = self.get_meminfo()
+        mem_share = read_cgroup_memory(self.cgroup_path) / (
+            meminfo['MemTotal'] - meminfo['MemFree']
         )
-        return cpu_share, mem_share
+        return min(cpu_share, 1), min(mem_share, 1)
 
     def get_total_power_usage(self, period, counters):
         """Get power usage based on counters"""
@@ -159,6 +378,9 @@ class CpuPowerUsage:
         pkg_total = 0
         dram_total = 0
         for dom in self.rapl_domain_names:
+            # Counters that have never been read are skipped
+            if count_dt.get(dom) is None or count_t.get(dom) is None:
+                continue
             diff = count_dt[dom] - count_t[dom]
 
             # If diff is less than 0, counters have overflown
@@ -178,10 +400,9 @@ class CpuPowerUsage:
         # by using DEFAULT_DRAM_CONSUMPTION
         if dram_power_usage == 0:
             # Used memory in GiB
-            mem_used = (
-                psutil.virtual_memory().percent
-                * psutil.virtual_memory().total
-                / (1024 * 1024 * 1024 * 100)
+            meminfo = self.get_meminfo()
+            mem_used = (meminfo['MemTotal'] - meminfo['MemAvailable']) / (
+                1024 * 1024 * 1024
             )
             dram_power_usage = mem_used * DEFAULT_DRAM_CONSUMPTION
 
@@ -189,9 +410,51 @@ class CpuPowerUsage:
 
     def get_power_usage(self, pids):
         """Get power usage by making two readings with a measurement interval"""
+        return sum(self.get_power_usage_components(pids))
+
+    def get_power_usage_components(self, pids):
+        """Get CPU package and DRAM power usages of current scope by making two
+        readings with a measurement interval"""
+        return self.get_power_usage_breakdown(pids, {})[0]
+
+    def get_power_usage_breakdown(self, pids, kernels, own_cpu_time=0):
+        """Get CPU package and DRAM power usages of current scope and of each
+        kernel
+
+        A single RAPL reading and a single pass over processes are made
+        irrespective of number of kernels. Returns usages of the scope and a dict
+        of usages of each kernel. CPU time consumed by the power meter itself
+        since last reading is given by own_cpu_time and it is not billed to the
+        scope.
+        """
+        scope = self.effective_scope
+        scope_usages, kernel_usages = self.get_power_usage_by_scope(
+            {scope: pids}, kernels, own_cpu_time
+        )
+        return scope_usages[scope], kernel_usages
+
+    def get_power_usage_by_scope(self, scopes, kernels, own_cpu_time=0):
+        """Get CPU package and DRAM power usages of several measurement scopes and
+        of each kernel
+
+        scopes maps measurement scopes to pids of their processes. All scopes and
+        kernels share a single RAPL reading and a single pass over processes.
+        Returns a dict of usages of each scope and a dict of usages of each
+        kernel.
+
+        Snapshots of a collector are cached for a short time. When time of host
+        counters has not moved since previous reading, usages of previous reading
+        are returned.
+        """
         # Make current measurements
-        rapl_readings_dt = self.get_rapl_counters()
-        current_time = time.time()
+        with self.overhead.phase('rapl'):
+            rapl_readings_dt = self.get_rapl_counters()
+        current_time = self.get_host_time()
+        if current_time <= self.time_t:
+            last_scopes, last_kernels = self._last_usages
+            return {scope: last_scopes.get(scope, (0, 0)) for scope in scopes}, {
+                kernel_id: last_kernels.get(kernel_id, (0, 0)) for kernel_id in kernels
+            }
 
         # Power usage computed based on previous readings
         cpu_power_usage, dram_power_usage = self.get_total_power_usage(
@@ -202,43 +465,111 @@ class CpuPowerUsage:
         # cpu_power_usage = random.uniform(20, 30)
         # dram_power_usage = random.uniform(5, 10)
 
-        cpu_share, mem_share = self.get_cpu_share(pids)
+        scope_shares, kernel_shares = self.get_cpu_shares_by_scope(
+            scopes, kernels, own_cpu_time
+        )
 
         # Set current measurements as previous measurements for next reading
         self.rapl_readings_t = rapl_readings_dt
         self.time_t = current_time
 
-        return cpu_power_usage * cpu_share + dram_power_usage * mem_share
+        def get_usages(shares):
+            return cpu_power_usage * shares[0], dram_power_usage * shares[1]
+
+        self._last_usages = (
+            {scope: get_usages(shares) for scope, shares in scope_shares.items()},
+            {
+                kernel_id: get_usages(shares)
+                for kernel_id, shares in kernel_shares.items()
+            },
+        )
+        return self._last_usages
 
 
 class GpuPowerUsage:
-    """Extract nVIDIA GPU power usage using PyNVML lib"""
+    """Extract nVIDIA GPU power usage using PyNVML lib
 
-    def __init__(self, server_app: ServerApp):
+    Device handles are cached at init. Energy consumed by each device since
+    previous reading is computed from its cumulative energy counter when it is
+    supported so that spikes between two readings are accounted for. Otherwise,
+    power usage samples are integrated.
+
+    The NVML module can be injected with nvml argument. It defaults to py3nvml.
+    """
+
+    def __init__(self, server_app: ServerApp, nvml=None, lazy=False):
         self.server_app = server_app
         self.config = server_app.web_app.settings['jupyter_power_usage_config']
+        self.nvml = nvml
+        self.initialized = False
 
-        self._power_usage_available = True
+        self._power_usage_available = False
         self._power_limit = 0
 
+        # Cached handles of devices
+        self.handles = []
+
+        # Readings of each device at t. Energy counters are None for devices that
+        # do not support them
+        self.energy_t = []
+        self.power_t = []
+        self.time_t = time.time()
+        if not lazy:
+            self.initialize()
+
+    def initialize(self):
+        """Initialise NVML and make first readings"""
+        # NVML bindings are only imported when needed
+        if self.nvml is None:
+            from py3nvml import py3nvml
+
+            self.nvml = py3nvml
+
+        # Not all versions of NVML bindings expose energy counters
+        self._get_energy = getattr(
+            self.nvml, 'nvmlDeviceGetTotalEnergyConsumption', None
+        )
+
         # Initialise NVML
+        self._power_usage_available = True
         try:
-            nvmlInit()
+            self.nvml.nvmlInit()
 
             # Number of devices
-            self.ngpus = nvmlDeviceGetCount()
+            self.ngpus = self.nvml.nvmlDeviceGetCount()
 
             # Get total power limit in mW for all GPUs
             for i in range(self.ngpus):
-                handle = nvmlDeviceGetHandleByIndex(i)
-                self._power_limit += nvmlDeviceGetEnforcedPowerLimit(handle)
-        except NVMLError as err:
+                handle = self.nvml.nvmlDeviceGetHandleByIndex(i)
+                self.handles.append(handle)
+                self._power_limit += self.nvml.nvmlDeviceGetEnforcedPowerLimit(handle)
+                self.energy_t.append(self._read_energy(handle))
+                self.power_t.append(self.nvml.nvmlDeviceGetPowerUsage(handle))
+            self.time_t = time.time()
+        except self.nvml.NVMLError as err:
             self.server_app.log.warning(
                 'Could not initiliaze pynvm due to %s. '
                 'GPU energy usage will not be reported...' % err
             )
             self._power_usage_available = False
             # self._power_limit = 100000
+        self.initialized = True
+
+    def _read_energy(self, handle):
+        """Read energy counter of device in mJ or None if it is not supported"""
+        if self._get_energy is None:
+            return None
+        try:
+            return self._get_energy(handle)
+        except self.nvml.NVMLError:
+            return None
+
+    def read_energy_counters(self):
+        """Read energy counter of each device in mJ. Counters of devices that do
+        not support them are None"""
+        if not self._power_usage_available:
+            return []
+        return [self._read_energy(handle) for handle in self.handles]
 
     def get_power_limit(self):
         """Get total power limit of all available GPUs in W"""
@@ -248,25 +579,89 @@ class GpuPowerUsage:
         """Checks if power usage metrics are available or not"""
         return self._power_usage_available
 
-    def get_power_usage(self):
-        """Get power usage of all available GPUs"""
+    def get_power_usage(self, pids=None):
+        """Get power usage of all available GPUs
+
+        If pids is given, only the share of processes in pids is returned
+        """
+        return self.get_power_usage_breakdown(pids, {})[0]
+
+    def get_device_power_usages(self):
+        """Get average power usage in W of each device since previous reading"""
+        current_time = time.time()
+        period = max(current_time - self.time_t, 1e-6)
+        usages = []
+        for i, handle in enumerate(self.handles):
+            energy = self._read_energy(handle) if self.energy_t[i] is not None else None
+            if energy is not None:
+                # Energy counters are in mJ
+                usages.append((energy - self.energy_t[i]) / 1e3 / period)
+                self.energy_t[i] = energy
+            else:
+                # Trapezoidal integration of power usage in mW between readings
+                power = self.nvml.nvmlDeviceGetPowerUsage(handle)
+                usages.append((power + self.power_t[i]) / 2 / 1e3)
+                self.power_t[i] = power
+                self.energy_t[i] = None
+        self.time_t = current_time
+        return usages
+
+    def get_process_shares(self, handle, groups):
+        """Get share of device used by each group of processes
+
+        Device is shared among its compute processes in proportion to their used
+        memory or equally if used memory is not reported.
+        """
+        procs = self.nvml.nvmlDeviceGetComputeRunningProcesses(handle)
+        if not procs:
+            return {key: 0 for key in groups}
+
+        if any(p.usedGpuMemory is None for p in procs):
+            weights = {p.pid: 1 for p in procs}
+        else:
+            weights = {p.pid: p.usedGpuMemory for p in procs}
+        total = max(sum(weights.values()), 1)
+        return {
+            key: sum(weights.get(pid, 0) for pid in pids) / total
+            for key, pids in groups.items()
+        }
+
+    def get_power_usage_breakdown(self, pids, kernels):
+        """Get GPU power usage of current scope and of each kernel
+
+        If pids is None, power usage of all GPUs is attributed to the scope.
+        kernels maps kernel ids to pids of their process subtree. Other groups
+        of processes, like other measurement scopes, can be passed along with
+        kernels and None pids attribute all the power usage to the group.
+        Returns usage of the scope and a dict of usages of each kernel.
+        """
         if not self._power_usage_available:
-            return 0
+            return 0, {kernel_id: 0 for kernel_id in kernels}
         # else:
         #     import random
         #     gpu_power_usage = random.uniform(20, 50)
         #     return gpu_power_usage
 
-        # Query power usage in mW for each GPU
+        groups = {
+            kernel_id: set(kernel_pids)
+            for kernel_id, kernel_pids in kernels.items()
+            if kernel_pids is not None
+        }
+        if pids is not None:
+            groups[None] = set(pids)
+
         try:
-            gpu_power_usage = 0
-            for i in range(self.ngpus):
-                handle = nvmlDeviceGetHandleByIndex(i)
-                gpu_power_usage += nvmlDeviceGetPowerUsage(handle)
-            return gpu_power_usage / 1e3
-        except NVMLError as err:
+            scope_usage = 0
+            kernel_usages = dict.fromkeys(kernels, 0)
+            for handle, usage in zip(self.handles, self.get_device_power_usages()):
+                shares = self.get_process_shares(handle, groups) if groups else {}
+                scope_usage += usage * shares.get(None, 1)
+                for kernel_id in kernels:
+                    kernel_usages[kernel_id] += usage * shares.get(kernel_id, 1)
+            return scope_usage, kernel_usages
+        except self.nvml.NVMLError as err:
             self.server_app.log.debug('Failed to get GPU power usage due to %s' % err)
-            return 0
+            return 0, {kernel_id: 0 for kernel_id in kernels}
 
 
 if __name__ == '__main__':
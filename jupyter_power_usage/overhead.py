@@ -0,0 +1,140 @@
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+
+# Phases of a sample whose cost is recorded
+PHASES = (
+    'sample',
+    'rapl',
+    'process_scan',
+    'process_read',
+    'memory',
+    'gpu',
+    'serialization',
+)
+
+# Clocks on which the cost of each phase is measured
+CLOCKS = ('wall', 'cpu')
+
+# Upper bounds of histogram buckets in sec
+DEFAULT_BUCKETS = (
+    1e-5,
+    2.5e-5,
+    5e-5,
+    1e-4,
+    2.5e-4,
+    5e-4,
+    1e-3,
+    2.5e-3,
+    5e-3,
+    1e-2,
+    2.5e-2,
+    5e-2,
+    0.1,
+    0.25,
+    0.5,
+    1,
+)
+
+# Shared context of disabled recorders
+_NULL_PHASE = nullcontext()
+
+
+class Histogram:
+    """Histogram with fixed bucket upper bounds
+
+    Counts are not cumulative. An extra bucket counts observations larger than
+    the last bound.
+    """
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        """Add an observation"""
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self):
+        """Return histogram as a dict"""
+        return {
+            'bounds': list(self.bounds),
+            'counts': list(self.counts),
+            'sum': self.sum,
+            'count': self.count,
+        }
+
+
+class Phase:
+    """Context that records wall and CPU time spent in a phase"""
+
+    __slots__ = ('recorder', 'name', 'wall', 'cpu')
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        # Each phase runs on a single thread. Thread CPU time does not include
+        # other threads of the server
+        self.cpu = time.thread_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.recorder.record(
+            self.name,
+            time.perf_counter() - self.wall,
+            time.thread_time() - self.cpu,
+        )
+
+
+class OverheadRecorder:
+    """Record wall and CPU time spent by the power meter itself
+
+    Cost of each phase of a sample is recorded in histograms. Cost of latest
+    sample is kept as well so that it can be added to readings. It is cleared by
+    start_sample() at the start of each sample. When disabled, phase() returns a
+    shared no-op context and nothing is recorded.
+    """
+
+    def __init__(self, enabled=True, buckets=DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.histograms = {
+            phase: {clock: Histogram(buckets) for clock in CLOCKS} for phase in PHASES
+        }
+
+        # Wall and CPU time of each phase in latest sample
+        self.latest = {}
+
+    def start_sample(self):
+        """Forget cost of phases of previous sample so that phases skipped by
+        the next one are not reported with stale cost"""
+        self.latest = {}
+
+    def phase(self, name):
+        """Return a context that records time spent in phase name"""
+        if not self.enabled:
+            return _NULL_PHASE
+        return Phase(self, name)
+
+    def record(self, name, wall, cpu):
+        """Record wall and CPU time in sec spent in phase name"""
+        histograms = self.histograms[name]
+        histograms['wall'].observe(wall)
+        histograms['cpu'].observe(cpu)
+        self.latest[name] = {'wall': wall, 'cpu': cpu}
+
+    def get_histograms(self):
+        """Return histograms of all phases that have been recorded"""
+        return {
+            phase: {clock: h.to_dict() for clock, h in histograms.items()}
+            for phase, histograms in self.histograms.items()
+            if histograms['wall'].count
+        }
@@ -0,0 +1,192 @@
+import time
+
+import psutil
+
+from .utils import read_pss
+
+# Exceptions raised by psutil when a process disappears or cannot be inspected
+PSUTIL_EXCEPTIONS = (psutil.NoSuchProcess, psutil.ZombieProcess, psutil.AccessDenied)
+
+
+class ProcessEntry:
+    """Cached handle and last readings of a process"""
+
+    __slots__ = ('proc', 'create_time', 'ppid', 'uid', 'cpu_time')
+
+    def __init__(self, proc, ppid, uid, cpu_time):
+        self.proc = proc
+        self.create_time = proc.create_time()
+        self.ppid = ppid
+        self.uid = uid
+        self.cpu_time = cpu_time
+
+
+class ProcessTable:
+    """Incremental index of processes on the host
+
+    Processes are identified by (pid, create_time) so that a reused pid is never
+    mistaken for an older process. On each scan only the new pids are inspected
+    and exited pids are dropped. Process handles and CPU times of previous
+    update are cached so that CPU time consumed between two updates can be
+    computed per process.
+    """
+
+    def __init__(self):
+        # Map of pid to process entry
+        self._entries = {}
+
+        # Index of children pids by parent pid. It is rebuilt once after entries
+        # change and shared by all subtrees walked until then
+        self._children = None
+
+        # Time of last update. Processes created before this time and found for
+        # the first time will use their current CPU time as baseline
+        self._last_update = time.time()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, pid):
+        return pid in self._entries
+
+    def get_create_time(self, pid):
+        """Return create time of a known process or None"""
+        entry = self._entries.get(pid)
+        return entry.create_time if entry is not None else None
+
+    @staticmethod
+    def _make_entry(pid):
+        """Inspect a new process and return its entry"""
+        proc = psutil.Process(pid)
+        with proc.oneshot():
+            return ProcessEntry(proc, proc.ppid(), proc.uids().real, None)
+
+    def scan(self):
+        """Add new processes and drop exited processes from the table
+
+        Processes whose parent has exited have been reparented and their parent
+        is read again. Other known processes are not inspected.
+        """
+        pids = set(psutil.pids())
+
+        # Drop exited processes
+        for pid in self._entries.keys() - pids:
+            del self._entries[pid]
+
+        # Refresh parent of orphans
+        for pid, entry in list(self._entries.items()):
+            if entry.ppid and entry.ppid not in self._entries:
+                try:
+                    entry.ppid = entry.proc.ppid()
+                except PSUTIL_EXCEPTIONS:
+                    del self._entries[pid]
+
+        # Inspect only new processes. Processes can vanish in the meantime and
+        # we simply ignore them
+        for pid in pids - self._entries.keys():
+            try:
+                self._entries[pid] = self._make_entry(pid)
+            except PSUTIL_EXCEPTIONS:
+                continue
+        self._children = None
+
+    def _get_children(self):
+        """Get index of children pids by parent pid"""
+        if self._children is None:
+            self._children = {}
+            for child, entry in self._entries.items():
+                self._children.setdefault(entry.ppid, []).append(child)
+        return self._children
+
+    def descendants(self, pid):
+        """Return pid and all its descendants known to the table"""
+        children = self._get_children()
+        pids = []
+        seen = set()
+        stack = [pid]
+        while stack:
+            current = stack.pop()
+            # Guard against cycles that can appear due to pid reuse
+            if current in seen:
+                continue
+            seen.add(current)
+            pids.append(current)
+            stack.extend(children.get(current, ()))
+        return pids
+
+    def user_pids(self, uid):
+        """Return pids of all processes owned by uid"""
+        return [pid for pid, entry in self._entries.items() if entry.uid == uid]
+
+    def update(self, pids, get_cpu_time, pss=False):
+        """Return CPU time consumed by processes since last update and their memory
+
+        get_cpu_time is a callable that takes cpu_times() of a process and
+        returns the CPU time to account for. Memory of processes is their RSS or
+        their PSS if pss is True. PSS is more accurate as shared memory is not
+        duplicated but it is more expensive to read.
+        """
+        return self.update_groups({None: pids}, get_cpu_time, pss=pss)[None]
+
+    def update_groups(self, groups, get_cpu_time, pss=False):
+        """Return CPU time consumed since last update and memory of each group of
+        processes
+
+        groups maps a key to a list of pids. Processes are inspected only once
+        even if they belong to several groups, e.g., a kernel and the scope of
+        the server.
+        """
+        now = time.time()
+        readings = {}
+        usages = {}
+        for key, pids in groups.items():
+            group_cpu_time = 0
+            group_mem = 0
+            for pid in pids:
+                reading = readings.get(pid)
+                if reading is None:
+                    reading = readings[pid] = self._read(pid, get_cpu_time, pss)
+                group_cpu_time += reading[0]
+                group_mem += reading[1]
+            usages[key] = (group_cpu_time, group_mem)
+
+        self._last_update = now
+        return usages
+
+    def _read(self, pid, get_cpu_time, pss):
+        """Return CPU time consumed by a process since last update and its memory"""
+        entry = self._entries.get(pid)
+        try:
+            # If pid is not known yet or if it has been reused since last
+            # scan, (re)create its entry
+            if entry is None or not entry.proc.is_running():
+                entry = self._entries[pid] = self._make_entry(pid)
+                self._children = None
+
+            with entry.proc.oneshot():
+                cpu_time = get_cpu_time(entry.proc.cpu_times())
+                mem = self._get_pss(entry) if pss else entry.proc.memory_info().rss
+        except PSUTIL_EXCEPTIONS:
+            # Processes that vanish are ignored
+            if self._entries.pop(pid, None) is not None:
+                self._children = None
+            return 0, 0
+
+        if entry.cpu_time is None:
+            # Processes that existed before last update but seen for the
+            # first time cannot be accounted for past CPU time
+            entry.cpu_time = cpu_time if entry.create_time < self._last_update else 0
+
+        cpu_time_delta = max(cpu_time - entry.cpu_time, 0)
+        entry.cpu_time = cpu_time
+        return cpu_time_delta, mem
+
+    @staticmethod
+    def _get_pss(entry):
+        """Get PSS of process falling back to RSS if smaps_rollup cannot be read"""
+        try:
+            return read_pss(entry.proc.pid)
+        except FileNotFoundError:
+            raise psutil.NoSuchProcess(entry.proc.pid)
+        except (OSError, ValueError):
+            return entry.proc.memory_info().rss
@@ -0,0 +1,176 @@
+import math
+
+# Content type of Prometheus text exposition format
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Prefix of all exported metric names
+METRIC_PREFIX = 'jupyter_power_usage'
+
+
+def _format_value(value):
+    """Format a sample value as expected by Prometheus"""
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def _escape_label(value):
+    """Escape a label value"""
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+class PrometheusExporter:
+    """Render power usage readings in Prometheus text exposition format
+
+    Exposition text is rendered once per reading made by sampler and served from
+    cache. Scrapes never trigger a new measurement or a new rendering irrespective
+    of scrape interval and number of scrapers.
+    """
+
+    def __init__(self, cpu_power_usage, ledger=None, overhead=None, emissions=None):
+        self.cpu_power_usage = cpu_power_usage
+        self.ledger = ledger
+        self.overhead = overhead
+        self.emissions = emissions
+
+        # Exposition text of latest reading. Empty until first reading
+        self.text = b''
+
+    def _render_metric(self, lines, name, metric_type, help_text, samples):
+        """Append HELP, TYPE and sample lines of a metric family"""
+        if not samples:
+            return
+        name = f'{METRIC_PREFIX}_{name}'
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        for labels, value in samples:
+            if labels:
+                label_str = ','.join(
+                    f'{k}="{_escape_label(v)}"' for k, v in labels.items()
+                )
+                lines.append(f'{name}{{{label_str}}} {_format_value(value)}')
+            else:
+                lines.append(f'{name} {_format_value(value)}')
+
+    def _render_histograms(self, lines, name, help_text, histograms):
+        """Append HELP, TYPE and sample lines of a histogram metric family.
+        histograms is a list of labels and histogram dicts with non cumulative
+        counts"""
+        if not histograms:
+            return
+        name = f'{METRIC_PREFIX}_{name}'
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for labels, histogram in histograms:
+            label_str = ','.join(f'{k}="{_escape_label(v)}"' for k, v in labels.items())
+            count = 0
+            bounds = [*histogram['bounds'], math.inf]
+            for bound, bucket_count in zip(bounds, histogram['counts']):
+                count += bucket_count
+                lines.append(
+                    f'{name}_bucket{{{label_str},le="{_format_value(bound)}"}} {count}'
+                )
+            lines.append(f'{name}_sum{{{label_str}}} {_format_value(histogram["sum"])}')
+            lines.append(f'{name}_count{{{label_str}}} {histogram["count"]}')
+
+    def render(self, reading):
+        """Render exposition text of a reading"""
+        lines = []
+        cpu = reading.get('cpu')
+        gpu = reading.get('gpu')
+
+        power = []
+        limits = []
+        if cpu:
+            power.append(({'domain': 'package'}, cpu['usage'] - cpu.get('dram', 0)))
+            power.append(({'domain': 'dram'}, cpu.get('dram', 0)))
+            limits.append(({'device': 'cpu'}, cpu['limit']))
+        if gpu:
+            power.append(({'domain': 'gpu'}, gpu['usage']))
+            limits.append(({'device': 'gpu'}, gpu['limit']))
+
+        self._render_metric(
+            lines,
+            'power_watts',
+            'gauge',
+            'Power usage of current measurement scope in W.',
+            power,
+        )
+        self._render_metric(
+            lines,
+            'power_limit_watts',
+            'gauge',
+            'Power limit of the host in W.',
+            limits,
+        )
+
+        # Cumulative energy is only available when it is recorded in ledger
+        if self.ledger is not None and (cpu or gpu):
+            self._render_metric(
+                lines,
+                'energy_joules_total',
+                'counter',
+                'Cumulative energy usage of current measurement scope in J.',
+                [({'domain': d}, e) for d, e in self.ledger.get_totals().items()],
+            )
+
+        # Cumulative emissions integrated on server
+        if self.emissions is not None and (cpu or gpu):
+            self._render_metric(
+                lines,
+                'emissions_grams_total',
+                'counter',
+                'Cumulative emissions of each measurement scope in gCO2e.',
+                [({'scope': s}, e) for s, e in self.emissions.totals.items()],
+            )
+            self._render_metric(
+                lines,
+                'carbon_intensity_grams_per_kwh',
+                'gauge',
+                'Carbon intensity used to integrate emissions in gCO2e/kWh.',
+                [({'source': self.emissions.source}, self.emissions.intensity)],
+            )
+
+        # Raw RAPL counters of the host as of latest reading. Counters wrap
+        # around and it is handled as a counter reset by Prometheus
+        if cpu:
+            counters = getattr(self.cpu_power_usage, 'rapl_readings_t', {})
+            self._render_metric(
+                lines,
+                'rapl_energy_joules_total',
+                'counter',
+                'Energy counter of RAPL domain of the host in J.',
+                [
+                    ({'domain': dom}, counters[dom] / 1e6)
+                    for dom in self.cpu_power_usage.rapl_domain_names
+                    if counters.get(dom) is not None
+                ],
+            )
+
+        # Cost of the power meter itself
+        if self.overhead is not None and self.overhead.enabled:
+            self._render_histograms(
+                lines,
+                'overhead_seconds',
+                'Time spent by power meter in each phase of sampling in sec.',
+                [
+                    ({'phase': phase, 'clock': clock}, histogram)
+                    for phase, clocks in self.overhead.get_histograms().items()
+                    for clock, histogram in clocks.items()
+                ],
+            )
+
+        self._render_metric(
+            lines,
+            'last_reading_timestamp_seconds',
+            'gauge',
+            'UNIX timestamp of latest reading.',
+            [({}, reading['timestamp'])],
+        )
+        return ('\n'.join(lines) + '\n').encode()
+
+    def update(self, reading):
+        """Render and cache a new reading made by sampler"""
+        self.text = self.render(reading)
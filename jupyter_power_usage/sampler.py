@@ -0,0 +1,380 @@
+import asyncio
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from tornado.ioloop import IOLoop
+
+from .config import MIN_MEASUREMENT_PERIOD
+from .overhead import OverheadRecorder
+from .scheduler import AdaptiveScheduler
+from .snapshot import StaticMetadata
+from .utils import read_cgroup_procs
+
+# Measurement scopes computed together when all scopes are reported
+ALL_SCOPES = ('process', 'user', 'sys')
+
+
+class PowerUsageSampler:
+    """Sample CPU and GPU power usage periodically in a background task
+
+    A single sampler is shared by all the handlers of the server so that the
+    measurement window is always one sampling period irrespective of number of
+    clients polling the API. Computed readings are kept in a fixed size ring
+    buffer and the latest reading is served by handlers without doing any
+    measurement.
+
+    CPU time consumed by sampling and by listeners is measured on every sample
+    and it is not billed to the measurement scope. Cost of each phase of a
+    sample is recorded in overhead recorder if it is enabled.
+    """
+
+    # A single worker is enough as there is only one sampling task and it avoids
+    # concurrent updates of the readings at t stored in CPU power usage
+    executor = ThreadPoolExecutor(max_workers=1)
+
+    def __init__(self, server_app, cpu_power_usage, gpu_power_usage, overhead=None):
+        self.server_app = server_app
+        self.config = server_app.web_app.settings['jupyter_power_usage_config']
+        self.cpu_power_usage = cpu_power_usage
+        self.gpu_power_usage = gpu_power_usage
+        self.overhead = overhead or OverheadRecorder(enabled=False)
+
+        # CPU time of sampling thread at previous sample and CPU time consumed
+        # by listeners since then
+        self._thread_time_t = None
+        self._listener_cpu_time = 0
+
+        # Ring buffer of readings. Oldest readings are discarded when full. It is
+        # sized from config when sampling starts
+        self.readings = deque()
+
+        # Sequence number of latest reading. It is incremented with each new
+        # reading and can be used by clients to detect new readings
+        self.seq = 0
+
+        # Metadata of backends that is computed once they are initialized
+        self.metadata = None
+
+        # Pids of running kernels and of their process subtree found by latest
+        # scan by kernel id
+        self.kernel_pids = {}
+        self.kernel_subtrees = {}
+
+        # Current process and user used in process and user measurement scopes
+        self.pid = os.getpid()
+        self.uid = os.getuid()
+
+        # Callables that are called with each new reading and listeners whose
+        # failure has already been logged
+        self._listeners = []
+        self._failed_listeners = set()
+
+        # Adaptive scheduler of samples and event set by clients to wake up
+        # sampler when it has backed off. Both are created when sampling starts
+        self.scheduler = None
+        self._wakeup = None
+
+        self._task = None
+
+    @property
+    def period(self):
+        """Sampling period in seconds"""
+        return max(self.config.sampling_period, MIN_MEASUREMENT_PERIOD) / 1e3
+
+    @property
+    def latest(self):
+        """Latest reading or None if no reading has been made yet"""
+        try:
+            return self.readings[-1]
+        except IndexError:
+            return None
+
+    def touch(self):
+        """Record a client request and wake up sampler if it has backed off"""
+        if self.scheduler is None:
+            return
+        self.scheduler.touch()
+        if self._wakeup is not None and self.scheduler.period > self.period:
+            self._wakeup.set()
+
+    def get_next_period(self, reading, cost):
+        """Get period in sec until next sample"""
+        if self.scheduler is None:
+            return self.period
+        return self.scheduler.next_period(reading, cost)
+
+    async def _wait(self, start, period):
+        """Wait until period has elapsed since start or until sampler is woken
+        up by a client"""
+        loop = asyncio.get_running_loop()
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(
+                self._wakeup.wait(), max(period - (loop.time() - start), 0)
+            )
+        except asyncio.TimeoutError:
+            return
+        # Keep a minimum measurement window
+        await asyncio.sleep(
+            max(MIN_MEASUREMENT_PERIOD / 1e3 - (loop.time() - start), 0)
+        )
+
+    def add_listener(self, listener):
+        """Add a callable that will be called with each new reading on event loop"""
+        self._listeners.append(listener)
+
+    def notify(self, reading):
+        """Call each listener with a new reading
+
+        A failing listener does not prevent other listeners from getting the
+        reading. Failure of each listener is logged once.
+        """
+        for listener in self._listeners:
+            try:
+                listener(reading)
+            except Exception as err:
+                if listener not in self._failed_listeners:
+                    self._failed_listeners.add(listener)
+                    self.server_app.log.warning(
+                        'Power usage listener %s failed due to %s'
+                        % (getattr(listener, '__qualname__', listener), err)
+                    )
+
+    def get_kernel_pids(self):
+        """Get pids of running kernels by kernel id
+
+        Kernels are listed on event loop as kernel manager is not thread safe.
+        Kernels that are not local processes are ignored.
+        """
+        kernel_manager = getattr(self.server_app, 'kernel_manager', None)
+        if kernel_manager is None:
+            return {}
+
+        kernel_pids = {}
+        for kernel_id in list(kernel_manager.list_kernel_ids()):
+            try:
+                kernel = kernel_manager.get_kernel(kernel_id)
+            except KeyError:
+                continue
+            pid = getattr(getattr(kernel, 'provisioner', None), 'pid', None)
+            if isinstance(pid, int):
+                kernel_pids[kernel_id] = pid
+        self.kernel_pids = kernel_pids
+        return kernel_pids
+
+    def get_scopes(self):
+        """Get measurement scopes computed on each sample. Scope in use comes
+        first"""
+        scope = self.cpu_power_usage.effective_scope
+        if not self.config.report_all_scopes:
+            return [scope]
+        return [scope] + [s for s in ALL_SCOPES if s != scope]
+
+    def get_pids(self, kernel_pids=None, scopes=None):
+        """Get pids of each measurement scope and pids of process subtree of each
+        kernel
+
+        Processes are classified by ancestry and by owner from the same scan.
+        Returns a dict of pids by scope and a dict of pids by kernel id.
+        """
+        kernel_pids = kernel_pids or {}
+        scopes = scopes or [self.cpu_power_usage.effective_scope]
+        if not kernel_pids and not any(s in ('process', 'user') for s in scopes):
+            # No need to pass any PIDs. CPU and memory shares will be always 1
+            return {scope: [] for scope in scopes}, {}
+
+        # Only new and exited processes since last scan are inspected
+        process_table = self.cpu_power_usage.process_table
+        with self.overhead.phase('process_scan'):
+            process_table.scan()
+        kernels = {
+            kernel_id: process_table.descendants(pid)
+            for kernel_id, pid in kernel_pids.items()
+        }
+        self.kernel_subtrees = kernels
+        scope_pids = {}
+        for scope in scopes:
+            if scope == 'process':
+                scope_pids[scope] = process_table.descendants(self.pid)
+            elif scope == 'user':
+                scope_pids[scope] = process_table.user_pids(self.uid)
+            else:
+                scope_pids[scope] = []
+        return scope_pids, kernels
+
+    def get_gpu_pids(self, scope, pids):
+        """Get pids of a scope to which GPU power usage is attributed or None if
+        all GPU power usage is attributed to the scope"""
+        if scope in ('process', 'user'):
+            return pids
+        if scope == 'cgroup' and self.cpu_power_usage.cgroup_path is not None:
+            return read_cgroup_procs(self.cpu_power_usage.cgroup_path)
+        return None
+
+    def initialize(self):
+        """Initialize power usage backends that have not been initialized yet
+
+        Discovery of RAPL domains and NVML devices is deferred to the sampling
+        thread so that it does not delay server startup.
+        """
+        for backend in (self.cpu_power_usage, self.gpu_power_usage):
+            if not backend.initialized:
+                backend.initialize()
+
+    def get_own_cpu_time(self):
+        """Get CPU time consumed by sampling and listeners since previous sample"""
+        thread_time = time.thread_time()
+        own_cpu_time = 0
+        if self._thread_time_t is not None:
+            own_cpu_time = thread_time - self._thread_time_t + self._listener_cpu_time
+        self._thread_time_t = thread_time
+        self._listener_cpu_time = 0
+        return own_cpu_time
+
+    def sample(self, kernel_pids=None):
+        """Make a new reading and add cost of the power meter itself to it if
+        overhead recorder is enabled"""
+        own_cpu_time = self.get_own_cpu_time()
+        self.overhead.start_sample()
+        with self.overhead.phase('sample'):
+            reading = self._sample(kernel_pids, own_cpu_time)
+        if self.overhead.enabled:
+            reading['overhead'] = {
+                'own_cpu_time': own_cpu_time,
+                'phases': dict(self.overhead.latest),
+            }
+        return reading
+
+    def _sample(self, kernel_pids, own_cpu_time):
+        """Make a new reading of CPU and GPU power usages
+
+        CPU and GPU power usages of each kernel are attributed from the same
+        readings
+        """
+        reading = {'timestamp': time.time()}
+        cpu_available = self.cpu_power_usage.power_usage_available()
+        gpu_available = self.gpu_power_usage.power_usage_available()
+        if not cpu_available and not gpu_available:
+            return reading
+
+        scopes = self.get_scopes()
+        scope_pids, kernels = self.get_pids(kernel_pids, scopes)
+        scope_readings = {scope: {} for scope in scopes}
+        kernel_readings = {kernel_id: {} for kernel_id in kernels}
+
+        # Add CPU metrics to reading if available
+        if cpu_available:
+            (
+                scope_usages,
+                kernel_usages,
+            ) = self.cpu_power_usage.get_power_usage_by_scope(
+                scope_pids, kernels, own_cpu_time=own_cpu_time
+            )
+            for scope, (package, dram) in scope_usages.items():
+                scope_readings[scope]['cpu'] = {'usage': package + dram, 'dram': dram}
+            for kernel_id, (package, dram) in kernel_usages.items():
+                kernel_readings[kernel_id]['cpu'] = {
+                    'usage': package + dram,
+                    'dram': dram,
+                }
+            reading['cpu'] = {
+                **scope_readings[scopes[0]]['cpu'],
+                'limit': self.cpu_power_usage.get_power_limit(),
+            }
+
+        # Add GPU metrics to reading if available. Other scopes are attributed
+        # along with kernels from the same queries
+        if gpu_available:
+            groups = dict(kernels)
+            for scope in scopes[1:]:
+                groups[('scope', scope)] = self.get_gpu_pids(scope, scope_pids[scope])
+            with self.overhead.phase('gpu'):
+                (
+                    gpu_usage,
+                    group_usages,
+                ) = self.gpu_power_usage.get_power_usage_breakdown(
+                    self.get_gpu_pids(scopes[0], scope_pids[scopes[0]]), groups
+                )
+            scope_readings[scopes[0]]['gpu'] = {'usage': gpu_usage}
+            for scope in scopes[1:]:
+                scope_readings[scope]['gpu'] = {'usage': group_usages[('scope', scope)]}
+            for kernel_id in kernels:
+                kernel_readings[kernel_id]['gpu'] = {'usage': group_usages[kernel_id]}
+            reading['gpu'] = {
+                'usage': gpu_usage,
+                'limit': self.gpu_power_usage.get_power_limit(),
+            }
+
+        # Usages of all scopes are only reported when they are all computed
+        if len(scopes) > 1:
+            reading['scopes'] = scope_readings
+        reading['kernels'] = kernel_readings
+        return reading
+
+    async def _run(self):
+        """Sampling loop"""
+        loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        try:
+            await loop.run_in_executor(self.executor, self.initialize)
+        except Exception as err:
+            self.server_app.log.warning(
+                'Failed to initialize power usage backends due to %s' % err
+            )
+        self.metadata = StaticMetadata.from_backends(
+            self.config, self.cpu_power_usage, self.gpu_power_usage
+        )
+        # First readings are made by initialization. Wait for a full measurement
+        # window before the first sample
+        await asyncio.sleep(self.period)
+        while True:
+            start = loop.time()
+            reading = {}
+            try:
+                reading = await loop.run_in_executor(
+                    self.executor, self.sample, self.get_kernel_pids()
+                )
+                self.readings.append(reading)
+                self.seq += 1
+
+                # Listeners serialize the reading on event loop
+                cpu_start = time.thread_time()
+                with self.overhead.phase('serialization'):
+                    self.notify(reading)
+                self._listener_cpu_time += time.thread_time() - cpu_start
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                self.server_app.log.debug(
+                    'Failed to sample power usage due to %s' % err
+                )
+            # Account for time spent in sampling to keep a steady period
+            period = self.get_next_period(reading, loop.time() - start)
+            await self._wait(start, period)
+
+    def _start_task(self):
+        """Create sampling task on the running event loop"""
+        if self._task is None:
+            self.readings = deque(
+                self.readings, maxlen=self.config.sampling_buffer_size
+            )
+            if self.config.adaptive_sampling:
+                self.scheduler = AdaptiveScheduler(
+                    MIN_MEASUREMENT_PERIOD / 1e3,
+                    self.period,
+                    self.config.max_sampling_period / 1e3,
+                    self.config.client_idle_timeout,
+                )
+            self._task = asyncio.ensure_future(self._run())
+
+    def start(self):
+        """Start sampling once the server event loop is running"""
+        IOLoop.current().add_callback(self._start_task)
+
+    def stop(self):
+        """Stop sampling"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
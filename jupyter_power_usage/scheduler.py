@@ -0,0 +1,99 @@
+import math
+import time
+
+# Relative change of power usage between two readings above which power usage is
+# considered to be changing
+CHANGE_THRESHOLD = 0.1
+
+# Change of power usage in W below which power usage is considered to be steady
+# irrespective of relative change. Noise of power usage of a scope that is close
+# to idle is much larger than its usage in relative terms
+CHANGE_FLOOR = 0.5
+
+# Factor by which sampling period grows while power usage is steady
+BACKOFF_FACTOR = 1.5
+
+# Maximum fraction of time that can be spent in sampling
+MAX_DUTY_CYCLE = 0.05
+
+
+class AdaptiveScheduler:
+    """Choose period until next sample from latest reading and client activity
+
+    Sampling period is halved down to min_period while power usage of the scope
+    is changing by more than change_threshold relative to previous reading and by
+    more than change_floor W. It grows back by BACKOFF_FACTOR while it is
+    steady. It never exceeds base_period while clients have made a request in
+    last idle_timeout sec and it backs off up to max_period otherwise. Period is
+    always long enough so that sampling does not take more than MAX_DUTY_CYCLE
+    of the time.
+
+    All periods are in sec.
+    """
+
+    def __init__(
+        self,
+        min_period,
+        base_period,
+        max_period,
+        idle_timeout,
+        change_threshold=CHANGE_THRESHOLD,
+        change_floor=CHANGE_FLOOR,
+        backoff_factor=BACKOFF_FACTOR,
+        max_duty_cycle=MAX_DUTY_CYCLE,
+    ):
+        self.min_period = min_period
+        self.base_period = max(base_period, min_period)
+        self.max_period = max(max_period, self.base_period)
+        self.idle_timeout = idle_timeout
+        self.change_threshold = change_threshold
+        self.change_floor = change_floor
+        self.backoff_factor = backoff_factor
+        self.max_duty_cycle = max_duty_cycle
+
+        self.period = self.base_period
+        self._last_usage = None
+        self._last_activity = -math.inf
+
+    def touch(self, now=None):
+        """Record a client request"""
+        self._last_activity = time.monotonic() if now is None else now
+
+    def clients_active(self, now=None):
+        """Check if a client has made a request recently"""
+        now = time.monotonic() if now is None else now
+        return now - self._last_activity < self.idle_timeout
+
+    @property
+    def ceiling(self):
+        """Longest period allowed given client activity"""
+        return self.base_period if self.clients_active() else self.max_period
+
+    @staticmethod
+    def get_usage(reading):
+        """Get total power usage of scope from a reading or None if power usage is
+        not available"""
+        usages = [reading[k]['usage'] for k in ('cpu', 'gpu') if k in reading]
+        return sum(usages) if usages else None
+
+    def is_changing(self, usage):
+        """Check if power usage has changed since previous reading"""
+        last_usage = self._last_usage
+        self._last_usage = usage
+        if usage is None or last_usage is None:
+            return False
+        change = abs(usage - last_usage)
+        return change > max(self.change_threshold * abs(last_usage), self.change_floor)
+
+    def next_period(self, reading, cost):
+        """Return period until next sample given latest reading and wall time in
+        sec spent in making it"""
+        if self.is_changing(self.get_usage(reading)):
+            period = self.period / 2
+        else:
+            period = self.period * self.backoff_factor
+        period = min(max(period, self.min_period), self.ceiling)
+
+        # Bound cost of sampling irrespective of activity
+        self.period = max(period, cost / self.max_duty_cycle)
+        return self.period
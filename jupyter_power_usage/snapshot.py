@@ -0,0 +1,67 @@
+import getpass
+import socket
+
+from ._version import __version__
+
+
+class StaticMetadata:
+    """Metadata of power usage backends that does not change after startup
+
+    Metadata is computed once when backends have been initialized and it is
+    shared by all requests. Instances are immutable.
+    """
+
+    __slots__ = ('_fields',)
+
+    def __init__(self, **fields):
+        object.__setattr__(self, '_fields', fields)
+
+    def __getattr__(self, name):
+        try:
+            return self._fields[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name, value):
+        raise AttributeError('StaticMetadata is immutable')
+
+    @classmethod
+    def from_backends(cls, config, cpu_power_usage, gpu_power_usage):
+        """Make metadata of initialized CPU and GPU power usage backends"""
+        cpu_available = cpu_power_usage.power_usage_available()
+        gpu_available = gpu_power_usage.power_usage_available()
+        return cls(
+            version=__version__,
+            hostname=socket.gethostname(),
+            user=getpass.getuser(),
+            measurement_scope=cpu_power_usage.effective_scope,
+            cpu_available=cpu_available,
+            cpu_limit=cpu_power_usage.get_power_limit() if cpu_available else None,
+            rapl_domains=tuple(getattr(cpu_power_usage, 'rapl_domain_names', [])),
+            gpu_available=gpu_available,
+            gpu_limit=gpu_power_usage.get_power_limit() if gpu_available else None,
+            num_gpus=len(getattr(gpu_power_usage, 'handles', [])),
+        )
+
+    def to_dict(self):
+        """Return a copy of metadata as a dict"""
+        return dict(self._fields)
+
+
+def get_snapshot_etag(seq, emission_factor=None):
+    """Get ETag of a snapshot from sequence number of the reading and emission
+    factor it contains"""
+    if emission_factor is None:
+        return f'"{seq}"'
+    return f'"{seq}-{emission_factor!r}"'
+
+
+def make_snapshot(seq, metrics, metadata, emission_factor=None):
+    """Make a combined snapshot of latest reading, static metadata and
+    emission factor"""
+    return {
+        **metrics,
+        'seq': seq,
+        'metadata': metadata.to_dict(),
+        'emission_factor': emission_factor,
+    }
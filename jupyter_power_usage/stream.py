@@ -0,0 +1,99 @@
+import asyncio
+import json
+
+
+def diff_payload(current, previous):
+    """Return leaves of current payload that differ from previous payload
+
+    Keys of previous payload that are not in current payload, like kernels that
+    have exited, are marked as removed with a None value.
+    """
+    if not isinstance(current, dict) or not isinstance(previous, dict):
+        return current
+    delta = {}
+    for key, value in current.items():
+        if key not in previous:
+            delta[key] = value
+        elif value != previous[key]:
+            delta[key] = diff_payload(value, previous[key])
+    for key in previous.keys() - current.keys():
+        delta[key] = None
+    return delta
+
+
+class Subscriber:
+    """A client subscribed to power usage stream
+
+    Only the sequence number of last frame sent to the client is kept. A slow
+    client never accumulates frames: when it is ready for the next frame, it gets
+    a delta frame if it is up to date or a full frame if it has missed some.
+    """
+
+    def __init__(self):
+        self.event = asyncio.Event()
+        self.seq = 0
+
+
+class PowerStreamBroadcaster:
+    """Broadcast each new power usage payload to all subscribed clients
+
+    Full and delta frames are encoded once per sample irrespective of number of
+    subscribers.
+    """
+
+    def __init__(self, make_payload):
+        self.make_payload = make_payload
+        self.subscribers = set()
+        self.seq = 0
+        self.full_frame = None
+        self.delta_frame = None
+        self._payload = None
+
+    def subscribe(self):
+        """Add a new subscriber"""
+        subscriber = Subscriber()
+        self.subscribers.add(subscriber)
+        # Send current payload right away if there is one
+        if self._payload is not None:
+            subscriber.event.set()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        """Remove a subscriber"""
+        self.subscribers.discard(subscriber)
+
+    def _encode(self, payload, full):
+        """Encode a frame"""
+        return json.dumps({'seq': self.seq, 'full': full, 'data': payload})
+
+    def next_frame(self, subscriber):
+        """Return next frame to send to subscriber or None if subscriber is up to
+        date"""
+        if subscriber.seq == self.seq:
+            return None
+        if subscriber.seq == self.seq - 1 and self.delta_frame is not None:
+            frame = self.delta_frame
+        else:
+            if self.full_frame is None:
+                self.full_frame = self._encode(self._payload, True)
+            frame = self.full_frame
+        subscriber.seq = self.seq
+        return frame
+
+    def publish(self, reading):
+        """Encode a new reading made by sampler and notify subscribers"""
+        payload = self.make_payload(reading)
+        self.seq += 1
+        self.full_frame = None
+        self.delta_frame = None
+
+        # Frames are encoded only if there are subscribers
+        if self.subscribers:
+            self.full_frame = self._encode(payload, True)
+            if self._payload is not None:
+                self.delta_frame = self._encode(
+                    diff_payload(payload, self._payload), False
+                )
+        self._payload = payload
+        for subscriber in self.subscribers:
+            subscriber.event.set()
@@ -0,0 +1,69 @@
+import os
+
+import pytest
+from mock import MagicMock
+
+from jupyter_power_usage import utils
+
+
+def write_file(path, content):
+    """Write content to file creating parent directories"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(f'{content}\n')
+
+
+def make_rapl_tree(root, num_sockets=1, dram=True, energy_uj=1000000):
+    """Make a fake RAPL powercap tree"""
+    for i_soc in range(num_sockets):
+        package_path = os.path.join(root, f'intel-rapl:{i_soc}')
+        write_file(os.path.join(package_path, 'name'), f'package-{i_soc}')
+        write_file(os.path.join(package_path, 'energy_uj'), energy_uj)
+        write_file(os.path.join(package_path, 'max_energy_range_uj'), 262143328850)
+        write_file(os.path.join(package_path, 'constraint_0_power_limit_uw'), 150000000)
+        if dram:
+            domain_path = os.path.join(package_path, f'intel-rapl:{i_soc}:0')
+            write_file(os.path.join(domain_path, 'name'), 'dram')
+            write_file(os.path.join(domain_path, 'energy_uj'), energy_uj)
+            write_file(os.path.join(domain_path, 'max_energy_range_uj'), 65712999613)
+    return root
+
+
+def make_server_app(**config):
+    """Make a mock server app with given config"""
+    server_app = MagicMock()
+    settings = MagicMock()
+    settings.measurement_scope = 'process'
+    settings.memory_accounting = 'meminfo'
+    settings.sampling_period = 100
+    settings.sampling_buffer_size = 10
+    settings.collector_socket = ''
+    settings.adaptive_sampling = False
+    settings.report_all_scopes = False
+    for key, value in config.items():
+        setattr(settings, key, value)
+    server_app.web_app.settings = {'jupyter_power_usage_config': settings}
+    return server_app
+
+
+@pytest.fixture
+def rapl_tree(tmp_path, monkeypatch):
+    """Fake RAPL powercap tree with one socket and DRAM domain"""
+    root = make_rapl_tree(str(tmp_path / 'intel-rapl'))
+    monkeypatch.setattr(utils, 'RAPL_API_DIR', root)
+    return root
+
+
+@pytest.fixture
+def cgroup_tree(tmp_path, monkeypatch):
+    """Fake cgroup v2 unified hierarchy with cgroup of current process"""
+    root = str(tmp_path / 'cgroup')
+    write_file(os.path.join(root, 'cgroup.controllers'), 'cpu memory')
+    path = os.path.join(root, 'user.slice', 'jupyter.service')
+    write_file(os.path.join(path, 'cpu.stat'), 'usage_usec 1000000\nuser_usec 0')
+    write_file(os.path.join(path, 'memory.current'), 1024 * 1024)
+    proc_cgroup = str(tmp_path / 'proc-cgroup')
+    write_file(proc_cgroup, '0::/user.slice/jupyter.service')
+    monkeypatch.setattr(utils, 'CGROUP_API_DIR', root)
+    monkeypatch.setattr(utils, 'PROC_CGROUP_FILE', proc_cgroup)
+    return path
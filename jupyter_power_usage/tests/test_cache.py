@@ -0,0 +1,138 @@
+import asyncio
+
+import pytest
+from tornado import web
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpclient import HTTPClientError
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+
+from jupyter_power_usage.cache import get_cache_ttl
+from jupyter_power_usage.cache import ResponseCache
+
+
+class StubHandler(web.RequestHandler):
+    """Stub of an upstream API that counts the requests it gets"""
+
+    def initialize(self, state):
+        self.state = state
+
+    async def get(self):
+        self.state['hits'] += 1
+        await asyncio.sleep(self.state['delay'])
+        if self.state['fail']:
+            raise web.HTTPError(503)
+        if self.state['cache_control']:
+            self.set_header('Cache-Control', self.state['cache_control'])
+        self.finish({'carbonIntensity': self.state['hits']})
+
+
+def run_with_stub(test):
+    """Run a test coroutine with a stub upstream server on a local port"""
+
+    async def run():
+        state = {'hits': 0, 'delay': 0, 'fail': False, 'cache_control': ''}
+        sock, port = bind_unused_port()
+        server = HTTPServer(web.Application([(r'/.*', StubHandler, {'state': state})]))
+        server.add_sockets([sock])
+        url = 'http://127.0.0.1:%d/v3/carbon-intensity/latest' % port
+        client = AsyncHTTPClient(force_instance=True)
+
+        async def fetch():
+            response = await client.fetch(url)
+            return response.body, get_cache_ttl(response.headers, 0.2)
+
+        try:
+            await test(state, fetch)
+        finally:
+            server.stop()
+            client.close()
+
+    asyncio.run(run())
+
+
+class TestCache:
+    """Test cache of upstream responses"""
+
+    def test_get_cache_ttl(self):
+        """Check that upstream cache headers can only shorten default TTL"""
+        assert get_cache_ttl({}, 300) == 300
+        assert get_cache_ttl({'Cache-Control': 'public, max-age=60'}, 300) == 60
+        assert get_cache_ttl({'Cache-Control': 'max-age=600'}, 300) == 300
+        assert get_cache_ttl({'Cache-Control': 'max-age=600, s-maxage=10'}, 300) == 10
+        assert get_cache_ttl({'Cache-Control': 'no-store'}, 300) == 0
+        assert get_cache_ttl({'Expires': 'Thu, 01 Jan 1970 00:00:00 GMT'}, 300) == 0
+        assert get_cache_ttl({'Expires': 'invalid'}, 300) == 0
+
+    def test_single_flight(self):
+        """Check that concurrent misses make a single upstream fetch"""
+
+        async def test(state, fetch):
+            cache = ResponseCache(ttl=0.2)
+            state['delay'] = 0.1
+            values = await asyncio.gather(*[cache.get('key', fetch) for _ in range(20)])
+            assert state['hits'] == 1
+            assert len(set(values)) == 1
+
+            # Fresh value is served from cache
+            assert await cache.get('key', fetch) == values[0]
+            assert state['hits'] == 1
+
+        run_with_stub(test)
+
+    def test_stale_while_revalidate(self):
+        """Check that stale value is served while upstream is slow or failing"""
+
+        async def test(state, fetch):
+            cache = ResponseCache(ttl=0.2)
+            first = await cache.get('key', fetch)
+            await asyncio.sleep(0.25)
+
+            # Expired value is served right away while it is revalidated
+            state['delay'] = 0.1
+            assert await cache.get('key', fetch) == first
+            assert await cache.get('key', fetch) == first
+            await asyncio.sleep(0.15)
+            assert state['hits'] == 2
+            assert await cache.get('key', fetch) != first
+
+            # Upstream failures do not hide last value
+            await asyncio.sleep(0.25)
+            state['fail'] = True
+            last = await cache.get('key', fetch)
+            await asyncio.sleep(0.15)
+            assert await cache.get('key', fetch) == last
+            assert state['hits'] == 3
+
+            # Without any cached value, upstream errors are raised
+            with pytest.raises(HTTPClientError):
+                await cache.get('other', fetch)
+
+        run_with_stub(test)
+
+    def test_cache_headers(self):
+        """Check that responses that must not be stored are not cached"""
+
+        async def test(state, fetch):
+            cache = ResponseCache(ttl=0.2)
+            state['cache_control'] = 'no-store'
+            await cache.get('key', fetch)
+            await cache.get('key', fetch)
+            assert state['hits'] == 2
+            assert len(cache) == 0
+
+        run_with_stub(test)
+
+    def test_lru(self):
+        """Check that cache is bounded and least recently used keys are evicted"""
+
+        async def test(state, fetch):
+            cache = ResponseCache(ttl=0.2, max_size=2)
+            await cache.get('a', fetch)
+            await cache.get('b', fetch)
+            await cache.get('a', fetch)
+            await cache.get('c', fetch)
+            assert list(cache._entries) == ['a', 'c']
+            assert state['hits'] == 3
+
+        run_with_stub(test)
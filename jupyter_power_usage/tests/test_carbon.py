@@ -0,0 +1,67 @@
+import calendar
+import json
+from functools import partial
+
+import pytest
+
+from jupyter_power_usage.api import make_carbon_table_response
+from jupyter_power_usage.carbon import CarbonIntensityTable
+from jupyter_power_usage.carbon import main
+from jupyter_power_usage.emissions import EmissionsIntegrator
+
+CARBON_CSV = """zone,month,hour,carbon_intensity
+FR,,,50
+fr,7,,30
+FR,7,12,10
+DE,,18,600
+"""
+
+
+def utc(month, hour):
+    """UNIX timestamp of a given month and hour in UTC"""
+    return calendar.timegm((2024, month, 1, hour, 30, 0))
+
+
+@pytest.fixture
+def carbon_table(tmp_path):
+    """Carbon intensity table built from CSV with CLI"""
+    path = tmp_path / 'carbon.csv'
+    path.write_text(CARBON_CSV)
+    main([str(path), '-o', str(tmp_path / 'carbon.bin')])
+    return CarbonIntensityTable(str(tmp_path / 'carbon.bin'))
+
+
+class TestCarbonTable:
+    """Test offline carbon intensity table"""
+
+    def test_lookup(self, carbon_table):
+        """Check that more specific rows take precedence"""
+        assert carbon_table.lookup('FR', utc(1, 0)) == 50
+        assert carbon_table.lookup('FR', utc(7, 0)) == 30
+        assert carbon_table.lookup('fr', utc(7, 12)) == 10
+        assert carbon_table.lookup('DE', utc(3, 18)) == 600
+
+        # Missing zones and hours are not in table
+        assert carbon_table.lookup('DE', utc(3, 17)) is None
+        assert carbon_table.lookup('UK', utc(3, 17)) is None
+
+    def test_fallback(self, carbon_table):
+        """Check that table answers latest carbon intensity requests and is a
+        source of emissions integrated on server"""
+        response = json.loads(make_carbon_table_response(carbon_table, 'fr'))
+        assert response['zone'] == 'FR'
+        assert response['carbonIntensity'] in (10, 30, 50)
+        assert response['isEstimated']
+        assert make_carbon_table_response(carbon_table, 'UK') is None
+        assert make_carbon_table_response(None, 'FR') is None
+
+        emissions = EmissionsIntegrator(
+            lambda: 'process',
+            475,
+            sources=[
+                ('emaps', lambda timestamp: None),
+                ('table', partial(carbon_table.lookup, 'FR')),
+            ],
+        )
+        emissions.add({'timestamp': utc(7, 12), 'cpu': {'usage': 1000}})
+        assert (emissions.intensity, emissions.source) == (10, 'table')
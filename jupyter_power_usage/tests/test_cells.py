@@ -0,0 +1,184 @@
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import psutil
+from jupyter_client.session import Session
+from mock import MagicMock
+from mock import patch
+
+from .conftest import make_server_app
+from .conftest import write_file
+from jupyter_power_usage.cells import CellEnergyRecorder
+from jupyter_power_usage.cells import KERNEL_ACTIONS_SCHEMA
+from jupyter_power_usage.metrics import CpuPowerUsage
+from jupyter_power_usage.sampler import PowerUsageSampler
+
+# Kernel is a plain Python process that burns CPU
+KERNEL_CODE = 'import time\nt = time.time()\nwhile time.time() - t < 30: pass'
+
+
+def make_recorder(server_app):
+    """Make cell energy recorder of a sampler on fake RAPL tree without GPU"""
+    cpu_power_usage = CpuPowerUsage(server_app)
+    gpu_power_usage = MagicMock()
+    gpu_power_usage.initialized = False
+    sampler = PowerUsageSampler(server_app, cpu_power_usage, gpu_power_usage)
+    return CellEnergyRecorder(sampler, max_cells=2)
+
+
+def iopub_message(session, msg_type, content, request):
+    """Serialize an iopub message sent by a kernel in reply to request"""
+    msg = session.msg(msg_type, content, parent=request)
+    return session.serialize(msg, ident=[msg_type.encode()])
+
+
+class TestCells:
+    """Test energy accounting of cell executions"""
+
+    def test_cell_energy(self, rapl_tree):
+        """Check that energy of an execution is attributed to the kernel from
+        counters read on its iopub messages"""
+        recorder = make_recorder(make_server_app(measurement_scope='process'))
+        session = Session(key=b'secret')
+        kernel = subprocess.Popen([sys.executable, '-c', KERNEL_CODE])
+        recorder.sampler.kernel_pids = {'k1': kernel.pid}
+        request = session.msg('execute_request', {'code': 'x'})
+        try:
+            # Messages are only parsed and counters read, processes are never
+            # scanned on the message path
+            with patch.object(psutil, 'pids', side_effect=AssertionError):
+                futures = [
+                    recorder._on_recv(
+                        'k1',
+                        session,
+                        iopub_message(session, msg_type, content, request),
+                    )
+                    for msg_type, content in (
+                        ('status', {'execution_state': 'busy'}),
+                        ('execute_input', {'code': 'x', 'execution_count': 3}),
+                        ('stream', {'name': 'stdout', 'text': 'x' * 1000}),
+                    )
+                ]
+                # Outputs are not handed over to the sampling thread
+                assert futures[2] is None
+                for future in futures[:2]:
+                    future.result()
+
+                # 20 J consumed by package and 2 J by DRAM during execution
+                time.sleep(0.5)
+                write_file(
+                    os.path.join(rapl_tree, 'intel-rapl:0', 'energy_uj'), 21000000
+                )
+                write_file(
+                    os.path.join(
+                        rapl_tree, 'intel-rapl:0', 'intel-rapl:0:0', 'energy_uj'
+                    ),
+                    3000000,
+                )
+                recorder._on_recv(
+                    'k1',
+                    session,
+                    iopub_message(
+                        session, 'status', {'execution_state': 'idle'}, request
+                    ),
+                ).result()
+        finally:
+            kernel.kill()
+            kernel.wait()
+
+        (cell,) = recorder.get_cells('k1')
+        assert cell['msg_id'] == request['header']['msg_id']
+        assert cell['execution_count'] == 3
+        assert cell['duration'] >= 0.5
+        assert 0 < cell['cpu_share'] <= 1
+        energy = cell['energy']
+        assert energy['cpu'] == 22 * cell['cpu_share']
+        assert energy['dram'] == 2 * cell['cpu_share']
+        assert energy['gpu'] is None
+        assert energy['total'] == energy['cpu']
+        assert recorder.get_cells('k2') == []
+
+    def test_gpu_without_energy_counters(self, rapl_tree):
+        """Check that sampled GPU power usage of a kernel is integrated when
+        devices have no energy counter"""
+        recorder = make_recorder(make_server_app(measurement_scope='process'))
+        recorder.gpu_power_usage.initialized = True
+        recorder.gpu_power_usage.read_energy_counters.return_value = [None]
+        recorder.sampler.readings.extend(
+            {'timestamp': t, 'kernels': {'k1': {'gpu': {'usage': usage}}}}
+            for t, usage in ((10, 100), (20, 50), (30, 200))
+        )
+        start = recorder.read_counters([])._replace(timestamp=15)
+        end = recorder.read_counters([])._replace(timestamp=35)
+        _, energy = recorder.get_energy(start, end, [], 'k1')
+        # 5 sec at 50 W, 10 sec at 200 W and 5 sec after latest reading
+        assert energy['gpu'] == 5 * 50 + 10 * 200 + 5 * 200
+        assert energy['total'] == energy['cpu'] + energy['gpu']
+
+        # Kernels that have not been sampled have no GPU energy
+        _, energy = recorder.get_energy(start, end, [], 'k2')
+        assert energy['gpu'] is None
+
+    def test_sync_kernels(self, rapl_tree):
+        """Check that iopub channel of kernels is observed while they run"""
+        server_app = make_server_app(measurement_scope='process')
+        recorder = make_recorder(server_app)
+        session = Session()
+        streams = {k: MagicMock() for k in ('k1', 'k2')}
+        server_app.kernel_manager.get_kernel.side_effect = lambda k: MagicMock(
+            session=session, connect_iopub=MagicMock(return_value=streams[k])
+        )
+
+        server_app.kernel_manager.list_kernel_ids.return_value = ['k1', 'k2']
+        recorder.update({})
+        recorder.update({})
+        assert server_app.kernel_manager.get_kernel.call_count == 2
+        streams['k1'].on_recv.assert_called_once()
+
+        # Executions of kernels that have stopped are forgotten
+        recorder.cells['k2'] = [{}]
+        server_app.kernel_manager.list_kernel_ids.return_value = ['k1']
+        recorder.update({})
+        streams['k2'].close.assert_called_once()
+        streams['k1'].close.assert_not_called()
+        assert recorder.get_cells('k2') == []
+
+    def test_kernel_started(self, rapl_tree):
+        """Check that kernels are observed as soon as they are started"""
+        server_app = make_server_app(measurement_scope='process')
+        recorder = make_recorder(server_app)
+        kernel = MagicMock(session=Session())
+        kernel.provisioner.pid = 1234
+        server_app.kernel_manager.get_kernel.return_value = kernel
+
+        data = {'action': 'start', 'kernel_id': 'k1', 'status': 'success'}
+        asyncio.run(recorder.on_kernel_action(None, KERNEL_ACTIONS_SCHEMA, data))
+        kernel.connect_iopub.return_value.on_recv.assert_called_once()
+        assert recorder.get_kernel_pids('k1') == [1234]
+
+        # Restarted kernels are observed through a new connection
+        stream = kernel.connect_iopub.return_value
+        data['action'] = 'restart'
+        asyncio.run(recorder.on_kernel_action(None, KERNEL_ACTIONS_SCHEMA, data))
+        stream.close.assert_called_once()
+        assert kernel.connect_iopub.call_count == 2
+
+    def test_pid_reuse(self, rapl_tree):
+        """Check that cached process handles are not used for a reused pid"""
+        recorder = make_recorder(make_server_app(measurement_scope='process'))
+        process_table = recorder.cpu_power_usage.process_table
+        process_table.scan()
+        pid = os.getpid()
+        recorder.get_kernel_cpu_time([pid])
+        ((key, proc),) = recorder._procs.items()
+        assert key == (pid, proc.create_time())
+
+        # Process table has found another process with the same pid
+        with patch.object(process_table, 'get_create_time', return_value=0):
+            recorder.get_kernel_cpu_time([pid])
+            assert len(recorder._procs) == 1
+            recorder.prune()
+            assert recorder._procs == {}
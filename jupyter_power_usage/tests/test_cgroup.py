@@ -0,0 +1,60 @@
+import os
+
+import psutil
+import pytest
+from mock import patch
+
+from .conftest import make_server_app
+from .conftest import write_file
+from jupyter_power_usage import utils
+from jupyter_power_usage.metrics import CpuPowerUsage
+from jupyter_power_usage.utils import get_cgroup_path
+from jupyter_power_usage.utils import read_cgroup_cpu_time
+from jupyter_power_usage.utils import read_cgroup_memory
+
+
+class TestCgroup:
+    """Test cgroup v2 measurement scope"""
+
+    def test_cgroup_path(self, cgroup_tree):
+        """Check that cgroup of current process is found"""
+        assert get_cgroup_path() == cgroup_tree
+        assert read_cgroup_cpu_time(cgroup_tree) == 1
+        assert read_cgroup_memory(cgroup_tree) == 1024 * 1024
+
+    def test_cgroup_v1(self, cgroup_tree, tmp_path, monkeypatch):
+        """Check that cgroup v1 hierarchy is not used"""
+        proc_cgroup = str(tmp_path / 'proc-cgroup-v1')
+        write_file(proc_cgroup, '4:memory:/user.slice/jupyter.service\n0::/')
+        monkeypatch.setattr(utils, 'PROC_CGROUP_FILE', proc_cgroup)
+        assert get_cgroup_path() is None
+
+    def test_cgroup_share(self, rapl_tree, cgroup_tree):
+        """Check that CPU and memory shares are read from cgroup"""
+        server_app = make_server_app(measurement_scope='cgroup')
+        cpu_power_usage = CpuPowerUsage(server_app)
+        assert cpu_power_usage.cgroup_path == cgroup_tree
+
+        # Consume 0.5 s of CPU time out of 2 s of CPU time of host
+        total_cpu_time = cpu_power_usage.total_cpu_time_t
+        write_file(os.path.join(cgroup_tree, 'cpu.stat'), 'usage_usec 1500000')
+        with patch.object(
+            CpuPowerUsage, 'get_total_cpu_time', return_value=total_cpu_time + 2
+        ), patch.object(psutil, 'process_iter') as process_iter:
+            cpu_share, mem_share = cpu_power_usage.get_cpu_share([])
+            process_iter.assert_not_called()
+
+        assert cpu_share == pytest.approx(0.25)
+        meminfo = cpu_power_usage.get_meminfo()
+        assert mem_share == 1024 * 1024 / (meminfo['MemTotal'] - meminfo['MemFree'])
+
+    def test_cgroup_fallback(self, rapl_tree, tmp_path):
+        """Check that process scope is used when cgroup v2 is not available"""
+        server_app = make_server_app(measurement_scope='cgroup')
+        with patch('jupyter_power_usage.utils.CGROUP_API_DIR', str(tmp_path)):
+            cpu_power_usage = CpuPowerUsage(server_app)
+        assert cpu_power_usage.effective_scope == 'process'
+
+        # Shared config is left as configured
+        config = server_app.web_app.settings['jupyter_power_usage_config']
+        assert config.measurement_scope == 'cgroup'
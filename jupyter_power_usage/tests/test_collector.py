@@ -0,0 +1,101 @@
+import asyncio
+import os
+import threading
+
+from mock import patch
+
+from .conftest import make_server_app
+from .conftest import write_file
+from jupyter_power_usage.collector import HostCollector
+from jupyter_power_usage.metrics import CpuPowerUsage
+
+
+class CollectorThread:
+    """Run a host collector on a socket in a background thread"""
+
+    def __init__(self, path):
+        self.loop = asyncio.new_event_loop()
+        self.collector = HostCollector(max_age=0)
+        self.server = self.loop.run_until_complete(self.collector.start(path))
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop collector. Clients connected to it do not get replies anymore"""
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def close(self):
+        """Close collector"""
+        self.server.close()
+        tasks = asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+        self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        self.loop.close()
+
+
+class TestCollector:
+    """Test node local collector and client mode of CPU power usage"""
+
+    def test_client_mode(self, rapl_tree, tmp_path):
+        """Check that host wide counters are fetched from collector"""
+        path = str(tmp_path / 'collector.sock')
+        collector = CollectorThread(path)
+        try:
+            server_app = make_server_app(collector_socket=path)
+            # RAPL domains are not discovered by the server
+            with patch('jupyter_power_usage.metrics.get_rapl_topology') as discover:
+                cpu_power_usage = CpuPowerUsage(server_app)
+            discover.assert_not_called()
+            assert cpu_power_usage.rapl_reader is None
+            assert cpu_power_usage.power_usage_available()
+            assert cpu_power_usage.rapl_domain_names == ['package-0', 'dram-package-0']
+            assert cpu_power_usage.get_power_limit() == 150
+
+            write_file(os.path.join(rapl_tree, 'intel-rapl:0', 'energy_uj'), 2000000)
+            assert cpu_power_usage.get_rapl_counters() == {
+                'package-0': 2000000,
+                'dram-package-0': 1000000,
+            }
+            meminfo = cpu_power_usage.get_meminfo()
+            assert set(meminfo) == {'MemTotal', 'MemFree', 'MemAvailable'}
+            package_usage, dram_usage = cpu_power_usage.get_power_usage_components([])
+            assert package_usage > 0
+
+            # Collector goes away and counters are read directly
+            collector.stop()
+            write_file(os.path.join(rapl_tree, 'intel-rapl:0', 'energy_uj'), 3000000)
+            assert cpu_power_usage.get_rapl_counters()['package-0'] == 3000000
+            assert cpu_power_usage.rapl_reader is not None
+            server_app.log.warning.assert_called_once()
+        finally:
+            collector.close()
+
+    def test_cached_snapshot(self, rapl_tree):
+        """Check that usages of previous reading are returned when time of host
+        counters has not moved"""
+        cpu_power_usage = CpuPowerUsage(make_server_app(measurement_scope='sys'))
+        cpu_power_usage.time_t -= 1
+        write_file(os.path.join(rapl_tree, 'intel-rapl:0', 'energy_uj'), 11000000)
+        usages = cpu_power_usage.get_power_usage_by_scope({'sys': []}, {})
+        assert usages[0]['sys'][0] > 0
+
+        # Same snapshot of collector is served to next reading
+        with patch.object(
+            cpu_power_usage, 'get_host_time', return_value=cpu_power_usage.time_t
+        ):
+            assert cpu_power_usage.get_power_usage_by_scope(
+                {'sys': []}, {'k1': [1]}
+            ) == ({'sys': usages[0]['sys']}, {'k1': (0, 0)})
+
+    def test_fallback(self, rapl_tree, tmp_path):
+        """Check that counters are read directly when collector is absent"""
+        server_app = make_server_app(collector_socket=str(tmp_path / 'missing.sock'))
+        cpu_power_usage = CpuPowerUsage(server_app)
+        assert cpu_power_usage.rapl_reader is not None
+        assert cpu_power_usage.power_usage_available()
+        assert cpu_power_usage.get_rapl_counters() == {
+            'package-0': 1000000,
+            'dram-package-0': 1000000,
+        }
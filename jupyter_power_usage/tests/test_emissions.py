@@ -0,0 +1,83 @@
+import asyncio
+
+from mock import MagicMock
+from pytest import approx
+
+from jupyter_power_usage.api import make_metrics_payload
+from jupyter_power_usage.emissions import EmissionsIntegrator
+from jupyter_power_usage.prometheus import PrometheusExporter
+
+
+def reading(timestamp, cpu=600, gpu=300, scopes=None):
+    """Make a reading as made by sampler"""
+    reading = {
+        'timestamp': timestamp,
+        'cpu': {'usage': cpu, 'dram': 0, 'limit': 1000},
+        'gpu': {'usage': gpu, 'limit': 1000},
+    }
+    if scopes is not None:
+        reading['scopes'] = scopes
+    return reading
+
+
+class TestEmissions:
+    """Test emissions integrated on server"""
+
+    def test_static_factor(self):
+        """Check that power usage is integrated with static factor"""
+        emissions = EmissionsIntegrator(lambda: 'process', 500)
+        # 900 W during 2 h is 1.8 kWh
+        for t in range(3):
+            emissions.add(reading(t * 3600))
+        totals = emissions.get_totals()
+        assert totals['total'] == approx(900)
+        assert totals['source'] == 'static'
+        assert not totals['configured']
+        assert totals['scopes'] == {'process': approx(900)}
+
+        # Emissions are served along with power usage
+        payload = make_metrics_payload(reading(0), emissions=emissions)
+        assert payload['emissions'] == totals
+
+    def test_scopes_and_intensity(self):
+        """Check that all scopes are integrated with cached carbon intensity"""
+        intensity = MagicMock(return_value=None)
+        emissions = EmissionsIntegrator(
+            lambda: 'user', 500, sources=[('emaps', intensity)]
+        )
+        scopes = {
+            'user': {'cpu': {'usage': 1000, 'dram': 0}},
+            'sys': {'cpu': {'usage': 2000, 'dram': 0}},
+        }
+        emissions.add(reading(0, scopes=scopes))
+        intensity.return_value = 100
+        emissions.add(reading(3600, scopes=scopes))
+        totals = emissions.get_totals()
+        assert totals['source'] == 'emaps'
+        assert totals['configured']
+        assert totals['intensity'] == 100
+        assert totals['total'] == approx(100)
+        assert totals['scopes'] == {'user': approx(100), 'sys': approx(200)}
+
+        # Cumulative emissions are exposed to Prometheus
+        exporter = PrometheusExporter(MagicMock(), emissions=emissions)
+        exporter.update(reading(3600))
+        lines = exporter.text.decode().splitlines()
+        assert 'jupyter_power_usage_emissions_grams_total{scope="sys"} 200.0' in lines
+
+    def test_refresh(self):
+        """Check that carbon intensity is refreshed in background at most once
+        per interval"""
+        refresh = MagicMock()
+
+        async def fetch():
+            refresh()
+
+        async def run():
+            emissions = EmissionsIntegrator(lambda: 'process', 500, refresh=fetch)
+            for t in range(5):
+                emissions.add(reading(t))
+                await asyncio.sleep(0)
+
+        asyncio.run(run())
+        refresh.assert_called_once()
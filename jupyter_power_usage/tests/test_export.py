@@ -0,0 +1,81 @@
+import io
+import math
+
+import numpy as np
+
+from .test_ledger import reading
+from jupyter_power_usage.export import EXPORT_COLUMNS
+from jupyter_power_usage.export import iter_export
+from jupyter_power_usage.export import load_export
+from jupyter_power_usage.export import main
+from jupyter_power_usage.ledger import EnergyLedger
+from jupyter_power_usage.ledger import read_ledger
+
+
+def make_ledger(path, timestamps):
+    """Make a ledger with constant power usage at given timestamps"""
+    ledger = EnergyLedger(path, capacity=1000)
+    for t in timestamps:
+        ledger.add(reading(t))
+    ledger.close()
+    return read_ledger(path)
+
+
+def export(path, **kwargs):
+    """Export a ledger file into a dict of columns"""
+    header, records = read_ledger(path)
+    data = b''.join(iter_export(records, int(header['count']), **kwargs))
+    return load_export(io.BytesIO(data))
+
+
+class TestExport:
+    """Test columnar export of energy ledger"""
+
+    def test_export(self, tmp_path):
+        """Check that all records are exported with power since previous row"""
+        path = str(tmp_path / 'energy.bin')
+        make_ledger(path, range(100))
+        columns = export(path)
+        assert set(columns) == set(EXPORT_COLUMNS)
+        assert columns['timestamp'].tolist() == list(range(100))
+        assert columns['package_energy'][-1] == 99 * 8
+        assert math.isnan(columns['package_power'][0])
+        assert np.all(columns['package_power'][1:] == 8)
+        assert np.all(columns['dram_power'][1:] == 2)
+        assert np.all(columns['gpu_power'][1:] == 5)
+
+    def test_chunks(self, tmp_path):
+        """Check that chunking does not change the export"""
+        path = str(tmp_path / 'energy.bin')
+        make_ledger(path, range(100))
+        for kwargs in ({}, {'resolution': 7}, {'since': 10.5, 'until': 80}):
+            expected = export(path, **kwargs)
+            columns = export(path, chunk_size=3, **kwargs)
+            for column in EXPORT_COLUMNS:
+                np.testing.assert_array_equal(columns[column], expected[column])
+
+    def test_range_and_resolution(self, tmp_path):
+        """Check that range is filtered and downsampled rows average power"""
+        path = str(tmp_path / 'energy.bin')
+        make_ledger(path, range(100))
+
+        columns = export(path, since=10, until=19)
+        assert columns['timestamp'].tolist() == list(range(10, 20))
+        # Power of first row is computed from record preceding the range
+        assert columns['package_power'][0] == 8
+
+        columns = export(path, resolution=10)
+        assert columns['timestamp'].tolist() == list(range(9, 100, 10))
+        assert np.all(columns['package_power'][1:] == 8)
+
+        # Empty exports are valid archives
+        columns = export(path, since=1000)
+        assert all(len(columns[column]) == 0 for column in EXPORT_COLUMNS)
+
+    def test_cli(self, tmp_path):
+        """Check that CLI exports a ledger file"""
+        path = str(tmp_path / 'energy.bin')
+        make_ledger(path, range(10))
+        output = str(tmp_path / 'export.npz')
+        main(['--ledger', path, '--since', '5', '-o', output])
+        assert load_export(output)['timestamp'].tolist() == list(range(5, 10))
@@ -0,0 +1,116 @@
+from types import SimpleNamespace
+
+import pytest
+
+from .conftest import make_server_app
+from jupyter_power_usage.metrics import GpuPowerUsage
+
+
+class FakeNvml:
+    """Fake NVML module with devices of given power usage and energy counters"""
+
+    class NVMLError(Exception):
+        pass
+
+    def __init__(self, power, energy=None, procs=None, fail_init=False):
+        # Power usage in mW and energy counters in mJ of each device
+        self.power = power
+        self.energy = energy
+        self.procs = procs or [[] for _ in power]
+        self.fail_init = fail_init
+        self.handle_calls = 0
+        if energy is not None:
+            self.nvmlDeviceGetTotalEnergyConsumption = self._get_energy
+
+    def nvmlInit(self):
+        if self.fail_init:
+            raise self.NVMLError('NVML Shared Library Not Found')
+
+    def nvmlDeviceGetCount(self):
+        return len(self.power)
+
+    def nvmlDeviceGetHandleByIndex(self, i):
+        self.handle_calls += 1
+        return i
+
+    def nvmlDeviceGetEnforcedPowerLimit(self, handle):
+        return 300000
+
+    def nvmlDeviceGetPowerUsage(self, handle):
+        return self.power[handle]
+
+    def _get_energy(self, handle):
+        if self.energy[handle] is None:
+            raise self.NVMLError('Not Supported')
+        return self.energy[handle]
+
+    def nvmlDeviceGetComputeRunningProcesses(self, handle):
+        return [
+            SimpleNamespace(pid=pid, usedGpuMemory=mem)
+            for pid, mem in self.procs[handle]
+        ]
+
+
+def make_gpu_power_usage(nvml):
+    """Make GPU power usage with a fake NVML module"""
+    return GpuPowerUsage(make_server_app(), nvml=nvml)
+
+
+class TestGpu:
+    """Test GPU power usage"""
+
+    def test_unavailable(self):
+        """Check that GPU power usage is not reported if NVML cannot be initialised"""
+        gpu_power_usage = make_gpu_power_usage(FakeNvml([100000], fail_init=True))
+        assert not gpu_power_usage.power_usage_available()
+        assert gpu_power_usage.get_power_usage() == 0
+
+    def test_cached_handles(self):
+        """Check that device handles are looked up only once"""
+        nvml = FakeNvml([100000, 100000])
+        gpu_power_usage = make_gpu_power_usage(nvml)
+        assert gpu_power_usage.get_power_limit() == 600
+        for _ in range(3):
+            gpu_power_usage.get_power_usage()
+        assert nvml.handle_calls == 2
+
+    def test_energy_counter(self):
+        """Check that power usage is computed from energy counters"""
+        nvml = FakeNvml([100000, 100000], energy=[0, None])
+        gpu_power_usage = make_gpu_power_usage(nvml)
+
+        # A spike of 2 kJ on first device between readings that instantaneous
+        # power usage misses. Second device does not support energy counter
+        gpu_power_usage.time_t -= 10
+        nvml.energy[0] = 2000000
+        nvml.power[1] = 200000
+        usage = gpu_power_usage.get_power_usage()
+        assert usage == pytest.approx(200 + 150, rel=1e-3)
+
+    def test_integration(self):
+        """Check that power usage is integrated without energy counters"""
+        nvml = FakeNvml([100000])
+        gpu_power_usage = make_gpu_power_usage(nvml)
+        nvml.power[0] = 200000
+        assert gpu_power_usage.get_power_usage() == 150
+        assert gpu_power_usage.get_power_usage() == 200
+
+    def test_process_attribution(self):
+        """Check that GPU power usage is attributed by used memory of processes"""
+        nvml = FakeNvml(
+            [100000, 100000],
+            procs=[[(10, 3000), (20, 1000)], []],
+        )
+        gpu_power_usage = make_gpu_power_usage(nvml)
+        scope_usage, kernel_usages = gpu_power_usage.get_power_usage_breakdown(
+            [1, 10], {'kernel': [20]}
+        )
+        assert scope_usage == 75
+        assert kernel_usages == {'kernel': 25}
+
+        # All GPU power usage is attributed to system scope
+        assert gpu_power_usage.get_power_usage() == 200
+
+        # Equal shares if used memory is not reported
+        nvml.procs[0] = [(10, None), (20, 1000)]
+        assert gpu_power_usage.get_power_usage([10]) == 50
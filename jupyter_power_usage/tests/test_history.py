@@ -0,0 +1,68 @@
+from jupyter_power_usage.history import PowerHistory
+from jupyter_power_usage.history import RingBuffer
+
+
+def reading(timestamp, cpu, gpu=None):
+    """Make a reading as made by sampler"""
+    reading = {'timestamp': timestamp, 'cpu': {'usage': cpu, 'limit': 100}}
+    if gpu is not None:
+        reading['gpu'] = {'usage': gpu, 'limit': 300}
+    return reading
+
+
+class TestHistory:
+    """Test multi resolution power history store"""
+
+    def test_ring_buffer(self):
+        """Check that oldest rows are overwritten and slices are views"""
+        buffer = RingBuffer(4, 1)
+        for t in range(6):
+            buffer.append([t, t * 10])
+        segments = buffer.segments()
+        assert [row[0] for segment in segments for row in segment] == [2, 3, 4, 5]
+
+        views = buffer.since(3.5)
+        assert [row[0] for view in views for row in view] == [4, 5]
+        assert all(view.base is buffer.data for view in views)
+
+    def test_query_raw(self):
+        """Check that raw readings are returned since a given time"""
+        history = PowerHistory(['cpu', 'gpu'], raw_capacity=3)
+        for t in range(5):
+            history.add(reading(t, t, gpu=2 * t if t % 2 else None))
+        result = history.query(since=2)
+        assert result['timestamp'] == [2, 3, 4]
+        assert result['cpu'] == [2, 3, 4]
+        assert result['gpu'] == [None, 6, None]
+
+        assert history.query(since=10)['cpu'] == []
+
+    def test_query_tiers(self):
+        """Check that downsampled tiers keep min, mean and max per bucket"""
+        history = PowerHistory(['cpu'], tiers=(('1m', 60, 10),))
+        for t, cpu in [(0, 1), (30, 3), (59, 5), (60, 10), (121, 7)]:
+            history.add(reading(t, cpu))
+        result = history.query(resolution='1m')
+        assert result['timestamp'] == [0, 60, 120]
+        assert result['cpu'] == {
+            'min': [1, 10, 7],
+            'mean': [3, 10, 7],
+            'max': [5, 10, 7],
+        }
+        assert history.resolutions == ['raw', '1m']
+
+        # Current bucket is partial and updated until it is flushed
+        assert result['partial']
+        history.add(reading(150, 9))
+        result = history.query(since=100, resolution='1m')
+        assert result['timestamp'] == [120]
+        assert result['cpu'] == {'min': [7], 'mean': [8], 'max': [9]}
+        history.add(reading(180, 1))
+        result = history.query(since=100, resolution='1m')
+        assert result['cpu']['mean'] == [8, 1]
+        assert history.query(since=200, resolution='1m') == {
+            'resolution': '1m',
+            'timestamp': [],
+            'partial': False,
+            'cpu': {'min': [], 'mean': [], 'max': []},
+        }
@@ -0,0 +1,278 @@
+import asyncio
+import json
+
+from tornado import web
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpclient import HTTPClientError
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+
+from jupyter_power_usage.hub import HubAggregator
+from jupyter_power_usage.hub import make_app
+
+# Users of stub hub with power usage of their server and host wide power usage
+# of their node
+USERS = {
+    'alice': {'node': 'node1', 'power': 10, 'host': 100},
+    'bob': {'node': 'node1', 'power': 20, 'host': 102},
+    'carol': {'node': 'node2', 'power': 30, 'host': 200},
+    'dave': {'node': 'node2', 'power': 40, 'host': None},
+}
+
+
+def make_snapshot(user, seq):
+    """Make snapshot of a single user server"""
+    spec = USERS[user]
+    snapshot = {
+        'seq': seq,
+        'cpu': {'usage': spec['power'], 'dram': 0, 'limit': 400},
+        'emissions': {'total': 1},
+        'metadata': {'hostname': spec['node'], 'measurement_scope': 'process'},
+    }
+    if spec['host'] is not None:
+        snapshot['scopes'] = {'sys': {'cpu': {'usage': spec['host'], 'dram': 0}}}
+    return snapshot
+
+
+class HubUsersHandler(web.RequestHandler):
+    """Stub of JupyterHub users API with two pages"""
+
+    def initialize(self, state):
+        self.state = state
+
+    def get(self):
+        assert self.request.headers['Authorization'] == 'token service-token'
+        names = sorted(USERS)
+        offset = int(self.get_argument('offset', 0))
+        page = names[offset : offset + 2]
+        next_page = None
+        if offset + 2 < len(names):
+            next_page = {
+                'url': f'{self.state["url"]}/hub/api/users?offset={offset + 2}'
+            }
+        self.finish(
+            {
+                'items': [
+                    {'name': n, 'servers': {'': {'ready': True, 'url': f'/user/{n}/'}}}
+                    for n in page
+                ],
+                '_pagination': {'next': next_page},
+            }
+        )
+
+
+class HubUserHandler(web.RequestHandler):
+    """Stub of JupyterHub API that identifies owner of a token"""
+
+    def initialize(self, state):
+        self.state = state
+
+    def get(self):
+        self.state['token_checks'] += 1
+        token = self.request.headers['Authorization'][len('token ') :]
+        if token == 'operator-token':
+            self.finish({'name': 'operator', 'scopes': ['read:metrics']})
+        elif token == 'admin-token':
+            self.finish({'name': 'admin', 'admin': True, 'scopes': []})
+        elif token == 'user-token':
+            self.finish({'name': 'alice', 'scopes': ['access:servers!user=alice']})
+        else:
+            raise web.HTTPError(403)
+
+
+class SnapshotHandler(web.RequestHandler):
+    """Stub of single user servers behind the proxy"""
+
+    def initialize(self, state):
+        self.state = state
+
+    async def get(self, user):
+        self.state['inflight'] += 1
+        self.state['max_inflight'] = max(
+            self.state['max_inflight'], self.state['inflight']
+        )
+        try:
+            await asyncio.sleep(0.05)
+            if user in self.state['down']:
+                raise web.HTTPError(503)
+            if user == 'dave' and self.state['slow']:
+                await asyncio.sleep(1)
+            etag = '"1"'
+            self.set_header('Etag', etag)
+            if self.request.headers.get('If-None-Match') == etag:
+                self.state['not_modified'] += 1
+                self.set_status(304)
+                return
+            self.finish(make_snapshot(user, 1))
+        finally:
+            self.state['inflight'] -= 1
+
+
+def run_with_hub(test):
+    """Run a test coroutine with a stub hub and stub servers on a local port"""
+
+    async def run():
+        state = {
+            'inflight': 0,
+            'max_inflight': 0,
+            'not_modified': 0,
+            'down': set(),
+            'slow': False,
+            'token_checks': 0,
+        }
+        sock, port = bind_unused_port()
+        state['url'] = 'http://127.0.0.1:%d' % port
+        server = HTTPServer(
+            web.Application(
+                [
+                    (r'/hub/api/users', HubUsersHandler, {'state': state}),
+                    (r'/hub/api/user', HubUserHandler, {'state': state}),
+                    (
+                        r'/user/(\w+)/api/metrics/v1/power_usage/snapshot',
+                        SnapshotHandler,
+                        {'state': state},
+                    ),
+                ]
+            )
+        )
+        server.add_sockets([sock])
+        aggregator = HubAggregator(
+            f'{state["url"]}/hub/api',
+            'service-token',
+            state['url'],
+            concurrency=2,
+            timeout=0.5,
+        )
+        try:
+            await test(state, aggregator)
+        finally:
+            server.stop()
+            aggregator.client.close()
+
+    asyncio.run(run())
+
+
+class TestHub:
+    """Test aggregation of power usage of single user servers"""
+
+    def test_aggregate(self):
+        """Check that servers are aggregated by user and node with host wide
+        power usage counted once per node"""
+
+        async def test(state, aggregator):
+            view = await aggregator.collect()
+            assert state['max_inflight'] <= 2
+            assert set(view['users']) == set(USERS)
+            assert view['users']['bob']['power'] == 20
+            assert view['nodes']['node1']['users_power'] == 30
+            assert view['nodes']['node1']['power'] in (100, 102)
+            assert view['nodes']['node2']['power'] == 200
+            assert view['total']['users_power'] == 100
+            assert view['total']['power'] == view['nodes']['node1']['power'] + 200
+            assert view['total']['emissions'] == 4
+            assert view['total']['nodes'] == 2
+
+            # Unchanged snapshots are revalidated with their ETag
+            await aggregator.collect()
+            assert state['not_modified'] == 4
+
+        run_with_hub(test)
+
+    def test_last_good_value(self):
+        """Check that last good value of failing and slow servers is kept"""
+
+        async def test(state, aggregator):
+            await aggregator.collect()
+            state['down'].add('carol')
+            state['slow'] = True
+            view = await aggregator.collect()
+            assert view['users']['carol']['stale']
+            assert view['users']['dave']['stale']
+            assert not view['users']['alice']['stale']
+            assert view['total']['users_power'] == 100
+
+            # Values that are too old are not aggregated anymore
+            for entry in aggregator.entries.values():
+                if entry['stale']:
+                    entry['fetched'] -= aggregator.max_age
+            view = await aggregator.collect()
+            assert set(view['users']) == {'alice', 'bob'}
+
+        run_with_hub(test)
+
+    def test_service(self):
+        """Check that aggregated view is only served to allowed tokens"""
+
+        async def test(state, aggregator):
+            await aggregator.collect()
+            sock, port = bind_unused_port()
+            server = HTTPServer(make_app(aggregator, '/services/power-usage/'))
+            server.add_sockets([sock])
+            client = AsyncHTTPClient(force_instance=True)
+            url = 'http://127.0.0.1:%d/services/power-usage/api/power_usage' % port
+            try:
+                response = await client.fetch(
+                    url, headers={'Authorization': 'token operator-token'}
+                )
+                assert json.loads(response.body)['total']['nodes'] == 2
+                for token in ('user-token', 'invalid'):
+                    try:
+                        await client.fetch(
+                            url, headers={'Authorization': f'token {token}'}
+                        )
+                        raise AssertionError('Token should not be allowed')
+                    except HTTPClientError as err:
+                        assert err.code == 403
+            finally:
+                server.stop()
+                client.close()
+
+        run_with_hub(test)
+
+    def test_token_cache(self):
+        """Check that validated tokens are cached in a bounded cache until they
+        expire and that denied tokens are not cached"""
+
+        async def test(state, aggregator):
+            sock, port = bind_unused_port()
+            app = make_app(aggregator, token_cache_ttl=0.2, token_cache_size=1)
+            server = HTTPServer(app)
+            server.add_sockets([sock])
+            client = AsyncHTTPClient(force_instance=True)
+            url = 'http://127.0.0.1:%d/api/power_usage' % port
+
+            async def fetch(token):
+                response = await client.fetch(
+                    url,
+                    headers={'Authorization': f'token {token}'},
+                    raise_error=False,
+                )
+                return response.code
+
+            try:
+                assert await fetch('operator-token') == 200
+                assert await fetch('operator-token') == 200
+                assert state['token_checks'] == 1
+
+                # Denied tokens are checked on every request and never evict
+                # allowed tokens
+                for _ in range(3):
+                    assert await fetch('invalid') == 403
+                assert state['token_checks'] == 4
+                assert await fetch('operator-token') == 200
+                assert state['token_checks'] == 4
+
+                # Cache is bounded and least recently used tokens are evicted
+                assert await fetch('admin-token') == 200
+                assert await fetch('operator-token') == 200
+                assert state['token_checks'] == 6
+
+                # Expired tokens are checked again
+                await asyncio.sleep(0.3)
+                assert await fetch('operator-token') == 200
+                assert state['token_checks'] == 7
+            finally:
+                server.stop()
+                client.close()
+
+        run_with_hub(test)
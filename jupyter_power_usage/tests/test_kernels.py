@@ -0,0 +1,91 @@
+import asyncio
+import json
+import os
+import sys
+
+from jupyter_client.multikernelmanager import AsyncMultiKernelManager
+from mock import MagicMock
+from mock import patch
+
+from .conftest import make_server_app
+from .conftest import write_file
+from jupyter_power_usage.metrics import CpuPowerUsage
+from jupyter_power_usage.sampler import PowerUsageSampler
+
+# Kernels are plain Python processes that either burn CPU or sleep
+KERNEL_CODE = {
+    'busy': 'import time\nt = time.time()\nwhile time.time() - t < 30: pass',
+    'idle': 'import time\ntime.sleep(30)',
+}
+
+
+def make_kernelspecs(root):
+    """Make kernelspecs of busy and idle kernels"""
+    for name, code in KERNEL_CODE.items():
+        write_file(
+            os.path.join(root, 'kernels', name, 'kernel.json'),
+            json.dumps(
+                {
+                    'argv': [sys.executable, '-c', code, '{connection_file}'],
+                    'display_name': name,
+                    'language': 'python',
+                }
+            ),
+        )
+
+
+class TestKernels:
+    """Test per kernel power attribution"""
+
+    def test_kernel_attribution(self, rapl_tree, tmp_path, monkeypatch):
+        """Check that power usage is attributed to each kernel in a single pass"""
+        make_kernelspecs(str(tmp_path / 'jupyter'))
+        monkeypatch.setenv('JUPYTER_PATH', str(tmp_path / 'jupyter'))
+
+        server_app = make_server_app(measurement_scope='process')
+        cpu_power_usage = CpuPowerUsage(server_app)
+        gpu_power_usage = MagicMock()
+        gpu_power_usage.power_usage_available.return_value = False
+
+        async def run():
+            os.makedirs(tmp_path / 'runtime')
+            kernel_manager = AsyncMultiKernelManager(
+                connection_dir=str(tmp_path / 'runtime')
+            )
+            server_app.kernel_manager = kernel_manager
+            sampler = PowerUsageSampler(server_app, cpu_power_usage, gpu_power_usage)
+            try:
+                busy = await kernel_manager.start_kernel(kernel_name='busy')
+                idle = await kernel_manager.start_kernel(kernel_name='idle')
+                kernel_pids = sampler.get_kernel_pids()
+                assert set(kernel_pids) == {busy, idle}
+
+                # 20 J consumed by package in the measurement window
+                await asyncio.sleep(1)
+                write_file(
+                    os.path.join(rapl_tree, 'intel-rapl:0', 'energy_uj'), 21000000
+                )
+
+                process_table = cpu_power_usage.process_table
+                with patch.object(
+                    process_table, 'update_groups', wraps=process_table.update_groups
+                ) as update_groups, patch.object(
+                    cpu_power_usage.rapl_reader,
+                    'read',
+                    wraps=cpu_power_usage.rapl_reader.read,
+                ) as read:
+                    reading = sampler.sample(kernel_pids)
+                update_groups.assert_called_once()
+                read.assert_called_once()
+            finally:
+                await kernel_manager.shutdown_all(now=True)
+            return busy, idle, reading
+
+        busy, idle, reading = asyncio.run(run())
+
+        kernels = reading['kernels']
+        assert set(kernels) == {busy, idle}
+        assert kernels[busy]['cpu']['usage'] > kernels[idle]['cpu']['usage']
+
+        # Kernels are part of process scope of the server
+        assert kernels[busy]['cpu']['usage'] <= reading['cpu']['usage']
@@ -0,0 +1,154 @@
+import os
+import time
+
+from mock import MagicMock
+from mock import patch
+
+from jupyter_power_usage.ledger import EnergyLedger
+from jupyter_power_usage.ledger import LEDGER_HEADER_SIZE
+
+
+def reading(timestamp, cpu=10, dram=2, gpu=5):
+    """Make a reading as made by sampler"""
+    return {
+        'timestamp': timestamp,
+        'cpu': {'usage': cpu, 'dram': dram, 'limit': 100},
+        'gpu': {'usage': gpu, 'limit': 300},
+    }
+
+
+class TestEnergyLedger:
+    """Test cumulative energy ledger"""
+
+    def test_integrate_and_reload(self, tmp_path):
+        """Check that cumulative energy survives a restart"""
+        path = str(tmp_path / 'ledger' / 'energy.bin')
+        ledger = EnergyLedger(path, capacity=100)
+        for t in range(11):
+            ledger.add(reading(t))
+        assert ledger.count == 11
+        assert ledger.get_totals() == {'package': 80, 'dram': 20, 'gpu': 50}
+        ledger.close()
+
+        # Energy is not integrated over the time server was not running
+        ledger = EnergyLedger(path, capacity=100)
+        ledger.open()
+        assert ledger.get_totals() == {'package': 80, 'dram': 20, 'gpu': 50}
+        ledger.add(reading(100))
+        ledger.add(reading(101))
+        assert ledger.get_totals() == {'package': 88, 'dram': 22, 'gpu': 55}
+        ledger.close()
+
+    def test_compaction(self, tmp_path):
+        """Check that compaction keeps cumulative energy and recent records"""
+        ledger = EnergyLedger(str(tmp_path / 'energy.bin'), capacity=8)
+        for t in range(20):
+            ledger.add(reading(t))
+        assert ledger.count <= 8
+        timestamps = ledger.records[: ledger.count, 0].tolist()
+        assert timestamps == sorted(timestamps)
+        assert timestamps[-4:] == [16, 17, 18, 19]
+        assert ledger.records[ledger.count - 1, 1] == 19 * 8
+        assert ledger.get_totals()['package'] == 19 * 8
+        ledger.close()
+
+    def test_interrupted_compaction(self, tmp_path):
+        """Check that a compaction interrupted before the compacted ledger
+        replaces the current one leaves the current ledger intact"""
+        path = str(tmp_path / 'energy.bin')
+        ledger = EnergyLedger(path, capacity=8)
+        for t in range(8):
+            ledger.add(reading(t))
+        with patch('jupyter_power_usage.ledger.os.replace', side_effect=OSError):
+            ledger.add(reading(8))
+        assert ledger.count == 8
+        ledger.close()
+
+        ledger = EnergyLedger(path, capacity=8)
+        ledger.open()
+        assert ledger.count == 8
+        assert ledger.records[:8, 0].tolist() == list(range(8))
+        assert ledger.get_totals()['package'] == 7 * 8
+
+        # Compaction is retried and ledger is still locked after it
+        ledger.add(reading(9))
+        ledger.add(reading(10))
+        timestamps = ledger.records[: ledger.count, 0].tolist()
+        assert timestamps == sorted(set(timestamps))
+        assert timestamps[-2:] == [9, 10]
+        other = EnergyLedger(path)
+        other.open()
+        assert other.records is None
+        ledger.close()
+
+        ledger = EnergyLedger(path, capacity=8)
+        ledger.open()
+        assert ledger.records[: ledger.count, 0].tolist() == timestamps
+        ledger.close()
+
+    def test_locked(self, tmp_path):
+        """Check that a ledger used by another server is not written"""
+        path = str(tmp_path / 'energy.bin')
+        ledger = EnergyLedger(path)
+        ledger.open()
+        other = EnergyLedger(path)
+        other.add(reading(0))
+        other.add(reading(1))
+        assert other.records is None
+        assert other.get_totals()['gpu'] == 5
+        assert ledger.count == 0
+        ledger.close()
+
+    def test_incompatible(self, tmp_path):
+        """Check that an incompatible file is moved aside"""
+        path = str(tmp_path / 'energy.bin')
+        with open(path, 'wb') as f:
+            f.write(b'garbage' * 1000)
+        ledger = EnergyLedger(path, capacity=10)
+        ledger.open()
+        assert ledger.count == 0
+        assert os.path.exists(path + '.bak')
+
+        # New ledger is locked
+        other = EnergyLedger(path)
+        other.open()
+        assert other.records is None
+        ledger.close()
+
+    def test_truncated(self, tmp_path):
+        """Check that empty and truncated files are moved aside"""
+        path = str(tmp_path / 'energy.bin')
+        ledger = EnergyLedger(path, capacity=10)
+        ledger.add(reading(0))
+        ledger.close()
+        with open(path, 'r+b') as f:
+            f.truncate(LEDGER_HEADER_SIZE + 8)
+
+        for _ in range(2):
+            ledger = EnergyLedger(path, capacity=10)
+            ledger.add(reading(0))
+            assert ledger.count == 1
+            ledger.close()
+            with open(path, 'wb'):
+                pass
+
+    def test_open_failure(self, tmp_path):
+        """Check that a ledger that cannot be opened is reported"""
+        (tmp_path / 'file').write_text('')
+        log = MagicMock()
+        ledger = EnergyLedger(str(tmp_path / 'file' / 'energy.bin'), log=log)
+        ledger.add(reading(0))
+        ledger.add(reading(1))
+        assert ledger.records is None
+        assert ledger.get_totals()['gpu'] == 5
+        log.warning.assert_called_once()
+
+    def test_overhead(self, tmp_path):
+        """Check that appending a record is cheap"""
+        ledger = EnergyLedger(str(tmp_path / 'energy.bin'), capacity=1000)
+        readings = [reading(t) for t in range(5000)]
+        start = time.perf_counter()
+        for r in readings:
+            ledger.add(r)
+        assert (time.perf_counter() - start) / len(readings) < 1e-3
+        ledger.close()
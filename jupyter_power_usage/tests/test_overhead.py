@@ -0,0 +1,84 @@
+from mock import MagicMock
+
+from .conftest import make_server_app
+from .test_sampler import make_sampler
+from jupyter_power_usage.metrics import CpuPowerUsage
+from jupyter_power_usage.overhead import OverheadRecorder
+from jupyter_power_usage.prometheus import PrometheusExporter
+
+
+class TestOverhead:
+    """Test instrumentation of the cost of the power meter"""
+
+    def test_disabled(self):
+        """Check that nothing is recorded when recorder is disabled"""
+        overhead = OverheadRecorder(enabled=False)
+        assert overhead.phase('rapl') is overhead.phase('gpu')
+        with overhead.phase('rapl'):
+            pass
+        assert overhead.get_histograms() == {}
+        assert overhead.latest == {}
+
+    def test_histograms(self):
+        """Check that wall and CPU time of phases are recorded in histograms"""
+        overhead = OverheadRecorder(buckets=(1e-3, 1e-2))
+        overhead.record('rapl', 5e-4, 1e-4)
+        overhead.record('rapl', 5e-3, 1e-3)
+        overhead.record('rapl', 1, 1e-3)
+        with overhead.phase('gpu'):
+            pass
+
+        histograms = overhead.get_histograms()
+        assert set(histograms) == {'rapl', 'gpu'}
+        assert histograms['rapl']['wall']['counts'] == [1, 1, 1]
+        assert histograms['rapl']['cpu']['counts'] == [3, 0, 0]
+        assert histograms['rapl']['wall']['count'] == 3
+        assert overhead.latest['rapl'] == {'wall': 1, 'cpu': 1e-3}
+
+        # Histograms are exposed to Prometheus with cumulative buckets
+        exporter = PrometheusExporter(MagicMock(), overhead=overhead)
+        exporter.update({'timestamp': 1700000000})
+        lines = exporter.text.decode().splitlines()
+        name = 'jupyter_power_usage_overhead_seconds'
+        assert f'# TYPE {name} histogram' in lines
+        assert f'{name}_bucket{{phase="rapl",clock="wall",le="0.01"}} 2' in lines
+        assert f'{name}_bucket{{phase="rapl",clock="wall",le="+Inf"}} 3' in lines
+        assert f'{name}_count{{phase="rapl",clock="wall"}} 3' in lines
+
+    def test_sample(self):
+        """Check that cost of each phase and own CPU time are added to readings"""
+        sampler = make_sampler()
+        sampler.overhead = OverheadRecorder()
+        sampler.sample()
+
+        # CPU time consumed by sampler since previous sample is passed to CPU
+        # power usage so that it is not billed to the scope
+        reading = sampler.sample()
+        _, kwargs = sampler.cpu_power_usage.get_power_usage_by_scope.call_args
+        assert kwargs['own_cpu_time'] == reading['overhead']['own_cpu_time']
+        assert reading['overhead']['own_cpu_time'] >= 0
+        assert set(reading['overhead']['phases']) == {'sample'}
+
+    def test_stale_phases(self):
+        """Check that phases of a previous sample are not added to readings"""
+        sampler = make_sampler()
+        sampler.overhead = OverheadRecorder()
+        sampler.overhead.record('gpu', 1, 1)
+        reading = sampler.sample()
+        assert set(reading['overhead']['phases']) == {'sample'}
+        assert sampler.overhead.get_histograms()['gpu']['wall']['count'] == 1
+
+    def test_own_cpu_time(self, rapl_tree):
+        """Check that CPU time of the power meter is not billed to process scope"""
+        cpu_power_usage = CpuPowerUsage(make_server_app(measurement_scope='process'))
+        cpu_power_usage.get_host_cpu_time = (
+            lambda: cpu_power_usage.total_cpu_time_t + 10
+        )
+        cpu_power_usage.process_table.update_groups = MagicMock(
+            return_value={('scope', 'process'): (4, 0), 'kernel': (4, 0)}
+        )
+        scope_shares, kernel_shares = cpu_power_usage.get_cpu_shares(
+            [1], {'kernel': [1]}, own_cpu_time=3
+        )
+        assert scope_shares[0] == 0.1
+        assert kernel_shares['kernel'][0] == 0.4
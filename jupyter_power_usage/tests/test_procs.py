@@ -0,0 +1,134 @@
+import os
+import subprocess
+import sys
+
+from mock import MagicMock
+
+from jupyter_power_usage.procs import ProcessTable
+
+
+def cpu_time(cpu_times):
+    return cpu_times.user + cpu_times.system
+
+
+class TestProcessTable:
+    """Test incremental process table"""
+
+    def test_descendants(self):
+        """Check that new children are discovered and exited ones dropped"""
+        table = ProcessTable()
+        table.scan()
+        child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])
+        try:
+            assert child.pid not in table.descendants(os.getpid())
+            table.scan()
+            assert child.pid in table.descendants(os.getpid())
+            assert child.pid in table.user_pids(os.getuid())
+        finally:
+            child.kill()
+            child.wait()
+        table.scan()
+        assert child.pid not in table
+
+    def test_children_index(self):
+        """Check that children index is built once per scan"""
+        code = (
+            'import subprocess\n'
+            'p = subprocess.Popen(["sleep", "30"], stdout=subprocess.DEVNULL)\n'
+            'print(p.pid, flush=True)\n'
+            'input()'
+        )
+        child = subprocess.Popen(
+            [sys.executable, '-c', code],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        grandchild = int(child.stdout.readline())
+        try:
+            table = ProcessTable()
+            table.scan()
+            assert grandchild in table.descendants(os.getpid())
+            children = table._children
+            table.descendants(child.pid)
+            assert table._children is children
+        finally:
+            os.kill(grandchild, 9)
+            child.communicate('')
+
+    def test_reparented(self):
+        """Check that parent of processes whose parent exited is refreshed"""
+        code = (
+            'import subprocess\n'
+            'p = subprocess.Popen(["sleep", "30"], stdout=subprocess.DEVNULL)\n'
+            'print(p.pid, flush=True)\n'
+            'input()'
+        )
+        child = subprocess.Popen(
+            [sys.executable, '-c', code],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        grandchild = int(child.stdout.readline())
+        try:
+            table = ProcessTable()
+            table.scan()
+            assert grandchild in table.descendants(os.getpid())
+
+            # Grandchild is reparented when child exits
+            child.communicate('')
+            table.scan()
+            assert grandchild not in table.descendants(os.getpid())
+            assert table._entries[grandchild].ppid != child.pid
+        finally:
+            os.kill(grandchild, 9)
+
+    def test_update_vanished_process(self):
+        """Check that processes vanishing mid scan are ignored"""
+        table = ProcessTable()
+        child = subprocess.Popen([sys.executable, '-c', 'pass'])
+        table.scan()
+        child.wait()
+
+        procs_cpu_time, procs_rss = table.update([os.getpid(), child.pid], cpu_time)
+        assert procs_cpu_time >= 0
+        assert procs_rss > 0
+        assert child.pid not in table
+
+    def test_update_cpu_time(self):
+        """Check that only CPU time since last update is accounted"""
+        table = ProcessTable()
+        table.scan()
+        table.update([os.getpid()], cpu_time)
+
+        # Burn some CPU
+        sum(i * i for i in range(2000000))
+
+        procs_cpu_time, _ = table.update([os.getpid()], cpu_time)
+        assert (
+            0 < procs_cpu_time < cpu_time(table._entries[os.getpid()].proc.cpu_times())
+        )
+
+    def test_pid_reuse(self):
+        """Check that a reused pid gets a new entry"""
+        table = ProcessTable()
+        table.scan()
+        table.update([os.getpid()], cpu_time)
+
+        # Fake a stale handle of a process that does not exist anymore
+        stale = MagicMock()
+        stale.is_running.return_value = False
+        table._entries[os.getpid()].proc = stale
+
+        table.update([os.getpid()], cpu_time)
+        assert table._entries[os.getpid()].proc is not stale
+        stale.cpu_times.assert_not_called()
+
+    def test_update_pss(self):
+        """Check that PSS of processes is used when asked"""
+        table = ProcessTable()
+        table.scan()
+        _, procs_rss = table.update([os.getpid()], cpu_time)
+        _, procs_pss = table.update([os.getpid()], cpu_time, pss=True)
+        assert 0 < procs_pss <= procs_rss
@@ -0,0 +1,63 @@
+from mock import MagicMock
+
+from jupyter_power_usage.prometheus import PrometheusExporter
+
+
+def make_exporter(ledger=None):
+    """Make an exporter with mocked CPU power usage"""
+    cpu_power_usage = MagicMock()
+    cpu_power_usage.rapl_domain_names = ['package-0', 'dram-package-0']
+    cpu_power_usage.rapl_readings_t = {
+        'package-0': 3000000,
+        'dram-package-0': 500000,
+    }
+    return PrometheusExporter(cpu_power_usage, ledger)
+
+
+class TestPrometheus:
+    """Test Prometheus exposition"""
+
+    def test_render(self):
+        """Check that exposition text has power, limits, energy and RAPL counters"""
+        ledger = MagicMock()
+        ledger.get_totals.return_value = {'package': 10.0, 'dram': 2.0, 'gpu': 0.0}
+        exporter = make_exporter(ledger)
+        assert exporter.text == b''
+
+        exporter.update(
+            {
+                'timestamp': 1700000000.5,
+                'cpu': {'usage': 30, 'dram': 5, 'limit': 200},
+                'gpu': {'usage': 50, 'limit': 300},
+            }
+        )
+        lines = exporter.text.decode().splitlines()
+        assert '# TYPE jupyter_power_usage_power_watts gauge' in lines
+        assert 'jupyter_power_usage_power_watts{domain="package"} 25.0' in lines
+        assert 'jupyter_power_usage_power_watts{domain="dram"} 5.0' in lines
+        assert 'jupyter_power_usage_power_watts{domain="gpu"} 50.0' in lines
+        assert 'jupyter_power_usage_power_limit_watts{device="cpu"} 200.0' in lines
+        assert 'jupyter_power_usage_power_limit_watts{device="gpu"} 300.0' in lines
+        assert '# TYPE jupyter_power_usage_energy_joules_total counter' in lines
+        assert 'jupyter_power_usage_energy_joules_total{domain="package"} 10.0' in lines
+        assert (
+            'jupyter_power_usage_rapl_energy_joules_total{domain="package-0"} 3.0'
+            in lines
+        )
+        assert (
+            'jupyter_power_usage_rapl_energy_joules_total{domain="dram-package-0"} 0.5'
+            in lines
+        )
+        assert 'jupyter_power_usage_last_reading_timestamp_seconds 1700000000.5' in (
+            lines
+        )
+
+    def test_cached(self):
+        """Check that exposition text is rendered only once per reading"""
+        exporter = make_exporter()
+        exporter.update({'timestamp': 0, 'gpu': {'usage': 50, 'limit': 300}})
+        text = exporter.text
+        assert exporter.text is text
+        assert b'energy_joules_total' not in text
+        assert b'rapl_energy_joules_total' not in text
+        exporter.cpu_power_usage.get_rapl_counters.assert_not_called()
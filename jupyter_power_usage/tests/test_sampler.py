@@ -0,0 +1,95 @@
+import asyncio
+
+from mock import MagicMock
+
+from jupyter_power_usage.sampler import PowerUsageSampler
+
+
+def make_sampler(scope='sys', period=100, buffer_size=3):
+    """Make a sampler with mocked CPU and GPU power usages"""
+    server_app = MagicMock()
+    config = MagicMock()
+    config.measurement_scope = scope
+    config.sampling_period = period
+    config.sampling_buffer_size = buffer_size
+    config.adaptive_sampling = False
+    config.report_all_scopes = False
+    server_app.web_app.settings = {'jupyter_power_usage_config': config}
+
+    cpu_power_usage = MagicMock()
+    cpu_power_usage.effective_scope = scope
+    cpu_power_usage.power_usage_available.return_value = True
+    cpu_power_usage.get_power_usage_by_scope.side_effect = (
+        ({scope: (i, 1)}, {}) for i in range(100)
+    )
+    cpu_power_usage.get_power_limit.return_value = 200
+
+    gpu_power_usage = MagicMock()
+    gpu_power_usage.power_usage_available.return_value = False
+
+    return PowerUsageSampler(server_app, cpu_power_usage, gpu_power_usage)
+
+
+class TestSampler:
+    """Test background power usage sampler"""
+
+    def test_sample(self):
+        """Check that a reading contains only available metrics"""
+        sampler = make_sampler()
+        reading = sampler.sample()
+        assert reading['cpu'] == {'usage': 1, 'dram': 1, 'limit': 200}
+        assert 'gpu' not in reading
+        assert 'timestamp' in reading
+
+    def test_failing_listener(self):
+        """Check that a failing listener does not prevent others from getting
+        readings and that its failure is logged once"""
+        sampler = make_sampler()
+        failing = MagicMock(side_effect=ValueError)
+        listener = MagicMock()
+        sampler.add_listener(failing)
+        sampler.add_listener(listener)
+        for _ in range(2):
+            sampler.notify(sampler.sample())
+        assert listener.call_count == 2
+        sampler.server_app.log.warning.assert_called_once()
+
+    def test_ring_buffer(self):
+        """Check that sampler keeps only latest readings irrespective of clients"""
+        sampler = make_sampler()
+        assert sampler.latest is None
+
+        async def run():
+            sampler._start_task()
+            await asyncio.sleep(0.55)
+            # Readings do not move forward by reading latest values
+            for _ in range(10):
+                sampler.latest
+            sampler.stop()
+
+        asyncio.run(run())
+
+        assert len(sampler.readings) == 3
+        usages = [r['cpu']['usage'] for r in sampler.readings]
+        assert usages == sorted(usages)
+        assert sampler.latest['cpu']['usage'] == usages[-1]
+        # Only one measurement per sampling period must be made
+        calls = sampler.cpu_power_usage.get_power_usage_by_scope.call_count
+        assert calls <= 7
+
+    def test_lazy_initialize(self):
+        """Check that backends are initialized in background before sampling"""
+        sampler = make_sampler()
+        sampler.cpu_power_usage.initialized = False
+        sampler.gpu_power_usage.initialized = True
+
+        async def run():
+            sampler._start_task()
+            await asyncio.sleep(0.25)
+            sampler.stop()
+
+        asyncio.run(run())
+
+        sampler.cpu_power_usage.initialize.assert_called_once()
+        sampler.gpu_power_usage.initialize.assert_not_called()
+        assert sampler.latest is not None
@@ -0,0 +1,79 @@
+import asyncio
+
+from .test_sampler import make_sampler
+from jupyter_power_usage.scheduler import AdaptiveScheduler
+
+
+def make_reading(usage):
+    """Make a reading with CPU power usage"""
+    return {'timestamp': 0, 'cpu': {'usage': usage, 'dram': 0, 'limit': 200}}
+
+
+class TestScheduler:
+    """Test adaptive sampling scheduler"""
+
+    def test_changing(self):
+        """Check that sampling speeds up while power usage is changing"""
+        scheduler = AdaptiveScheduler(0.1, 5, 60, 60)
+        scheduler.touch()
+        scheduler.next_period(make_reading(10), 0)
+        periods = [scheduler.next_period(make_reading(10 * 2**i), 0) for i in range(8)]
+        assert periods == sorted(periods, reverse=True)
+        assert periods[-1] == 0.1
+
+        # Power usage is steady again and sampling backs off to base period as
+        # clients are active
+        for _ in range(20):
+            period = scheduler.next_period(make_reading(1280), 0)
+        assert period == 5
+
+    def test_noisy_idle_usage(self):
+        """Check that noise of near zero power usage is not a change"""
+        scheduler = AdaptiveScheduler(0.1, 5, 60, 60)
+        scheduler.touch()
+        for i in range(20):
+            period = scheduler.next_period(make_reading(0.07 + 0.03 * (i % 2)), 0)
+        assert period == 5
+
+        # A kernel that starts computing is still a change
+        assert scheduler.next_period(make_reading(5), 0) == 2.5
+
+    def test_idle_clients(self):
+        """Check that sampling backs off when no client is active"""
+        scheduler = AdaptiveScheduler(0.1, 5, 60, 60)
+        assert not scheduler.clients_active()
+        for _ in range(20):
+            period = scheduler.next_period(make_reading(10), 0)
+        assert period == 60
+
+        # A client request brings period back to base period
+        scheduler.touch()
+        assert scheduler.next_period(make_reading(10), 0) == 5
+
+    def test_bounded_cost(self):
+        """Check that sampling does not take more than a fraction of the time"""
+        scheduler = AdaptiveScheduler(0.1, 5, 60, 60, max_duty_cycle=0.1)
+        scheduler.touch()
+        scheduler.next_period(make_reading(10), 0)
+        assert scheduler.next_period(make_reading(100), 2) == 20
+
+    def test_wakeup(self):
+        """Check that a backed off sampler is woken up by a client request"""
+        sampler = make_sampler(period=100)
+        sampler.config.adaptive_sampling = True
+        sampler.config.max_sampling_period = 60000
+        sampler.config.client_idle_timeout = 60
+
+        async def run():
+            sampler._start_task()
+            # Sampler backs off as no client is active
+            sampler.scheduler.period = 60
+            await asyncio.sleep(0.3)
+            count = len(sampler.readings)
+            sampler.touch()
+            await asyncio.sleep(0.3)
+            sampler.stop()
+            return count
+
+        count = asyncio.run(run())
+        assert len(sampler.readings) > count
@@ -0,0 +1,66 @@
+import os
+
+from mock import MagicMock
+from mock import patch
+
+from .conftest import make_server_app
+from .conftest import write_file
+from jupyter_power_usage.api import make_metrics_payload
+from jupyter_power_usage.metrics import CpuPowerUsage
+from jupyter_power_usage.sampler import PowerUsageSampler
+
+
+def make_sampler(**config):
+    """Make a sampler with real CPU power usage and no GPU"""
+    server_app = make_server_app(**config)
+    cpu_power_usage = CpuPowerUsage(server_app)
+    gpu_power_usage = MagicMock()
+    gpu_power_usage.power_usage_available.return_value = False
+    return PowerUsageSampler(server_app, cpu_power_usage, gpu_power_usage)
+
+
+class TestScopes:
+    """Test power usage of measurement scopes"""
+
+    def test_sys_scope(self, rapl_tree):
+        """Check that entire power usage of host is reported in sys scope"""
+        sampler = make_sampler(measurement_scope='sys')
+        write_file(os.path.join(rapl_tree, 'intel-rapl:0', 'energy_uj'), 21000000)
+        with patch.object(
+            sampler.cpu_power_usage.process_table, 'update_groups'
+        ) as update_groups:
+            reading = sampler.sample()
+        update_groups.assert_not_called()
+        assert reading['cpu']['usage'] > 0
+        scope_shares, _ = sampler.cpu_power_usage.get_cpu_shares_by_scope(
+            {'sys': []}, {}
+        )
+        assert scope_shares['sys'] == (1, 1)
+        assert 'scopes' not in reading
+
+    def test_all_scopes(self, rapl_tree):
+        """Check that all scopes are computed from a single pass over processes"""
+        sampler = make_sampler(measurement_scope='process', report_all_scopes=True)
+        cpu_power_usage = sampler.cpu_power_usage
+        write_file(os.path.join(rapl_tree, 'intel-rapl:0', 'energy_uj'), 21000000)
+        process_table = cpu_power_usage.process_table
+        with patch.object(
+            process_table, 'update_groups', wraps=process_table.update_groups
+        ) as update_groups, patch.object(
+            cpu_power_usage.rapl_reader, 'read', wraps=cpu_power_usage.rapl_reader.read
+        ) as read:
+            reading = sampler.sample()
+        update_groups.assert_called_once()
+        read.assert_called_once()
+
+        scopes = reading['scopes']
+        assert list(scopes) == ['process', 'user', 'sys']
+        assert scopes['process']['cpu']['usage'] == reading['cpu']['usage']
+
+        # Scopes are nested so their usages are ordered
+        usages = [scopes[s]['cpu']['usage'] for s in scopes]
+        assert usages == sorted(usages)
+
+        # All scopes are served along with the configured one
+        payload = make_metrics_payload(reading)
+        assert payload['scopes'] == scopes
@@ -0,0 +1,75 @@
+import asyncio
+import json
+
+import pytest
+
+from .test_sampler import make_sampler
+from jupyter_power_usage.api import EMAPS_LATEST_PATH
+from jupyter_power_usage.api import get_cached_emission_factor
+from jupyter_power_usage.api import get_emaps_cache_key
+from jupyter_power_usage.cache import ResponseCache
+from jupyter_power_usage.snapshot import get_snapshot_etag
+from jupyter_power_usage.snapshot import make_snapshot
+from jupyter_power_usage.snapshot import StaticMetadata
+
+
+class TestSnapshot:
+    """Test combined snapshot of power usage"""
+
+    def test_metadata(self):
+        """Check that metadata is computed once from backends and is immutable"""
+        sampler = make_sampler()
+        sampler.gpu_power_usage.handles = []
+
+        async def run():
+            sampler._start_task()
+            await asyncio.sleep(0.3)
+            sampler.stop()
+
+        asyncio.run(run())
+        metadata = sampler.metadata
+        assert metadata.cpu_available
+        assert metadata.cpu_limit == 200
+        assert not metadata.gpu_available
+        assert metadata.gpu_limit is None
+        assert sampler.seq == len(sampler.readings)
+
+        with pytest.raises(AttributeError):
+            metadata.cpu_limit = 100
+        metadata.to_dict()['cpu_limit'] = 100
+        assert metadata.cpu_limit == 200
+
+    def test_snapshot(self):
+        """Check that snapshot combines reading, metadata and emission factor"""
+        metadata = StaticMetadata(cpu_available=True, cpu_limit=200)
+        metrics = {'cpu': {'usage': 10, 'dram': 1, 'limit': 200}}
+        snapshot = make_snapshot(3, metrics, metadata, 50)
+        assert json.loads(json.dumps(snapshot)) == {
+            'cpu': {'usage': 10, 'dram': 1, 'limit': 200},
+            'seq': 3,
+            'metadata': {'cpu_available': True, 'cpu_limit': 200},
+            'emission_factor': 50,
+        }
+
+        # ETag changes with a new reading or a new emission factor
+        assert get_snapshot_etag(3) == '"3"'
+        assert get_snapshot_etag(3) != get_snapshot_etag(4)
+        assert get_snapshot_etag(3, 50) != get_snapshot_etag(3, 60)
+
+    def test_cached_emission_factor(self):
+        """Check that emission factor is read from the proxy cache without any
+        upstream request"""
+        cache = ResponseCache(ttl=60)
+        assert get_cached_emission_factor(cache, 'fr') is None
+
+        async def fetch_latest():
+            return json.dumps({'carbonIntensity': 42}), None
+
+        async def run():
+            key = get_emaps_cache_key(EMAPS_LATEST_PATH, {'zone': 'FR'})
+            await cache.get(key, fetch_latest)
+
+        asyncio.run(run())
+        assert get_cached_emission_factor(cache, 'fr') == 42
+        assert get_cached_emission_factor(cache, 'DE') is None
+        assert get_cached_emission_factor(None, 'FR') is None
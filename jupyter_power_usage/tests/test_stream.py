@@ -0,0 +1,80 @@
+import json
+
+from jupyter_power_usage.stream import diff_payload
+from jupyter_power_usage.stream import PowerStreamBroadcaster
+
+
+def reading(cpu, gpu=50):
+    """Make a reading as made by sampler"""
+    return {
+        'timestamp': 0,
+        'cpu': {'usage': cpu, 'limit': 100},
+        'gpu': {'usage': gpu, 'limit': 300},
+    }
+
+
+class TestStream:
+    """Test power usage stream broadcaster"""
+
+    def test_diff_payload(self):
+        """Check that only changed leaves are in delta"""
+        assert diff_payload(
+            {'cpu': {'usage': 2, 'limit': 100}, 'gpu': {'usage': 1}},
+            {'cpu': {'usage': 1, 'limit': 100}, 'gpu': {'usage': 1}},
+        ) == {'cpu': {'usage': 2}}
+
+    def test_removed_keys(self):
+        """Check that keys that disappear between frames are marked as removed"""
+        broadcaster = PowerStreamBroadcaster(
+            lambda r: {'cpu': r['cpu'], 'kernels': r['kernels']}
+        )
+        subscriber = broadcaster.subscribe()
+        kernels = {'k1': {'cpu': {'usage': 1}}, 'k2': {'cpu': {'usage': 2}}}
+        broadcaster.publish({**reading(10), 'kernels': kernels})
+        broadcaster.next_frame(subscriber)
+
+        # Kernel k2 has exited
+        broadcaster.publish({**reading(10), 'kernels': {'k1': kernels['k1']}})
+        frame = json.loads(broadcaster.next_frame(subscriber))
+        assert frame['data'] == {'kernels': {'k2': None}}
+
+    def test_frames(self):
+        """Check that up to date subscribers get deltas and slow ones full frames"""
+        broadcaster = PowerStreamBroadcaster(lambda r: {'cpu': r['cpu']})
+        fast = broadcaster.subscribe()
+        slow = broadcaster.subscribe()
+
+        broadcaster.publish(reading(10))
+        assert fast.event.is_set() and slow.event.is_set()
+        frame = json.loads(broadcaster.next_frame(fast))
+        assert frame == {
+            'seq': 1,
+            'full': True,
+            'data': {'cpu': {'usage': 10, 'limit': 100}},
+        }
+        # No new frame until next reading
+        assert broadcaster.next_frame(fast) is None
+
+        broadcaster.publish(reading(20))
+        broadcaster.publish(reading(30))
+        # Frames are encoded once for all subscribers
+        assert broadcaster.next_frame(fast) is broadcaster.next_frame(slow)
+        assert json.loads(broadcaster.full_frame)['data']['cpu']['usage'] == 30
+
+        broadcaster.publish(reading(40))
+        frame = json.loads(broadcaster.next_frame(fast))
+        assert frame == {'seq': 4, 'full': False, 'data': {'cpu': {'usage': 40}}}
+
+        broadcaster.unsubscribe(slow)
+        assert broadcaster.subscribers == {fast}
+
+    def test_late_subscriber(self):
+        """Check that a new subscriber gets current payload right away"""
+        broadcaster = PowerStreamBroadcaster(lambda r: {'cpu': r['cpu']})
+        broadcaster.publish(reading(10))
+        assert broadcaster.full_frame is None
+
+        subscriber = broadcaster.subscribe()
+        assert subscriber.event.is_set()
+        frame = json.loads(broadcaster.next_frame(subscriber))
+        assert frame['full'] and frame['data']['cpu']['usage'] == 10
@@ -0,0 +1,124 @@
+import os
+
+import psutil
+from mock import patch
+from pytest import approx
+
+from .conftest import make_server_app
+from .conftest import write_file
+from jupyter_power_usage import utils
+from jupyter_power_usage.metrics import CpuPowerUsage
+from jupyter_power_usage.utils import filter_rapl_domains
+from jupyter_power_usage.utils import get_rapl_topology
+from jupyter_power_usage.utils import RaplReader
+from jupyter_power_usage.utils import read_meminfo
+from jupyter_power_usage.utils import read_pss
+
+
+class TestRaplReader:
+    """Test batched RAPL counters reader"""
+
+    def test_read(self, rapl_tree):
+        """Check that counters of all domains are read"""
+        domains, _, _ = filter_rapl_domains()
+        reader = RaplReader(domains)
+        assert reader.names == ['package-0', 'dram-package-0']
+        assert reader.read() == [1000000, 1000000]
+
+        # Counters are read again from same open files
+        fds = list(reader._fds)
+        write_file(domains['package-0'], 2000000)
+        assert reader.read() == [2000000, 1000000]
+        assert reader._fds == fds
+        reader.close()
+        assert reader._fds == [None, None]
+
+    def test_reopen(self, rapl_tree):
+        """Check that counter files that disappear are reopened"""
+        domains, _, _ = filter_rapl_domains()
+        reader = RaplReader(domains)
+        reader.read()
+
+        # Counter file disappears
+        os.remove(domains['package-0'])
+        # Last good value is reported while it cannot be read
+        assert reader.read() == [1000000, 1000000]
+
+        # Counter file is back
+        write_file(domains['package-0'], 3000000)
+        os.close(reader._fds[0])
+        assert reader.read() == [3000000, 1000000]
+
+    def test_no_spike(self, rapl_tree):
+        """Check that a counter file that disappears between two samples does not
+        make a spike of power usage"""
+        cpu_power_usage = CpuPowerUsage(make_server_app(measurement_scope='sys'))
+        package_path = os.path.join(rapl_tree, 'intel-rapl:0', 'energy_uj')
+        dram_path = os.path.join(
+            rapl_tree, 'intel-rapl:0', 'intel-rapl:0:0', 'energy_uj'
+        )
+
+        # Measurement windows of 1 s. Counter file disappears and its open file
+        # cannot be read anymore as it happens in sysfs
+        os.remove(dram_path)
+        os.close(cpu_power_usage.rapl_reader._fds[1])
+        write_file(package_path, 1500000)
+        cpu_power_usage.time_t -= 1
+        package, dram = cpu_power_usage.get_power_usage_components([])
+        assert package == approx(0.5, rel=0.1)
+        assert dram < 1000
+
+        write_file(dram_path, 1100000)
+        cpu_power_usage.time_t -= 1
+        package, dram = cpu_power_usage.get_power_usage_components([])
+        assert dram == approx(0.1, rel=0.1)
+
+        # Counters that have never been read are skipped
+        assert (
+            cpu_power_usage.get_total_power_usage(
+                1,
+                (
+                    {'package-0': 3000000, 'dram-package-0': None},
+                    {'package-0': 1000000},
+                ),
+            )[0]
+            == 2
+        )
+
+
+class TestTopology:
+    """Test discovery and caching of host topology"""
+
+    def test_rapl_topology_cache(self, rapl_tree, tmp_path, monkeypatch):
+        """Check that RAPL topology is reused from cache until next boot"""
+        boot_id_file = str(tmp_path / 'boot_id')
+        write_file(boot_id_file, 'boot-1')
+        monkeypatch.setattr(utils, 'BOOT_ID_FILE', boot_id_file)
+        cache_path = str(tmp_path / 'cache' / 'rapl-topology.json')
+
+        topology = get_rapl_topology(cache_path)
+        assert os.path.exists(cache_path)
+        with patch.object(
+            utils, 'filter_rapl_domains', wraps=utils.filter_rapl_domains
+        ) as discover:
+            assert get_rapl_topology(cache_path) == topology
+            discover.assert_not_called()
+
+            # Topology is discovered again after a reboot
+            write_file(boot_id_file, 'boot-2')
+            assert get_rapl_topology(cache_path) == topology
+            discover.assert_called_once()
+
+
+class TestMemory:
+    """Test memory accounting utilities"""
+
+    def test_read_meminfo(self):
+        """Check that meminfo values are in bytes"""
+        meminfo = read_meminfo()
+        assert meminfo['MemTotal'] == psutil.virtual_memory().total
+        assert 0 < meminfo['MemAvailable'] <= meminfo['MemTotal']
+
+    def test_read_pss(self):
+        """Check that PSS of current process is read"""
+        assert 0 < read_pss(os.getpid()) <= psutil.Process().memory_info().rss
@@ -1,64 +1,47 @@
+import json
 import os
 import re
-import subprocess
 
 # RAPL powercap API directory
 RAPL_API_DIR = '/sys/class/powercap/intel-rapl'
 
-# Maximum number of RAPL domains
-# pkg, core, uncore, dram, psys
-# Seems like psys is TOTAL consumption but not available on all chips
-# Ref: https://github.com/powercap/powercap/issues/3
-NUM_RAPL_DOMAINS = 5
+# cgroup v2 unified hierarchy mount point
+CGROUP_API_DIR = '/sys/fs/cgroup'
 
+# File listing cgroups of current process
+PROC_CGROUP_FILE = '/proc/self/cgroup'
 
-def execute_cmd(cmd):
-    """Accept command string and returns output. If command fails, returns None"""
-    try:
-        # Execute command
-        completed = subprocess.run(
-            cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=True
-        )
-        # Get stdout and stderr. We are piping stderr to stdout as well
-        return completed.stdout.decode('utf-8').rstrip()
-    except subprocess.CalledProcessError:
-        return None
+# procfs mount point
+PROCFS_DIR = '/proc'
 
+# File with a unique ID of current boot
+BOOT_ID_FILE = '/proc/sys/kernel/random/boot_id'
 
-def get_num_sockets():
-    """Gets number of processors"""
-    # Get output from lscpu command
-    cmd_out = execute_cmd('lscpu')
 
-    if cmd_out is None:
-        # If command fails, return 1 socket as default
-        return 1
-
-    # Get number of sockets present in the processor
-    sockets = re.search(r'Socket\(s\):\s*([\d])', cmd_out, re.M)
-    if sockets:
-        return int(sockets.group(1))
-    else:
-        return 1
+def list_rapl_zones(path, prefix):
+    """List RAPL zones directly under path sorted by their index"""
+    try:
+        entries = os.listdir(path)
+    except OSError:
+        return []
+    pattern = re.compile(re.escape(prefix) + r'(\d+)')
+    zones = [
+        (m.group(0), int(m.group(1))) for m in map(pattern.fullmatch, entries) if m
+    ]
+    return [zone for zone, _ in sorted(zones, key=lambda z: z[1])]
 
 
 def get_all_available_rapl_domains():
     """Gets all the packages, core, uncore and dram domains available within RAPL
     powercap interface"""
 
-    # Get number of sockets present in the processor
-    # psys will be a separate domain so check for num_sockets + 1
-    num_sockets = get_num_sockets() + 1
-
     # Dict with package and domain names and paths
     rapl_domains = {'packages': {}}
 
-    # Check available devices for each socket
-    for i_soc in range(num_sockets):
-        package_path = os.path.join(RAPL_API_DIR, 'intel-rapl:{}'.format(i_soc))
-        # If path not found, ignore
-        if not os.path.exists(package_path):
-            continue
+    # Zones of packages are listed from sysfs directly. There is one package per
+    # socket and psys is a separate package
+    for package_zone in list_rapl_zones(RAPL_API_DIR, 'intel-rapl:'):
+        package_path = os.path.join(RAPL_API_DIR, package_zone)
 
         with open(os.path.join(package_path, 'name'), 'r') as pkg_name:
             package_name = pkg_name.readline().rstrip('\n')
@@ -68,20 +51,16 @@ def get_all_available_rapl_domains():
             'energy_uj': os.path.join(package_path, 'energy_uj'),
         }
 
-        for i_dom in range(NUM_RAPL_DOMAINS):
-            domain_path = os.path.join(
-                package_path, 'intel-rapl:{}:{}'.format(i_soc, i_dom)
-            )
-            if not os.path.exists(domain_path):
-                continue
+        for domain_zone in list_rapl_zones(package_path, f'{package_zone}:'):
+            domain_path = os.path.join(package_path, domain_zone)
 
             with open(os.path.join(domain_path, 'name'), 'r') as dom_name:
                 domain_name = dom_name.readline().rstrip('\n')
 
-            rapl_domains['packages'][package_name]['domains'] = {
-                domain_name: {
-                    'energy_uj': os.path.join(domain_path, 'energy_uj'),
-                }
+            rapl_domains['packages'][package_name].setdefault('domains', {})[
+                domain_name
+            ] = {
+                'energy_uj': os.path.join(domain_path, 'energy_uj'),
             }
 
     return rapl_domains
@@ -90,9 +69,8 @@ def get_all_available_rapl_domains():
 def read_max_energy_uj_counter(path):
     """Utility function that takes energy_uj path and return overflow counter for that
     energy counter"""
-    return int(
-        open(path.replace('energy_uj', 'max_energy_range_uj'), 'r').read().rstrip('\n')
-    )
+    with open(path.replace('energy_uj', 'max_energy_range_uj'), 'r') as f:
+        return int(f.read().rstrip('\n'))
 
 
 def read_power_limit_uw_counter(path):
@@ -111,12 +89,170 @@ def read_power_limit_uw_counter(path):
         # Check if constraint_1_power_limit_uw file exists. There is no guarantee that
         # it exists on all systems. If it exists return value
         if os.path.exists(power_limit_path):
-            return int(open(power_limit_path, 'r').read().rstrip('\n'))
+            with open(power_limit_path, 'r') as f:
+                return int(f.read().rstrip('\n'))
 
     # If neither of them exists, return 0
     return 0
 
 
+class RaplReader:
+    """Read energy counters of RAPL domains in one batch
+
+    A file descriptor is kept open for each domain and counters are read with
+    pread into a preallocated buffer to avoid open and close syscalls on every
+    reading. If a counter file disappears, its file descriptor is reopened on the
+    next reading and last good value of the counter is reported meanwhile.
+    """
+
+    # Energy counters in uJ fit in 20 digits and a new line
+    SLOT_SIZE = 32
+
+    def __init__(self, domains):
+        self.names = list(domains.keys())
+        self.paths = list(domains.values())
+        self._fds = [None] * len(self.paths)
+        self._buffer = bytearray(self.SLOT_SIZE * len(self.paths))
+        self._slots = [
+            memoryview(self._buffer)[i * self.SLOT_SIZE : (i + 1) * self.SLOT_SIZE]
+            for i in range(len(self.paths))
+        ]
+
+        # Last good value of each counter. None until a counter has been read
+        self._last = [None] * len(self.paths)
+
+    def _open(self, i):
+        """Open energy counter file of ith domain"""
+        self._fds[i] = os.open(self.paths[i], os.O_RDONLY)
+        return self._fds[i]
+
+    def _close(self, i):
+        """Close energy counter file of ith domain"""
+        if self._fds[i] is not None:
+            try:
+                os.close(self._fds[i])
+            except OSError:
+                pass
+            self._fds[i] = None
+
+    def _read(self, i):
+        """Read energy counter of ith domain in its slot and return number of bytes"""
+        fd = self._fds[i]
+        if fd is None:
+            fd = self._open(i)
+        try:
+            return os.preadv(fd, [self._slots[i]], 0)
+        except OSError:
+            # Counter file has disappeared or has been replaced. Reopen it once
+            self._close(i)
+            return os.preadv(self._open(i), [self._slots[i]], 0)
+
+    def read(self):
+        """Read energy counters of all domains in uJ. Counters that cannot be read
+        are reported with their last good value or None if they have never been
+        read, so that a failed read never looks like an overflow"""
+        for i in range(len(self.paths)):
+            try:
+                nbytes = self._read(i)
+                self._last[i] = int(
+                    self._buffer[i * self.SLOT_SIZE : i * self.SLOT_SIZE + nbytes]
+                )
+            except PermissionError:
+                continue
+            except (OSError, ValueError):
+                self._close(i)
+        return list(self._last)
+
+    def close(self):
+        """Close all file descriptors"""
+        for i in range(len(self._fds)):
+            self._close(i)
+
+    def __del__(self):
+        self.close()
+
+
+def get_cgroup_path():
+    """Gets path of cgroup v2 of current process in unified hierarchy. If cgroup v2
+    is not available, returns None"""
+    # Unified hierarchy must be mounted at CGROUP_API_DIR. In hybrid setups, v1
+    # controllers are mounted there and cpu and memory accounting are not
+    # available in unified hierarchy
+    if not os.path.exists(os.path.join(CGROUP_API_DIR, 'cgroup.controllers')):
+        return None
+
+    try:
+        with open(PROC_CGROUP_FILE, 'r') as f:
+            for line in f:
+                # cgroup v2 entry is always of form 0::<path>
+                hierarchy_id, controllers, path = line.rstrip('\n').split(':', 2)
+                if hierarchy_id == '0' and controllers == '':
+                    cgroup_path = os.path.join(CGROUP_API_DIR, path.lstrip('/'))
+                    if os.path.exists(os.path.join(cgroup_path, 'cpu.stat')):
+                        return cgroup_path
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def read_cgroup_cpu_time(path):
+    """Utility function that takes cgroup path and returns total CPU time consumed
+    by all processes in the cgroup in seconds"""
+    with open(os.path.join(path, 'cpu.stat'), 'r') as f:
+        for line in f:
+            key, value = line.split()
+            if key == 'usage_usec':
+                return int(value) / 1e6
+    return 0
+
+
+def read_cgroup_memory(path):
+    """Utility function that takes cgroup path and returns current memory usage of
+    all processes in the cgroup in bytes"""
+    try:
+        with open(os.path.join(path, 'memory.current'), 'r') as f:
+            return int(f.read().rstrip('\n'))
+    except (OSError, ValueError):
+        # memory controller might not be enabled for the cgroup
+        return 0
+
+
+def read_cgroup_procs(path):
+    """Utility function that takes cgroup path and returns pids of processes in the
+    cgroup"""
+    try:
+        with open(os.path.join(path, 'cgroup.procs'), 'r') as f:
+            return [int(pid) for pid in f.read().split()]
+    except (OSError, ValueError):
+        return []
+
+
+def read_meminfo():
+    """Utility function that reads /proc/meminfo and returns a dict of values in
+    bytes"""
+    meminfo = {}
+    with open(os.path.join(PROCFS_DIR, 'meminfo'), 'rb') as f:
+        for line in f:
+            fields = line.split()
+            # Values are in kB except for few entries like HugePages_Total
+            value = int(fields[1])
+            if len(fields) == 3:
+                value *= 1024
+            meminfo[fields[0][:-1].decode()] = value
+    return meminfo
+
+
+def read_pss(pid):
+    """Utility function that returns proportional set size (PSS) of process in bytes
+    from smaps_rollup. Shared pages are split among processes sharing them and hence
+    sum of PSS of all processes does not duplicate shared memory"""
+    with open(os.path.join(PROCFS_DIR, str(pid), 'smaps_rollup'), 'rb') as f:
+        for line in f:
+            if line.startswith(b'Pss:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
 def filter_rapl_domains():
     """From all available RAPL domains, filter the ones that are relevant for energy
     consumption calculation and return it as flattened dict"""
@@ -176,9 +312,68 @@ def filter_rapl_domains():
     )
 
 
-if __name__ == '__main__':
-    import json
+def read_boot_id():
+    """Read ID of current boot. Returns None if it is not available"""
+    try:
+        with open(BOOT_ID_FILE, 'r') as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
 
+
+def get_default_topology_cache_path():
+    """Default path of RAPL topology cache in Jupyter data directory"""
+    from jupyter_core.paths import jupyter_data_dir
+
+    return os.path.join(jupyter_data_dir(), 'power_usage', 'rapl-topology.json')
+
+
+def get_rapl_topology(cache_path=None):
+    """Return filtered RAPL domains, their power limits and overflow counters
+
+    Topology does not change until next boot. If cache_path is given, topology is
+    cached in it along with current boot ID and reused until next boot.
+    """
+    boot_id = read_boot_id() if cache_path else None
+    if boot_id is not None:
+        try:
+            with open(cache_path, 'r') as f:
+                cache = json.load(f)
+            if cache['boot_id'] == boot_id and cache['rapl_api_dir'] == RAPL_API_DIR:
+                return (
+                    cache['domains'],
+                    cache['power_limits'],
+                    cache['overflow_counters'],
+                )
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    topology = filter_rapl_domains()
+
+    # Only cache discovered domains as counters might become readable later
+    if boot_id is not None and topology[0]:
+        domains, power_limits, overflow_counters = topology
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(
+                    {
+                        'boot_id': boot_id,
+                        'rapl_api_dir': RAPL_API_DIR,
+                        'domains': domains,
+                        'power_limits': power_limits,
+                        'overflow_counters': overflow_counters,
+                    },
+                    f,
+                )
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            pass
+    return topology
+
+
+if __name__ == '__main__':
     rapl_domains = get_all_available_rapl_domains()
     print(json.dumps(rapl_domains, indent=2))
 
@@ -25,6 +25,13 @@ import '../style/index.css';
  */
 const DEFAULT_RAPL_REFRESH_RATE = 5000;
 
+/**
+ * Interval in ms and maximum number of retries while server is initializing
+ * power usage backends.
+ */
+const INITIALIZING_RETRY_INTERVAL = 1000;
+const MAX_INITIALIZING_RETRIES = 30;
+
 /**
  * By default indicator bar is always enabled.
  */
@@ -96,6 +103,7 @@ const extension: JupyterFrontEndPlugin<void> = {
 
     let refreshRate = DEFAULT_RAPL_REFRESH_RATE;
     let indicatorBarDisabled = DEFAULT_INDICATOR_BAR_DISABLED;
+    let scope = '';
     let cpuPowerLabel = DEFAULT_CPU_POWER_LABEL;
     let gpuPowerLabel = DEFAULT_GPU_POWER_LABEL;
     let emissionsRefreshRate = DEFAULT_EMISSIONS_REFRESH_RATE;
@@ -117,6 +125,8 @@ const extension: JupyterFrontEndPlugin<void> = {
       indicatorBarDisabled = settings.get('indicatorBarDisabled')
         .composite as boolean;
 
+      scope = settings.get('scope').composite as string;
+
       const emissionsSettings = settings.get('emissions')
         .composite as IEmissionsSettings;
       emissionFactorSource = emissionsSettings.source;
@@ -156,6 +166,7 @@ const extension: JupyterFrontEndPlugin<void> = {
 
     const model = new PowerUsage.Model(emissionsModel, {
       refreshRate,
+      scope,
       refreshStandby: () => {
         if (info) {
           return !info.isConnected || 'when-hidden';
@@ -165,6 +176,19 @@ const extension: JupyterFrontEndPlugin<void> = {
     });
     await model.refresh();
 
+    // Server discovers power usage backends in background after startup. Wait
+    // for the first reading before deciding which metrics are available
+    for (
+      let i = 0;
+      model.initializing && i < MAX_INITIALIZING_RETRIES;
+      i++
+    ) {
+      await new Promise((resolve) =>
+        setTimeout(resolve, INITIALIZING_RETRY_INTERVAL)
+      );
+      await model.refresh();
+    }
+
     // Dispose poll if none of the metrics are available
     if (!model.cpuPowerAvailable && !model.gpuPowerAvailable) {
       console.log('Power metrics are not available...');
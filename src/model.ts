@@ -38,6 +38,7 @@ export namespace PowerUsage {
     constructor(model: EmissionFactor.Model, options: Model.IOptions) {
       super();
       this._emissionModel = model;
+      this._scope = options.scope || '';
       for (let i = 0; i < N_BUFFER; i++) {
         this._values.push({ cpuPowerShare: 0, gpuPowerShare: 0 });
       }
@@ -57,6 +58,10 @@ export namespace PowerUsage {
         const { payload, phase } = poll.state;
         if (phase === 'resolved') {
           this._updateMetricsValues(payload);
+          // Switch to server push once metrics are known to be available
+          if (payload && (payload.cpu || payload.gpu)) {
+            this._connectStream();
+          }
           return;
         }
         if (phase === 'rejected') {
@@ -93,6 +98,13 @@ export namespace PowerUsage {
       return this._cpuPowerUsageAvailable;
     }
 
+    /**
+     * Whether the server is still initializing power usage backends.
+     */
+    get initializing(): boolean {
+      return this._initializing;
+    }
+
     /**
      * Whether the GPU power metric is available.
      */
@@ -177,9 +189,44 @@ export namespace PowerUsage {
      * Dispose of the power usage model.
      */
     dispose(): void {
+      if (this._stream) {
+        this._stream.close();
+        this._stream = null;
+      }
       this._poll.dispose();
     }
 
+    /**
+     * Subscribe to power usage stream pushed by the server. Polling is
+     * stopped while the stream is open and restarted if it fails.
+     */
+    private _connectStream(): void {
+      if (this._stream || typeof EventSource === 'undefined') {
+        return;
+      }
+      const stream = new EventSource(Private.STREAM_URL, {
+        withCredentials: true,
+      });
+      stream.onopen = () => {
+        void this._poll.stop();
+      };
+      stream.onmessage = (event: MessageEvent) => {
+        const frame = JSON.parse(event.data) as Private.IPowerUsageFrame;
+        this._streamPayload = frame.full
+          ? frame.data
+          : Private.mergePayload(this._streamPayload, frame.data);
+        this._updateMetricsValues(this._streamPayload);
+      };
+      stream.onerror = () => {
+        // Browser reconnects by itself unless the stream is closed
+        if (stream.readyState === EventSource.CLOSED) {
+          this._stream = null;
+          void this._poll.start();
+        }
+      };
+      this._stream = stream;
+    }
+
     /**
      * Given the results of the metrics request, update model values.
      *
@@ -188,6 +235,7 @@ export namespace PowerUsage {
     private _updateMetricsValues(
       value: Private.IPowerUsageResult | null
     ): void {
+      this._initializing = value !== null && value.status === 'initializing';
       if (value === null) {
         this._cpuPowerUsageAvailable = false;
         this._gpuPowerUsageAvailable = false;
@@ -200,41 +248,43 @@ export namespace PowerUsage {
         return;
       }
 
-      const cpuUsage = value.cpu ? value.cpu.usage : null;
+      // Usage of selected scope is only available when server reports all
+      // scopes. Otherwise usage of the scope configured on server is shown
+      const scopeValue =
+        this._scope && value.scopes ? value.scopes[this._scope] : undefined;
+      const cpuUsage = value.cpu
+        ? scopeValue && scopeValue.cpu
+          ? scopeValue.cpu.usage
+          : value.cpu.usage
+        : null;
       const cpuLimit = value.cpu ? value.cpu.limit : null;
       this._cpuPowerUsageAvailable = cpuUsage ? true : false;
 
       this._currentCpuPowerUsage = cpuUsage;
       this._currentCpuPowerLimit = cpuLimit;
 
-      const gpuUsage = value.gpu ? value.gpu.usage : null;
+      const gpuUsage = value.gpu
+        ? scopeValue && scopeValue.gpu
+          ? scopeValue.gpu.usage
+          : value.gpu.usage
+        : null;
       const gpuLimit = value.gpu ? value.gpu.limit : null;
       this._gpuPowerUsageAvailable = gpuUsage ? true : false;
 
       this._currentGpuPowerUsage = gpuUsage;
       this._currentGpuPowerLimit = gpuLimit;
 
-      const { emissionFactorAvailable, currentEmissionFactor } =
-        this._emissionModel;
-      this._lastEmissionFactor = emissionFactorAvailable
-        ? currentEmissionFactor
-        : this._lastEmissionFactor;
-      this._emissionsAvailable = this._lastEmissionFactor !== null;
-
-      if (this._emissionsAvailable) {
-        // Current emissions is currentEmissionFactor (mg/Ws) * currentCpuPower (W) * period (ms) / 1000
-        const currentPeriod = Date.now() - this._lastEmissionReading;
-        const powerUsage = (cpuUsage || 0) + (gpuUsage || 0);
-        const currentEmissions =
-          (this._lastEmissionFactor * powerUsage * currentPeriod) / 1000;
-        this._lastEmissionReading = Date.now();
-        const currentTotalEmissions = this._totalEmissions + currentEmissions;
-        const [readableCurrentTotalEmissions, units] = convertToLargestUnit(
-          currentTotalEmissions
-        );
-        this._currentEmissions = readableCurrentTotalEmissions;
-        this._emissionsUnits = units;
-        this._totalEmissions = currentTotalEmissions;
+      if (value.emissions && value.emissions.configured) {
+        // Emissions are integrated on the server even when no tab is visible.
+        // Browser settings are used when server only has a static factor
+        const scopeEmissions =
+          this._scope && this._scope in value.emissions.scopes
+            ? value.emissions.scopes[this._scope]
+            : value.emissions.total;
+        this._emissionsAvailable = true;
+        this._setTotalEmissions(scopeEmissions * 1000);
+      } else {
+        this._integrateEmissions((cpuUsage || 0) + (gpuUsage || 0));
       }
 
       const cpuPowerShare = this._currentCpuPowerLimit
@@ -254,6 +304,44 @@ export namespace PowerUsage {
       this.stateChanged.emit(void 0);
     }
 
+    /**
+     * Integrate emissions in the browser for servers that do not report them.
+     *
+     * @param powerUsage The current power usage in W.
+     */
+    private _integrateEmissions(powerUsage: number): void {
+      const { emissionFactorAvailable, currentEmissionFactor } =
+        this._emissionModel;
+      this._lastEmissionFactor = emissionFactorAvailable
+        ? currentEmissionFactor
+        : this._lastEmissionFactor;
+      this._emissionsAvailable = this._lastEmissionFactor !== null;
+
+      if (this._emissionsAvailable) {
+        // Current emissions is currentEmissionFactor (mg/Ws) * currentCpuPower (W) * period (ms) / 1000
+        const currentPeriod = Date.now() - this._lastEmissionReading;
+        const currentEmissions =
+          (this._lastEmissionFactor * powerUsage * currentPeriod) / 1000;
+        this._lastEmissionReading = Date.now();
+        this._setTotalEmissions(this._totalEmissions + currentEmissions);
+      }
+    }
+
+    /**
+     * Set total emissions and their readable value.
+     *
+     * @param totalEmissions The total emissions in mg.
+     */
+    private _setTotalEmissions(totalEmissions: number): void {
+      const [readableCurrentTotalEmissions, units] =
+        convertToLargestUnit(totalEmissions);
+      this._currentEmissions = readableCurrentTotalEmissions;
+      this._emissionsUnits = units;
+      this._totalEmissions = totalEmissions;
+    }
+
+    private _scope: string;
+    private _initializing = false;
     private _cpuPowerUsageAvailable = false;
     private _gpuPowerUsageAvailable = false;
     private _emissionsAvailable = false;
@@ -269,6 +357,8 @@ export namespace PowerUsage {
     private _emissionModel: EmissionFactor.Model;
     private _poll: Poll<Private.IPowerUsageResult | null>;
     private _values: Model.IMetricValue[] = [];
+    private _stream: EventSource | null = null;
+    private _streamPayload: Private.IPowerUsageResult = {};
   }
 
   /**
@@ -284,6 +374,12 @@ export namespace PowerUsage {
        */
       refreshRate: number;
 
+      /**
+       * The measurement scope to show. Defaults to the scope configured on
+       * the server.
+       */
+      scope?: string;
+
       /**
        * When the model stops polling the API. Defaults to `when-hidden`.
        */
@@ -509,7 +605,24 @@ namespace Private {
    */
   const METRIC_URL = URLExt.join(
     SERVER_CONNECTION_SETTINGS.baseUrl,
-    'api/metrics/v1/power_usage'
+    'api/metrics/v1/power_usage/snapshot'
+  );
+
+  /**
+   * ETag and payload of the last snapshot returned by the server.
+   */
+  let lastEtag: string | null = null;
+  let lastPayload: IPowerUsageResult | null = null;
+
+  /**
+   * The url endpoint for power usage stream pushed by the server.
+   */
+  export const STREAM_URL = URLExt.join(
+    SERVER_CONNECTION_SETTINGS.baseUrl,
+    'api/metrics/v1/power_usage/stream',
+    SERVER_CONNECTION_SETTINGS.token
+      ? URLExt.objectToQueryString({ token: SERVER_CONNECTION_SETTINGS.token })
+      : ''
   );
 
   /**
@@ -521,6 +634,7 @@ namespace Private {
    * The shape of a response from the power usage server extension.
    */
   export interface IPowerUsageResult {
+    status?: 'initializing';
     cpu?: {
       usage: number;
       limit: number;
@@ -529,22 +643,84 @@ namespace Private {
       usage: number;
       limit: number;
     };
+    scopes?: {
+      [scope: string]: {
+        cpu?: {
+          usage: number;
+          dram: number;
+        };
+        gpu?: {
+          usage: number;
+        };
+      };
+    };
+    emissions?: {
+      intensity: number;
+      source: 'emaps' | 'table' | 'static';
+      configured: boolean;
+      total: number;
+      scopes: { [scope: string]: number };
+    };
+  }
+
+  /**
+   * The shape of a frame pushed by the power usage stream. Delta frames
+   * contain only the values that changed since previous frame.
+   */
+  export interface IPowerUsageFrame {
+    seq: number;
+    full: boolean;
+    data: IPowerUsageResult;
   }
 
   /**
-   * Make a request to the backend.
+   * Merge a delta frame into current payload. Keys that are null in delta
+   * have been removed from payload.
+   */
+  export const mergePayload = (
+    current: { [key: string]: any },
+    delta: { [key: string]: any }
+  ): any => {
+    const merged = { ...current };
+    for (const key of Object.keys(delta)) {
+      const value = delta[key];
+      if (value === null) {
+        delete merged[key];
+      } else {
+        merged[key] =
+          typeof value === 'object' && !Array.isArray(value)
+            ? mergePayload(current[key] || {}, value)
+            : value;
+      }
+    }
+    return merged;
+  };
+
+  /**
+   * Make a request to the backend. The server answers with 304 when there
+   * is no new reading since last snapshot and the last payload is reused.
    */
   export const powerUsageFactory =
     async (): Promise<IPowerUsageResult | null> => {
+      const headers: HeadersInit = new Headers();
+      if (lastEtag) {
+        headers.set('If-None-Match', lastEtag);
+      }
       const request = ServerConnection.makeRequest(
         METRIC_URL,
-        {},
+        { headers },
         SERVER_CONNECTION_SETTINGS
       );
       const response = await request;
 
+      if (response.status === 304) {
+        return lastPayload;
+      }
+
       if (response.ok) {
-        return await response.json();
+        lastEtag = response.headers.get('Etag');
+        lastPayload = await response.json();
+        return lastPayload;
       }
 
       return null;